@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+
+"""
+Times the duplicate-reference check (ReferenceIndex) on made up titles and
+DOI's of growing numbers of entries, and compares what it finds with
+comparing every pair of titles on the first few thousand of them. About 1%
+of the entries repeat an earlier title, some with one of its words changed,
+and some repeat an earlier DOI.
+
+    python benchmarks/bench_duplicates.py [entries,...] [pairwise entries]
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from biblatex_check import (
+    ReferenceIndex,
+    minTitleWords,
+    normalizeTitle,
+    similarTitleThreshold,
+)
+from synthetic import syntheticEntries
+
+
+def syntheticReferences(entryCount):
+    # (id, line number, title, doi) tuples, without duplicate ID's as
+    # ReferenceIndex leaves those to non-unique-id
+    references = []
+    for i, (entryType, entryId, fields, closed) in enumerate(
+        syntheticEntries(entryCount, duplicateIds=0)
+    ):
+        values = dict((fieldName, value) for fieldName, value, comma in fields)
+        references.append(
+            (entryId, i * 6, values.get("title", ""), values.get("doi", ""))
+        )
+    return references
+
+
+def indexedDuplicates(references):
+    referenceIndex = ReferenceIndex()
+    return set(
+        reference[0]
+        for reference in references
+        if referenceIndex.add(reference[0], reference[1], reference[2]) is not None
+    )
+
+
+def pairwiseDuplicates(references):
+    duplicates = set()
+    earlierTitles = []
+    for entryId, lineNumber, title, doi in references:
+        words = normalizeTitle(title)
+        if len(words) < minTitleWords:
+            continue
+        words = set(words)
+        for earlierWords in earlierTitles:
+            if len(words & earlierWords) >= similarTitleThreshold * len(
+                words | earlierWords
+            ):
+                duplicates.add(entryId)
+                break
+        earlierTitles.append(words)
+    return duplicates
+
+
+def main():
+    sizes = sys.argv[1] if len(sys.argv) > 1 else "10000,100000"
+    sizes = [int(size) for size in sizes.split(",")]
+    pairwiseCount = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+
+    for entryCount in sizes:
+        references = syntheticReferences(entryCount)
+        referenceIndex = ReferenceIndex()
+        started = time.time()
+        found = 0
+        for reference in references:
+            if referenceIndex.add(*reference) is not None:
+                found += 1
+        elapsed = time.time() - started
+        print(
+            "{:>9} entries {:.3f}s  {:.2f} us/entry  ({} duplicates)".format(
+                entryCount, elapsed, elapsed / entryCount * 1e6, found
+            )
+        )
+
+    # titles only, the index has to find the same similar titles as
+    # comparing every pair does
+    references = syntheticReferences(pairwiseCount)
+    started = time.time()
+    expected = pairwiseDuplicates(references)
+    elapsed = time.time() - started
+    found = indexedDuplicates(references)
+    print(
+        "{:>9} entries pairwise {:.3f}s, {} of {} similar titles found".format(
+            pairwiseCount, elapsed, len(found & expected), len(expected)
+        )
+    )
+    assert found == expected
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+
+"""
+Compares checking one large synthetic bib file serially and split across
+worker processes (--jobs), and makes sure both report the same problems.
+
+    python benchmarks/bench_parallel.py [entries] [jobs]
+"""
+
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import biblatex_check
+from synthetic import writeSyntheticBib
+
+
+def problems(result):
+    return [
+        (entry.lineNumber, entry.id, problem)
+        for entry in result.entries
+        for problem in entry.problems
+    ]
+
+
+def main():
+    entryCount = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    jobs = int(sys.argv[2]) if len(sys.argv) > 2 else multiprocessing.cpu_count()
+
+    fd, bibFile = tempfile.mkstemp(suffix=".bib")
+    try:
+        with os.fdopen(fd, "w") as fOut:
+            writeSyntheticBib(fOut, entryCount)
+        print("{} entries, {:.1f} MB".format(entryCount, os.path.getsize(bibFile) / 1e6))
+
+        job = (bibFile, None, biblatex_check.CheckOptions())
+
+        start = time.time()
+        serial = biblatex_check.runCheckJob(job)
+        serialTime = time.time() - start
+        print("serial:    {:.2f}s".format(serialTime))
+
+        start = time.time()
+        parallel = biblatex_check.runParallelCheckJob(job, jobs)
+        parallelTime = time.time() - start
+        print("{} jobs:    {:.2f}s ({:.2f}x)".format(jobs, parallelTime, serialTime / parallelTime))
+
+        assert problems(serial) == problems(parallel), "parallel problems differ"
+        assert serial.problemCount == parallel.problemCount
+        print("{} problems, identical".format(serial.problemCount))
+    finally:
+        os.remove(bibFile)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+"""
+Compares the tokenizer (iterBibBlocks + parseBibEntries) with the line
+prefix dispatch it replaced, which classified lines with startswith("@") /
+startswith("}") and split field lines on "=" twice. Both run on the same
+synthetic bib file; the fastest of a few repeats is reported.
+
+Given a git revision, the full check is also timed with biblatex_check.py
+as it was in that revision (from runCheckJob on, i.e. after batch mode).
+
+    python benchmarks/bench_parser.py [entries] [repeats] [revision]
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import types
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import biblatex_check
+from synthetic import writeSyntheticBib
+
+
+def legacyLineDispatch(fIn):
+    # The parse work of the old main loop, without the checks
+    entries = 0
+    for line in fIn:
+        line = line.strip("\n")
+        if line.startswith("@"):
+            line.split("{")[1].rstrip(",\n")
+            line.split("{")[0].strip("@ ")
+        elif line.startswith("}"):
+            entries += 1
+        elif "=" in line:
+            line.split("=")[0].strip().lower()
+            line.split("=")[1].strip(", \n").strip("{} \n")
+    return entries
+
+
+def tokenizer(fIn):
+    entries = 0
+    for blockLineNumber, blockText in biblatex_check.iterBibBlocks(fIn):
+        for bibEntry in biblatex_check.parseBibEntries(blockText, blockLineNumber):
+            for fieldName, fieldValue, comma in bibEntry.fields:
+                fieldName.lower()
+            entries += 1
+    return entries
+
+
+def fullCheck(fIn, module=biblatex_check):
+    result = module.runCheckJob((fIn.name, None, module.CheckOptions()))
+    return len(result.entries)
+
+
+def loadRevision(revision):
+    # biblatex_check as it was in a git revision
+    repository = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+    source = subprocess.check_output(
+        ["git", "show", revision + ":biblatex_check.py"], cwd=repository
+    )
+    module = types.ModuleType("biblatex_check_" + revision)
+    exec(compile(source, "biblatex_check.py@" + revision, "exec"), module.__dict__)
+    return module
+
+
+def timeIt(function, bibFile, repeats):
+    best = None
+    for i in range(repeats):
+        fIn = open(bibFile)
+        start = time.time()
+        entries = function(fIn)
+        elapsed = time.time() - start
+        fIn.close()
+        best = elapsed if best is None else min(best, elapsed)
+    return best, entries
+
+
+def main():
+    entryCount = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    revision = sys.argv[3] if len(sys.argv) > 3 else None
+
+    fd, bibFile = tempfile.mkstemp(suffix=".bib")
+    try:
+        with os.fdopen(fd, "w") as fOut:
+            writeSyntheticBib(fOut, entryCount)
+        print("{} entries, {:.1f} MB".format(entryCount, os.path.getsize(bibFile) / 1e6))
+
+        benchmarks = [
+            ("line dispatch", legacyLineDispatch),
+            ("tokenizer", tokenizer),
+            ("full check", fullCheck),
+        ]
+        if revision:
+            baseline = loadRevision(revision)
+            benchmarks.append(
+                ("at " + revision, lambda fIn: fullCheck(fIn, baseline))
+            )
+
+        for name, function in benchmarks:
+            elapsed, entries = timeIt(function, bibFile, repeats)
+            print(
+                "{:14} {:.2f}s  {:.2f} us/entry  ({} entries)".format(
+                    name, elapsed, elapsed / entries * 1e6, entries
+                )
+            )
+    finally:
+        os.remove(bibFile)
+
+
+if __name__ == "__main__":
+    main()
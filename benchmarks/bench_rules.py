@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+
+"""
+Times the required field check per entry: the compiled rule table
+(requiredFieldRules) against resolving the type aliases, splitting
+"author/editor" and mapping the field aliases for every entry, as the
+check did before. Entries of every known type are made up with some of
+their fields missing; the fastest of a few repeats is reported.
+
+    python benchmarks/bench_rules.py [entries] [repeats]
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from biblatex_check import (
+    fieldAliases,
+    requiredEntryFields,
+    requiredFieldRules,
+    resolveAliasedRequiredFields,
+    unknownTypeRules,
+)
+from synthetic import syntheticEntries
+
+
+def requiredFieldEntries(entryCount):
+    # (type, field names) pairs, each required field kept with 90% chance
+    return [
+        (entryType, [fieldName for fieldName, value, comma in fields])
+        for entryType, entryId, fields, closed in syntheticEntries(
+            entryCount, missingFields=0.1
+        )
+    ]
+
+
+def aliasedRequiredFields(entries):
+    problems = 0
+    for entryType, entryFields in entries:
+        # Support for type aliases
+        entryFields = list(
+            map(
+                lambda typeName: fieldAliases.get(typeName)
+                if typeName in fieldAliases
+                else typeName,
+                entryFields,
+            )
+        )
+        entryRequiredFields = resolveAliasedRequiredFields(
+            requiredEntryFields.get(entryType), requiredEntryFields
+        )
+        for requiredEntryField in entryRequiredFields:
+            # support for author/editor syntax
+            requiredEntryField = requiredEntryField.split("/")
+            if set(requiredEntryField).isdisjoint(entryFields):
+                "missing field '" + "/".join(requiredEntryField) + "'"
+                problems += 1
+    return problems
+
+
+def compiledRequiredFields(entries):
+    problems = 0
+    for entryType, entryFields in entries:
+        entryRules = requiredFieldRules.get(entryType)
+        if entryRules is None:
+            entryRules = unknownTypeRules
+        for requiredEntryField, fieldNames in entryRules:
+            if fieldNames.isdisjoint(entryFields):
+                "missing field '" + requiredEntryField + "'"
+                problems += 1
+    return problems
+
+
+def timeIt(function, entries, repeats):
+    best = None
+    for i in range(repeats):
+        started = time.time()
+        problems = function(entries)
+        elapsed = time.time() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, problems
+
+
+def main():
+    entryCount = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    entries = requiredFieldEntries(entryCount)
+
+    results = []
+    for name, function in (
+        ("aliases per entry", aliasedRequiredFields),
+        ("compiled rules", compiledRequiredFields),
+    ):
+        elapsed, problems = timeIt(function, entries, repeats)
+        results.append(problems)
+        print(
+            "{:<18} {:.3f}s  {:.2f} us/entry  ({} missing fields)".format(
+                name, elapsed, elapsed / entryCount * 1e6, problems
+            )
+        )
+
+    # both have to find the same problems
+    assert results[0] == results[1]
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+
+"""
+Benchmark suite: generates synthetic bibliographies of several sizes and
+times parsing, checking and reporting on each of them separately, with the
+peak RSS of every phase. Each phase runs in a fresh process so its peak RSS
+is its own; the fastest of a few repeats is reported.
+
+The entries are made up by benchmarks/synthetic.py: of every type in
+requiredEntryFields, with some required fields missing, a fraction of
+duplicate ID's, missing commas and entries without their closing brace, and
+author lists of up to --max-authors names (most have a few, some very many).
+
+Results can be saved as JSON and compared against such a file, e.g. one
+saved before a change; phases that got slower by more than --tolerance are
+flagged and make the exit code 1.
+
+    python benchmarks/bench_suite.py --sizes 1k,10k,100k --save baseline.json
+    python benchmarks/bench_suite.py --sizes 1k,10k,100k --baseline baseline.json
+    python benchmarks/bench_suite.py --sizes 1M --repeats 1
+"""
+
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import biblatex_check
+from synthetic import parseSize, writeSyntheticBib
+
+phases = ("parse", "check", "report")
+
+
+def peakRssMB():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024.0 * 1024.0 if sys.platform == "darwin" else 1024.0)
+
+
+def runParse(bibFile):
+    fIn = io.open(bibFile, "r", encoding="utf8")
+    for blockLineNumber, blockText in biblatex_check.iterBibBlocks(fIn):
+        for bibEntry in biblatex_check.parseBibEntries(blockText, blockLineNumber):
+            for fieldName, fieldValue, comma in bibEntry.fields:
+                fieldName.lower()
+    fIn.close()
+    return None
+
+
+def runCheck(bibFile):
+    biblatex_check.runCheckJob(
+        (bibFile, None, biblatex_check.CheckOptions()), lambda result, entry: None
+    )
+    return None
+
+
+def runReport(bibFile):
+    # Check and report as the command line does, only the report is timed
+    outputDir = tempfile.mkdtemp()
+    htmlReport = biblatex_check.HTMLReport(os.path.join(outputDir, "report.html"))
+    jsonReport = biblatex_check.JSONLinesReport(os.path.join(outputDir, "report.jsonl"))
+    elapsed = [0.0]
+
+    def reportEntry(result, entry):
+        start = time.time()
+        htmlReport.addEntry(entry)
+        jsonReport.addEntry(entry)
+        elapsed[0] += time.time() - start
+
+    result = biblatex_check.runCheckJob(
+        (bibFile, None, biblatex_check.CheckOptions()), reportEntry
+    )
+    start = time.time()
+    htmlReport.close(result)
+    jsonReport.close(result)
+    elapsed[0] += time.time() - start
+
+    for name in os.listdir(outputDir):
+        os.remove(os.path.join(outputDir, name))
+    os.rmdir(outputDir)
+    return elapsed[0]
+
+
+phaseFunctions = {"parse": runParse, "check": runCheck, "report": runReport}
+
+
+def runPhase(phase, bibFile, repeats):
+    # In the child process, prints {"seconds": ..., "peakRssMB": ...}
+    best = None
+    for i in range(repeats):
+        start = time.time()
+        elapsed = phaseFunctions[phase](bibFile)
+        if elapsed is None:
+            elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print(json.dumps({"seconds": best, "peakRssMB": peakRssMB()}))
+
+
+def measurePhase(phase, bibFile, repeats):
+    output = subprocess.check_output(
+        [
+            sys.executable,
+            os.path.abspath(__file__),
+            "--phase",
+            phase,
+            "--input",
+            bibFile,
+            "--repeats",
+            str(repeats),
+        ]
+    )
+    return json.loads(output.decode("utf8").strip().splitlines()[-1])
+
+
+def compareResults(results, baseline, tolerance):
+    # Prints the change against the baseline, returns the slower phases
+    baselineTimes = dict(
+        ((measured["entries"], measured["phase"]), measured)
+        for measured in baseline["results"]
+    )
+    regressions = []
+    print("")
+    print("compared with {}".format(baseline.get("created", "the baseline")))
+    for measured in results:
+        key = (measured["entries"], measured["phase"])
+        before = baselineTimes.get(key)
+        if before is None:
+            continue
+        change = measured["seconds"] / before["seconds"] - 1 if before["seconds"] else 0
+        flag = ""
+        if change > tolerance:
+            flag = "  SLOWER"
+            regressions.append(key)
+        rssChange = ""
+        if measured["peakRssMB"] and before.get("peakRssMB"):
+            rssChange = "  rss {:+.0%}".format(
+                measured["peakRssMB"] / before["peakRssMB"] - 1
+            )
+        print(
+            "{:>9} {:<7} {:+.1%}{}{}".format(key[0], key[1], change, rssChange, flag)
+        )
+    return regressions
+
+
+def main():
+    parser = OptionParser(
+        "usage: %prog [--sizes 1k,10k,100k] [--save file.json] [--baseline file.json]"
+    )
+    parser.add_option("--sizes", default="1k,10k,100k", help="Entries per file")
+    parser.add_option("--repeats", type="int", default=3)
+    parser.add_option("--duplicates", type="float", default=0.01)
+    parser.add_option("--missing-commas", dest="missingCommas", type="float", default=0.02)
+    parser.add_option(
+        "--unbalanced-braces", dest="unbalancedBraces", type="float", default=0.0
+    )
+    parser.add_option("--max-authors", dest="maxAuthors", type="int", default=40)
+    parser.add_option("--phases", default=",".join(phases))
+    parser.add_option("--save", help="Write the results to this JSON file")
+    parser.add_option("--baseline", help="Compare with results saved by --save")
+    parser.add_option(
+        "--tolerance",
+        type="float",
+        default=0.1,
+        help="Flag phases more than this much slower than the baseline",
+    )
+    # used for the child processes
+    parser.add_option("--phase")
+    parser.add_option("--input")
+    (options, args) = parser.parse_args()
+
+    if options.phase:
+        runPhase(options.phase, options.input, options.repeats)
+        return 0
+
+    settings = {
+        "duplicates": options.duplicates,
+        "missingCommas": options.missingCommas,
+        "unbalancedBraces": options.unbalancedBraces,
+        "maxAuthors": options.maxAuthors,
+        "repeats": options.repeats,
+    }
+    results = []
+    print(
+        "{:>9} {:<7} {:>9} {:>12} {:>9}".format(
+            "entries", "phase", "seconds", "us/entry", "peak MB"
+        )
+    )
+    for size in options.sizes.split(","):
+        entryCount = parseSize(size)
+        fd, bibFile = tempfile.mkstemp(suffix=".bib")
+        try:
+            fOut = os.fdopen(fd, "w")
+            writeSyntheticBib(
+                fOut,
+                entryCount,
+                duplicateIds=options.duplicates,
+                missingCommas=options.missingCommas,
+                unbalancedBraces=options.unbalancedBraces,
+                maxAuthors=options.maxAuthors,
+            )
+            fOut.close()
+            fileSize = os.path.getsize(bibFile)
+
+            for phase in options.phases.split(","):
+                measured = measurePhase(phase, bibFile, options.repeats)
+                measured.update({"entries": entryCount, "bytes": fileSize, "phase": phase})
+                results.append(measured)
+                print(
+                    "{:>9} {:<7} {:>9.3f} {:>12.2f} {:>9}".format(
+                        entryCount,
+                        phase,
+                        measured["seconds"],
+                        measured["seconds"] / entryCount * 1e6,
+                        "-"
+                        if measured["peakRssMB"] is None
+                        else "{:.0f}".format(measured["peakRssMB"]),
+                    )
+                )
+        finally:
+            os.remove(bibFile)
+
+    run = {
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.platform(),
+        "settings": settings,
+        "results": results,
+    }
+    if options.save:
+        fOut = open(options.save, "w")
+        json.dump(run, fOut, indent=2, sort_keys=True)
+        fOut.close()
+
+    if options.baseline:
+        fIn = open(options.baseline)
+        baseline = json.load(fIn)
+        fIn.close()
+        if baseline.get("settings") != settings:
+            print("WARNING: the baseline was generated with other settings")
+        if compareResults(results, baseline, options.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,139 @@
+"""
+Synthetic bibliographies shared by the benchmarks. Entries are of every type
+in requiredEntryFields with some required fields missing, and, as in real
+exports, a fraction of duplicate ID's, titles and DOI's, missing commas,
+entries left without their closing brace and author lists of up to
+maxAuthors names (most have a few, some very many). The same seed gives the
+same entries.
+
+    from synthetic import syntheticEntries, writeSyntheticBib
+"""
+
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import biblatex_check
+
+firstNames = ["Jane", "Richard", "Ada", "Alan", "Grace", "Edsger", "Barbara", "Donald"]
+lastNames = ["Doe", "Roe", "Lovelace", "Turing", "Hopper", "Dijkstra", "Liskov", "Knuth"]
+# enough words for titles to only be similar when one repeats another
+titleWords = ["word" + str(i) for i in range(20000)]
+extraFields = ["doi", "pages", "note", "keywords", "publisher", "abstract"]
+# earlier titles kept to be repeated, a random sample once there are more
+maxRepeatedTitles = 10000
+
+
+def parseSize(size):
+    # 1000, 10k or 1M
+    multiplier = {"k": 1000, "m": 1000000}.get(size[-1:].lower())
+    if multiplier:
+        return int(float(size[:-1]) * multiplier)
+    return int(size)
+
+
+def generateAuthors(rng, maxAuthors):
+    # most entries have a few authors, some have very many
+    count = max(1, min(maxAuthors, int(rng.paretovariate(1.2))))
+    authors = []
+    for i in range(count):
+        first, last = rng.choice(firstNames), rng.choice(lastNames)
+        if rng.random() < 0.7:
+            authors.append(last + str(i) + ", " + first)
+        else:
+            authors.append(first + " " + last + str(i))
+    return " and ".join(authors)
+
+
+def generateTitle(rng, titles, duplicateTitles):
+    # A title of its own, or an earlier one repeated, some with a word changed
+    if titles and rng.random() < duplicateTitles:
+        words = list(rng.choice(titles))
+        if len(words) >= 10:
+            words[rng.randrange(len(words))] = "changed"
+    else:
+        words = [rng.choice(titleWords) for j in range(rng.randint(5, 14))]
+    if len(titles) < maxRepeatedTitles:
+        titles.append(words)
+    else:
+        titles[rng.randrange(maxRepeatedTitles)] = words
+    return " ".join(words).capitalize()
+
+
+def generateFieldValue(rng, fieldName, i, maxAuthors, duplicateDois):
+    if fieldName in ("author", "editor"):
+        return generateAuthors(rng, maxAuthors)
+    if fieldName in ("year", "date"):
+        return str(1950 + i % 70)
+    if fieldName in ("journal", "journaltitle"):
+        return "J. of Things" if rng.random() < 0.05 else "Journal of Things"
+    if fieldName == "pages":
+        return str(i % 300) + "--" + str(i % 300 + 12)
+    if fieldName == "url":
+        return "https://example.org/" + str(i)
+    if fieldName == "doi":
+        doiNumber = rng.randrange(i + 1) if rng.random() < duplicateDois else i
+        return "10.1000/" + str(doiNumber)
+    return "Some " + fieldName + " " + str(i % 1000)
+
+
+def syntheticEntries(
+    entryCount,
+    duplicateIds=0.01,
+    duplicateTitles=0.01,
+    duplicateDois=0.01,
+    missingFields=0.05,
+    missingCommas=0.02,
+    unbalancedBraces=0.0,
+    maxAuthors=40,
+    seed=0,
+):
+    # Yields (type, id, [(field name, value, comma), ...], closed) for each
+    # entry, the fields as parseBibEntries gives them. The rates are the
+    # fraction of entries with an ID or title used before, of DOI's used
+    # before, of required fields left out, of commas left out between
+    # fields, and of entries without their closing brace.
+    rng = random.Random(seed)
+    entryTypes = sorted(biblatex_check.requiredEntryFields)
+    titles = []
+    for i in range(entryCount):
+        entryType = rng.choice(entryTypes)
+        if i and rng.random() < duplicateIds:
+            entryId = "key" + str(rng.randrange(i))
+        else:
+            entryId = "key" + str(i)
+
+        fieldNames = []
+        for requiredEntryField in biblatex_check.resolveAliasedRequiredFields(
+            biblatex_check.requiredEntryFields[entryType],
+            biblatex_check.requiredEntryFields,
+        ):
+            if rng.random() >= missingFields:
+                fieldNames.append(rng.choice(requiredEntryField.split("/")))
+        fieldNames.extend(rng.sample(extraFields, rng.randint(0, 3)))
+        rng.shuffle(fieldNames)
+
+        fields = []
+        for position, fieldName in enumerate(fieldNames):
+            if fieldName == "title":
+                value = generateTitle(rng, titles, duplicateTitles)
+            else:
+                value = generateFieldValue(
+                    rng, fieldName, i, maxAuthors, duplicateDois
+                )
+            comma = ","
+            if position < len(fieldNames) - 1 and rng.random() < missingCommas:
+                comma = ""
+            fields.append((fieldName, value, comma))
+        yield entryType, entryId, fields, rng.random() >= unbalancedBraces
+
+
+def writeSyntheticBib(fOut, entryCount, **knobs):
+    # Writes syntheticEntries(entryCount, **knobs) as a bib file
+    for entryType, entryId, fields, closed in syntheticEntries(entryCount, **knobs):
+        fOut.write("@" + entryType + "{" + entryId + ",\n")
+        for fieldName, value, comma in fields:
+            fOut.write("  " + fieldName + " = {" + value + "}" + comma + "\n")
+        fOut.write("}\n\n" if closed else "\n")
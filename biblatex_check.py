@@ -55,6 +55,18 @@ requiredEntryFields = {
     "report": ["author", "title", "type", "institution", "year/date"],
     "thesis": ["author", "title", "type", "institution", "year/date"],
     "unpublished": ["author", "title", "year/date"],
+    "dataset": "misc",
+    "software": "misc",
+    # data-only types, their fields are inherited by the entries using them
+    "set": [],
+    "xdata": [],
+    # custom types have no required fields
+    "customa": [],
+    "customb": [],
+    "customc": [],
+    "customd": [],
+    "custome": [],
+    "customf": [],
     # semi aliases (differing fields)
     "mastersthesis": ["author", "title", "institution", "year/date"],
     "techreport": ["author", "title", "institution", "year/date"],
@@ -71,55 +83,25 @@ fieldAliases = {"school": "institution", "address": "location"}
 
 ####################################################################
 
+import bisect
+import collections
+import glob
+import hashlib
+import io
+import itertools
+import json
+import math
+import operator
+import os
 import string
 import re
+import subprocess
 import sys
+import threading
+import time
+import zlib
 from optparse import OptionParser
-
-### Parse Args ###
-
-usage = (
-    sys.argv[0]
-    + " [-b|--bib=<input.bib>] [-a|--aux=<input.aux>] [-o|--output=<output.html>] [-v|--view] [-h|--help]"
-)
-
-parser = OptionParser(usage)
-
-parser.add_option(
-    "-b",
-    "--bib",
-    dest="bibFile",
-    help="Bib File",
-    metavar="input.bib",
-    default="input.bib",
-)
-
-parser.add_option(
-    "-a",
-    "--aux",
-    dest="auxFile",
-    help="Aux File",
-    metavar="input.aux",
-    default="references.aux",
-)
-
-parser.add_option(
-    "-o", "--output", dest="htmlOutput", help="HTML Output File", metavar="output.html"
-)
-
-parser.add_option(
-    "-v", "--view", dest="view", action="store_true", help="Open in Browser"
-)
-
-parser.add_option(
-    "-N",
-    "--no-console",
-    dest="no_console",
-    action="store_true",
-    help="Do not print problems to console",
-)
-
-(options, args) = parser.parse_args()
+from xml.sax.saxutils import escape, quoteattr
 
 ### Backport Python 3 open(encoding="utf-8") to Python 2 ###
 # based on http://stackoverflow.com/questions/10971033/backporting-python-3-openencoding-utf-8-to-python-2
@@ -160,50 +142,6 @@ else:
         )
 
 
-### Handle Args ###
-
-print("INFO: Reading references from '" + options.bibFile + "'")
-try:
-    fIn = open(options.bibFile, "r", encoding="utf8")
-except IOError as e:
-    print(
-        "ERROR: Input bib file '"
-        + options.bibFile
-        + "' doesn't exist or is not readable"
-    )
-    sys.exit(-1)
-
-if options.no_console:
-    print("INFO: Will suppress problems on console")
-
-if options.htmlOutput:
-    print(
-        "INFO: Will output HTML to '"
-        + options.htmlOutput
-        + "'"
-        + (" and auto open in the default web browser" if options.view else "")
-    )
-
-# Filter by reference ID's that are used
-usedIds = set()
-if options.auxFile:
-    print("INFO: Filtering by references found in '" + options.auxFile + "'")
-    try:
-        fInAux = open(options.auxFile, "r", encoding="utf8")
-        for auxLine in fInAux:
-            if auxLine.startswith("\\citation"):
-                entryIds = auxLine.split("{")[1].rstrip("} \n").split(", ")
-                for entryId in entryIds:
-                    if entryId != "":
-                        usedIds.add(entryId)
-        fInAux.close()
-    except IOError as e:
-        print(
-            "WARNING: Aux file '"
-            + options.auxFile
-            + "' doesn't exist -> not restricting entries"
-        )
-
 ### Methods ###
 
 removePunctuationMap = dict((ord(char), None) for char in string.punctuation)
@@ -217,285 +155,2788 @@ def resolveAliasedRequiredFields(entryRequiredFields, requiredFieldsDict):
     return entryRequiredFields
 
 
-def generateEntryProblemsHTML(
-    itemHTML, itemId, type, articleId, title, problems, author, lineNumber
-):
-    cleanedTitle = title.translate(removePunctuationMap)
-    html = "<div id='" + itemId + "' class='problem severe" + str(len(problems)) + "'>"
-    html += "<h2>" + itemId + " (" + type + ")</h2> "
-    html += "<div class='links'>"
-    if citeulikeUsername:
-        html += (
-            "<a href='"
-            + citeulikeHref
-            + articleId
-            + "' target='_blank'>CiteULike</a> |"
-        )
+def compileRequiredFields(requiredFieldsDict, fieldAliasesDict):
+    # Entry type -> ((required field, frozenset of fields that satisfy it), ...)
+    # with type aliases resolved, "author/editor" split and the field aliases
+    # added, so an entry is checked with a lookup and a few isdisjoint calls
+    aliasesOf = {}
+    for alias, fieldName in fieldAliasesDict.items():
+        aliasesOf.setdefault(fieldName, []).append(alias)
+
+    rules = {}
+    for entryType, entryRequiredFields in requiredFieldsDict.items():
+        entryRules = []
+        for requiredEntryField in resolveAliasedRequiredFields(
+            entryRequiredFields, requiredFieldsDict
+        ):
+            # support for author/editor syntax
+            fieldNames = set(requiredEntryField.split("/"))
+            for fieldName in list(fieldNames):
+                fieldNames.update(aliasesOf.get(fieldName, ()))
+            entryRules.append((requiredEntryField, frozenset(fieldNames)))
+        rules[entryType] = tuple(entryRules)
+    return rules
+
+
+# compiled from requiredEntryFields and fieldAliases, recompile after changing them
+requiredFieldRules = compileRequiredFields(requiredEntryFields, fieldAliases)
+# biblatex checks entries of unknown types as misc
+unknownTypeRules = requiredFieldRules["misc"]
+
+
+# \citation{a,b}, biblatex's \abx@aux@cite{refsection}{a} and \@input{b.aux}
+# of the aux files of \include'd chapters
+auxCommandPattern = re.compile(r"\\(citation|abx@aux@cite|@input)((?:\{[^{}]*\})+)")
+# the citations biber is asked for
+bcfCitekeyPattern = re.compile(r"<bcf:citekey\b[^>]*>([^<]*)</bcf:citekey>")
+
+
+def splitAuxFiles(auxFile):
+    # Several aux (or bcf) files are separated by ","
+    return [fileName for fileName in auxFile.split(",") if fileName]
+
+
+def loadUsedIds(auxFile):
+    # Reference ID's cited in aux files (including those they \@input) or in
+    # biber's bcf files. An empty set means every entry is cited, as by
+    # \nocite{*}. Raises IOError if a given file can't be read.
+    usedIds = set()
+    for fileName in splitAuxFiles(auxFile):
+        if fileName.endswith(".bcf"):
+            loadBcfCitations(fileName, usedIds)
+        else:
+            loadAuxCitations(fileName, usedIds, os.path.dirname(fileName), set())
+    if "*" in usedIds:
+        return set()
+    return usedIds
+
+
+def loadAuxCitations(auxFile, usedIds, auxDir, loadedFiles):
+    fInAux = open(auxFile, "r", encoding="utf8")
+    try:
+        auxText = fInAux.read()
+    finally:
+        fInAux.close()
+    loadedFiles.add(os.path.abspath(auxFile))
+
+    for command, arguments in auxCommandPattern.findall(auxText):
+        lastArgument = arguments[arguments.rindex("{") + 1 : -1]
+        if command == "@input":
+            # relative to the main aux file, as LaTeX writes them
+            includedFile = os.path.join(auxDir, lastArgument)
+            if os.path.abspath(includedFile) in loadedFiles:
+                continue
+            try:
+                loadAuxCitations(includedFile, usedIds, auxDir, loadedFiles)
+            except IOError:
+                # not written (yet), as for chapters left out by \includeonly
+                pass
+        else:
+            for entryId in lastArgument.split(","):
+                entryId = entryId.strip()
+                if entryId:
+                    usedIds.add(entryId)
+
+
+def loadBcfCitations(bcfFile, usedIds):
+    from xml.sax.saxutils import unescape
+
+    fInBcf = open(bcfFile, "r", encoding="utf8")
+    try:
+        bcfText = fInBcf.read()
+    finally:
+        fInBcf.close()
+    for entryId in bcfCitekeyPattern.findall(bcfText):
+        entryId = unescape(entryId.strip())
+        if entryId:
+            usedIds.add(entryId)
+
+
+# entry ID's and the fields naming the entries biber includes with them
+referencePattern = re.compile(
+    r"@[ \t]*\w+\s*[{(]\s*([^\s,{}()]*)"
+    r"|\b(?:crossref|xdata|related)\s*=\s*[{\"]\s*([^{}\"]*)[}\"]",
+    re.IGNORECASE,
+)
+referenceFieldNames = ("crossref", "xdata", "related")
+
+
+def addReferencedIds(usedIds, blocks):
+    # usedIds and the ID's they lead to through crossref, xdata and related
+    # fields, from the (first line number, text) blocks of a bib file
+    if not usedIds:
+        return usedIds
+
+    references = {}
+    for blockLineNumber, blockText in blocks:
+        # substring tests are much faster than a case-insensitive regex
+        lowerText = blockText.lower()
+        if not any(fieldName in lowerText for fieldName in referenceFieldNames):
+            continue
+        entryId = None
+        for match in referencePattern.finditer(blockText):
+            if match.group(1) is not None:
+                entryId = match.group(1)
+            elif entryId is not None:
+                references.setdefault(entryId, []).extend(
+                    referencedId.strip() for referencedId in match.group(2).split(",")
+                )
+    if not references:
+        return usedIds
+
+    usedIds = set(usedIds)
+    pending = list(usedIds)
+    while pending:
+        for referencedId in references.get(pending.pop(), ()):
+            if referencedId and referencedId not in usedIds:
+                usedIds.add(referencedId)
+                pending.append(referencedId)
+    return usedIds
+
+
+# Problems are (rule ID, message) pairs, the rule ID names the check that
+# found them: rule ID -> (severity, description). Errors are counted towards
+# the exit code, warnings are only reported.
+problemRules = {
+    "missing-comma": ("error", "Comma missing after the entry key or a field"),
+    "non-unique-id": ("error", "Reference ID defined more than once"),
+    "missing-closing-brace": ("warning", "Entry not closed before the next one"),
+    "unknown-type": ("warning", "Unknown entry type, checked as misc"),
+    "missing-field": ("error", "Field required by the entry type is missing"),
+    "duplicate-reference": (
+        "warning",
+        "Same DOI or (nearly) the same title as an earlier entry",
+    ),
+}
+# the checks of field values add theirs, see fieldRule
+# rules only checked when enabled, as they cost more than the others
+optionalRules = frozenset(("duplicate-reference",))
+# the CheckResult counter each problem of these rules counts towards, those
+# of field rules count towards their counterName
+ruleCounterNames = {
+    "missing-comma": "counterMissingCommas",
+    "non-unique-id": "counterNonUniqueId",
+    "missing-field": "counterMissingFields",
+}
+
+
+def problemCounterName(ruleId):
+    # The counter a problem counts towards, None for warnings
+    counterName = ruleCounterNames.get(ruleId)
+    if counterName is None and ruleId in fieldRules:
+        counterName = fieldRules[ruleId].counterName
+    return counterName
+
+
+def generateNonUniqueIdProblem(entryId, firstId, firstLineNumber):
+    problem = "non-unique id: '" + entryId + "'"
+    if firstId != entryId:
+        problem += " clashes with '" + firstId + "'"
+    return (
+        "non-unique-id",
+        problem + " (first defined on line " + str(firstLineNumber) + ")",
+    )
+
+
+# BibTeX names: "First von Last", "von Last, First" or "von Last, Jr, First",
+# separated by "and". Nothing inside braces separates anything, so
+# "{Barnes and Noble, Inc.}" is a single last name.
+nameSeparatorPattern = re.compile(r"\s+and\s+", re.IGNORECASE)
+nameCommaPattern = re.compile(r"\s*,\s*")
+nameWordPattern = re.compile(r"[\s~]+")
+# the Jr part of "Last, Jr, First"; anything else there is more likely a
+# "Last, First, Middle" mistake
+nameSuffixPattern = re.compile(
+    r"^(?:jr|sr|[ivx]+|\d+(?:st|nd|rd|th))\.?$", re.IGNORECASE
+)
+# special characters whose case is that of their command, as {\OE} or {\ss}
+nameSpecialCommands = frozenset(("aa", "ae", "i", "j", "l", "o", "oe", "ss"))
+nameCommandPattern = re.compile(r"\\([a-zA-Z]+|.)")
+
+
+def splitOutsideBraces(text, separatorPattern, maxsplit=0):
+    # separatorPattern.split(text, maxsplit), skipping separators in braces
+    if "{" not in text:
+        return separatorPattern.split(text, maxsplit)
+    parts = []
+    start = position = depth = 0
+    for match in separatorPattern.finditer(text):
+        depth += text.count("{", position, match.start())
+        depth -= text.count("}", position, match.start())
+        position = match.start()
+        if depth == 0:
+            parts.append(text[start : match.start()])
+            start = match.end()
+            if len(parts) == maxsplit:
+                break
+    parts.append(text[start:])
+    return parts
+
+
+def splitNames(fieldValue, maxsplit=0):
+    # The names of an author or editor field
+    if "{" not in fieldValue and not (
+        "  " in fieldValue
+        or "\n" in fieldValue
+        or "\t" in fieldValue
+        or " AND " in fieldValue
+        or " And " in fieldValue
+    ):
+        # single spaces around "and", the usual case, split faster
+        return fieldValue.split(" and ", maxsplit or -1)
+    return splitOutsideBraces(fieldValue, nameSeparatorPattern, maxsplit)
+
+
+def isVonWord(word):
+    # Words starting with a lower case letter (outside braces, apart from
+    # special characters like {\"u}) are part of the "von" of a name
+    depth = 0
+    for position, char in enumerate(word):
+        if char == "{":
+            depth += 1
+            if depth == 1 and word.startswith("\\", position + 1):
+                # a special character, the first letter of its command or
+                # after it tells the case
+                match = nameCommandPattern.match(word, position + 1)
+                command = match.group(1)
+                if command.lower() in nameSpecialCommands:
+                    return command[0].islower()
+                for letter in word[match.end() :]:
+                    if letter.isalpha():
+                        return letter.islower()
+                return False
+        elif char == "}":
+            depth -= 1
+        elif depth == 0 and char.isalpha():
+            return char.islower()
+    return False
+
+
+class BibName(object):
+    # A name parsed by parseName, its parts joined by single spaces, with
+    # the problems found in it as keys of nameProblemMessages[fieldName]
+    __slots__ = ("first", "von", "last", "jr", "problems")
+
+    def __init__(self, first, von, last, jr, problems):
+        self.first = first
+        self.von = von
+        self.last = last
+        self.jr = jr
+        self.problems = problems
+
+
+# raw name -> BibName of the names parsed lately, least recently used first.
+# Bibliographies repeat the same authors over and over, so few names are
+# parsed more than once.
+parsedNames = collections.OrderedDict()
+maxParsedNames = 20000
+
+
+def parseName(name):
+    parsed = parsedNames.get(name)
+    if parsed is not None:
+        touchParsedName(name)
+        return parsed
+    parsed = parsedNames[name] = parseNameParts(name)
+    if len(parsedNames) > maxParsedNames:
+        parsedNames.popitem(last=False)
+    return parsed
+
+
+def touchParsedNameBackport(name):
+    # OrderedDict.move_to_end, which Python 2 doesn't have
+    parsedNames[name] = parsedNames.pop(name)
+
+
+touchParsedName = getattr(parsedNames, "move_to_end", touchParsedNameBackport)
+
+
+def parseNameParts(name):
+    # Split a name into First, von, Last and Jr as BibTeX does
+    parts = splitOutsideBraces(name.strip(), nameCommaPattern)
+    problems = ()
+    if len(parts) > 3 or len(parts) == 3 and not nameSuffixPattern.match(parts[1]):
+        problems = ("too-many-components",)
+    elif len(parts) > 1:
+        if not parts[0]:
+            problems += ("empty-last",)
+        if not parts[-1]:
+            problems += ("empty-first",)
+
+    words = [word for word in splitOutsideBraces(parts[0], nameWordPattern) if word]
+    vonWords = [isVonWord(word) for word in words[:-1]]
+    if len(parts) == 1:
+        # First von Last: von from the first to the last lower case word
+        vonStart = vonWords.index(True) if True in vonWords else len(vonWords)
+        first = words[:vonStart]
+        words = words[vonStart:]
+        vonWords = vonWords[vonStart:]
+    else:
+        first = [parts[-1]]
+    # von Last: von up to the last lower case word but the last one
+    vonEnd = len(vonWords) - vonWords[::-1].index(True) if True in vonWords else 0
+    return BibName(
+        " ".join(first),
+        " ".join(words[:vonEnd]),
+        " ".join(words[vonEnd:]),
+        parts[1] if len(parts) == 3 else "",
+        problems,
+    )
+
+
+def generateNameProblemMessages(fieldName, person):
+    inField = " in field '" + fieldName + "'"
+    return {
+        "too-many-components": "too many name components for " + person + inField,
+        "empty-last": "last name of " + person + inField + " empty",
+        "empty-first": "first name of " + person + inField + " empty",
+    }
+
+
+# field -> name problem -> message
+nameProblemMessages = {
+    "author": generateNameProblemMessages("author", "an author"),
+    "editor": generateNameProblemMessages("editor", "an editor"),
+}
 
-    librariesList = []
-    for name, site in libraries:
-        librariesList.append(
+
+def generateEntryProblemsHTML(entry, showBibFile=False):
+    # an empty title may be a byte string on python 2, which can't translate
+    cleanedTitle = entry.title and entry.title.translate(removePunctuationMap)
+    html = [
+        "<div id='",
+        entry.id,
+        "' class='problem severe",
+        str(len(entry.problems)),
+        "'>",
+        "<h2>",
+        entry.id,
+        " (",
+        entry.type,
+        ")</h2> ",
+        "<div class='links'>",
+    ]
+    if citeulikeUsername:
+        html += [
+            "<a href='",
+            citeulikeHref,
+            entry.articleId,
+            "' target='_blank'>CiteULike</a> |",
+        ]
+
+    html.append(
+        " | ".join(
             " <a href='" + site + cleanedTitle + "' target='_blank'>" + name + "</a>"
+            for name, site in libraries
         )
-    html += " | ".join(librariesList)
+    )
+
+    html += [
+        "</div>",
+        "<div class='reference'>",
+        entry.title,
+        " (",
+        entry.author,
+        ")",
+        "</div>",
+    ]
+    if showBibFile:
+        html += [
+            "<div class='reference'>",
+            entry.bibFile,
+            ":",
+            str(entry.lineNumber),
+            "</div>",
+        ]
+    html.append("<ul>")
+
+    for ruleId, subproblem in entry.problems:
+        html += ["<li>", subproblem, "</li>"]
+
+    html += [
+        "</ul>",
+        "<form class='problem_control'><label>checked</label><input type='checkbox' class='checked'/></form>",
+        "<div class='bibtex_toggle'>Current BibLaTex Entry</div>",
+        "<div class='bibtex'>",
+    ]
+    html.extend(line + "<br />" for line in entry.source.split("\n") if line)
+    html.append("</div></div>")
+
+    return "".join(html)
+
+
+def generateEntryProblemsConsole(entry, bibFile, problems=None):
+    # problems are those of the entry to print, all by default
+    prefix = "PROBLEM: " + bibFile + ":" + str(entry.lineNumber) + " - " + entry.id
+    return "".join(
+        prefix + " - " + subproblem + "\n"
+        for ruleId, subproblem in (entry.problems if problems is None else problems)
+    )
+
+
+### Parser ###
+
+entryHeaderPattern = re.compile(r"@[ \t]*(\w+)\s*([{(])\s*([^\s,{}()]*)\s*(,?)")
+# name = value for the common case of a single value without nested braces
+simpleField = (
+    r'([^\s=,{}()"#@]+)\s*=\s*'
+    r'(\{[^{}]*\}|"[^"{}]*"|[^\s,{}()"#@]+(?![^\s,{}()"#@]))\s*(?![\s#])(,?)'
+)
+simpleFieldPattern = re.compile(r"\s*" + simpleField + r"\s*")
+# all fields of an entry made up of simple fields only, up to the closer
+simpleEntryBody = (
+    r'\s*(?:[^\s=,{}()"#@]+\s*=\s*(?:\{[^{}]*\}|"[^"{}]*"|[^\s,{}()"#@]+)\s*,?\s*)*'
+)
+simpleEntryBodyPatterns = {
+    "{": re.compile(simpleEntryBody + r"\}"),
+    "(": re.compile(simpleEntryBody + r"\)"),
+}
+# the same with values in nested braces, to find where an entry that isn't
+# checked ends as parsing its fields would
+nestedEntryBody = (
+    r'\s*(?:[^\s=,{}()"#@]+\s*=\s*'
+    r"(?:\{[^{}]*(?:\{[^{}]*(?:\{[^{}]*\}[^{}]*)*\}[^{}]*)*\}"
+    r'|"[^"{}]*(?:\{[^{}]*\}[^"{}]*)*"|[^\s,{}()"#@]+(?![^\s,{}()"#@]))\s*,?\s*)*'
+)
+nestedEntryBodyPatterns = {
+    "{": re.compile(nestedEntryBody + r"\}"),
+    "(": re.compile(nestedEntryBody + r"\)"),
+}
+fieldsPattern = re.compile(
+    r'([^\s=,{}()"#@]+)\s*=\s*(\{[^{}]*\}|"[^"{}]*"|[^\s,{}()"#@]+)\s*(,?)'
+)
+fieldNamePattern = re.compile(r'([^\s=,{}()"#@]+)\s*=\s*')
+valuePiecePattern = re.compile(r'[^\s,{}()"#@]+')
+whitespacePattern = re.compile(r"\s*")
+bracePattern = re.compile(r"[{}]")
+# braces nested up to three deep, deeper ones are left to findClosingBrace
+nestedBracesPattern = re.compile(
+    r"\{[^{}]*(?:\{[^{}]*(?:\{[^{}]*(?:\{[^{}]*\}[^{}]*)*\}[^{}]*)*\}[^{}]*)*\}"
+)
+quotedBracePattern = re.compile(r'[{}"]')
+parenBracePattern = re.compile(r"[{}()]")
+
+entryClosers = {"{": "}", "(": ")"}
+# entry types that don't hold a reference
+skippedEntryTypes = frozenset(("comment", "preamble", "string"))
+
+
+class BibEntry(object):
+    # A parsed entry; start/end are offsets of the '@' and after the closing
+    # delimiter, fields are (name, raw value, "," unless the comma after it is
+    # missing) in order
+    __slots__ = (
+        "type",
+        "id",
+        "start",
+        "end",
+        "startLine",
+        "endLine",
+        "fields",
+        "headerComma",
+        "terminated",
+        "source",
+        "cached",
+        "cacheable",
+        "skipped",
+        "duplicatesChanged",
+    )
+
+    def __init__(self, type, id, start, end, startLine, endLine):
+        self.type = type
+        self.id = id
+        self.start = start
+        self.end = end
+        self.startLine = startLine
+        self.endLine = endLine
+        self.fields = []
+        self.headerComma = True
+        self.terminated = True
+        self.source = ""
+        self.cached = None  # see parseBibEntries
+        self.cacheable = False
+        self.skipped = False
+        # skipped, but first defined by a changed entry, see iterChangedBibEntries
+        self.duplicatesChanged = False
+
+
+def iterBibBlocks(lines, firstLineNumber=0, batchSize=4096):
+    # Group lines into (first line number, text) blocks of about batchSize
+    # lines, cut before a line starting with '@' outside of braces so no
+    # entry is split and the file never has to be in memory as a whole
+    lines = iter(lines)
+    return cutBibBlocks(
+        (
+            "".join(batch)
+            for batch in iter(lambda: list(itertools.islice(lines, batchSize)), [])
+        ),
+        firstLineNumber,
+    )
 
-    html += "</div>"
-    html += "<div class='reference'>" + title + " (" + author + ")"
-    html += "</div>"
-    html += "<ul>"
 
-    for subproblem in problems:
-        html += "<li>" + subproblem + "</li>"
-        if not options.no_console:
-            errorMessage = "PROBLEM: {}:{} - {} - {}\n".format(
-                options.bibFile, lineNumber, itemId, subproblem
+# characters a block left open by an unbalanced brace grows to before it is
+# cut at a line starting with '@' anyway, so the rest of the file isn't read
+# into it; the entry cut short is reported as not closed
+maxOpenBlockSize = 1 << 22
+
+
+def cutBibBlocks(batches, firstLineNumber=0, maxBlockSize=maxOpenBlockSize):
+    # Blocks of iterBibBlocks from the text of consecutive batches of lines.
+    # The text not yielded yet holds no '\n@' at brace depth 0, it would
+    # have been cut there, so only each new batch is looked at: its braces
+    # are counted once and the depth of the pending text carried on.
+    lineNumber = firstLineNumber
+    pending = []  # the text not yielded yet, in pieces
+    pendingSize = 0
+    depth = 0  # of the pending text
+    for batch in batches:
+        endDepth = depth + batch.count("{") - batch.count("}")
+        # the last '\n@' at depth 0, counting back from the end of the batch
+        cut = None
+        lastCut = lastCutDepth = None
+        previous = len(batch)
+        previousDepth = endDepth
+        while True:
+            end = previous
+            previous = batch.rfind("\n@", 0, end)
+            if previous < 0:
+                break
+            previousDepth -= batch.count("{", previous, end) - batch.count(
+                "}", previous, end
             )
-            sys.stderr.write(errorMessage)
+            if lastCut is None:
+                lastCut, lastCutDepth = previous, previousDepth
+            if previousDepth == 0:
+                cut, cutDepth = previous, 0
+                break
+        if (
+            cut is None
+            and depth == 0
+            and batch[:1] == "@"
+            and pending
+            and pending[-1][-1:] == "\n"
+        ):
+            # before the batch, the '\n' ends the pending text
+            cut, cutDepth = -1, 0
+        if (
+            cut is None
+            and lastCut is not None
+            and pendingSize + len(batch) > maxBlockSize
+        ):
+            # a brace is left open, don't take the rest of the file along
+            cut, cutDepth = lastCut, lastCutDepth
+
+        if cut is None:
+            pending.append(batch)
+            pendingSize += len(batch)
+            depth = endDepth
+            continue
+
+        pending.append(batch[: cut + 1])
+        block = "".join(pending)
+        yield lineNumber, block
+        lineNumber += block.count("\n")
+        pending = [batch[cut + 1 :]]
+        pendingSize = len(batch) - cut - 1
+        depth = endDepth - cutDepth
+
+    rest = "".join(pending)
+    if rest:
+        yield lineNumber, rest
+
+
+# batch size -> pattern of that many lines, ended as universal newlines
+# would end them, or of what's left of the file if there are fewer
+mappedBatchPatterns = {}
+
+
+def iterMappedBibBlocks(fIn, firstLineNumber=0, batchSize=4096):
+    # Same blocks as iterBibBlocks, from a memory mapped file: the batches of
+    # lines are found on the raw bytes and each is decoded in one go instead
+    # of line by line. The batches have to be the same, they decide where
+    # broken entries end. Streams that can't be mapped (or were read from
+    # already) fall back to iterBibBlocks.
+    import mmap
+
+    try:
+        if fIn.tell() != 0:
+            raise ValueError("stream was read from")
+        mapped = mmap.mmap(fIn.fileno(), 0, access=mmap.ACCESS_READ)
+    except (AttributeError, EnvironmentError, ValueError, mmap.error):
+        # e.g. StringIO, pipes or empty files
+        return iterBibBlocks(fIn, firstLineNumber, batchSize)
+
+    batchPattern = mappedBatchPatterns.get(batchSize)
+    if batchPattern is None:
+        line = r"[^\r\n]*(?:\r\n|\r(?!\n)|\n)"
+        batchPattern = mappedBatchPatterns[batchSize] = re.compile(
+            (
+                r"(?:%s){%d}|(?:%s){0,%d}[^\r\n]*"
+                % (line, batchSize, line, batchSize - 1)
+            ).encode("ascii")
+        )
+    return cutBibBlocks(
+        iterMappedBatches(mapped, batchSize, batchPattern), firstLineNumber
+    )
 
-    html += "</ul>"
-    html += "<form class='problem_control'><label>checked</label><input type='checkbox' class='checked'/></form>"
-    html += "<div class='bibtex_toggle'>Current BibLaTex Entry</div>"
-    html += "<div class='bibtex'>" + itemHTML + "</div>"
-    html += "</div>"
 
-    return html
+def readBibBlocks(fIn, mmapInput=True, firstLineNumber=0):
+    # iterMappedBibBlocks or iterBibBlocks, the same blocks either way
+    if mmapInput:
+        return iterMappedBibBlocks(fIn, firstLineNumber)
+    return iterBibBlocks(fIn, firstLineNumber)
 
 
-### Globals ###
+def iterMappedBatches(mapped, batchSize, batchPattern):
+    # The text of every batchSize lines of a memory mapped file
+    import mmap
+
+    try:
+        size = len(mapped)
+        pos = released = 0
+        window = 1 << 17  # bytes looked at for the next batch
+        while pos < size:
+            chunk = mapped[pos : pos + window]
+            pieces = chunk.split(b"\n", batchSize)
+            if len(pieces) > batchSize:
+                end = pos + len(chunk) - len(pieces[-1])
+            elif pos + window >= size:
+                end = size
+            elif b"\r" not in chunk:
+                window *= 2
+                continue
+            else:
+                end = None
+
+            batch = None
+            if end is not None:
+                batch = chunk[: end - pos]
+                if b"\r" in batch:
+                    # as universal newlines would read them
+                    batch = batch.replace(b"\r\n", b"\n")
+                    if b"\r" in batch:
+                        batch = None
+            if batch is None:
+                # rare, some lines end in just "\r"
+                end = batchPattern.match(mapped, pos).end()
+                batch = mapped[pos:end].replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+            yield batch.decode("utf8")
+            # the next batch is likely about as long
+            window = (end - pos) * 5 // 4 + 1024
+            pos = end
+
+            # the pages read so far aren't needed again, don't keep them
+            # counted in this process's memory
+            if hasattr(mapped, "madvise"):
+                releaseTo = pos - pos % mmap.PAGESIZE
+                if releaseTo > released:
+                    mapped.madvise(mmap.MADV_DONTNEED, released, releaseTo - released)
+                    released = releaseTo
+    finally:
+        mapped.close()
+
+
+def findClosingBrace(text, pos):
+    # Offset after the brace closing the one at pos, -1 if it isn't closed
+    nestedBraces = nestedBracesPattern.match(text, pos)
+    if nestedBraces is not None:
+        return nestedBraces.end()
+
+    depth = 0
+    for match in bracePattern.finditer(text, pos):
+        if match.group() == "{":
+            depth += 1
+        else:
+            depth -= 1
+            if depth == 0:
+                return match.end()
+    return -1
+
+
+def findClosingQuote(text, pos):
+    # Offset after the '"' closing the one at pos, quotes in braces don't count
+    depth = 0
+    for match in quotedBracePattern.finditer(text, pos + 1):
+        char = match.group()
+        if char == "{":
+            depth += 1
+        elif char == "}":
+            depth -= 1
+        elif depth <= 0:
+            return match.end()
+    return -1
+
+
+def findEntryEnd(text, pos, opener):
+    # Offset after the delimiter closing an entry opened at pos
+    if opener == "{":
+        return findClosingBrace(text, pos)
+
+    depth = 0
+    for match in parenBracePattern.finditer(text, pos + 1):
+        char = match.group()
+        if char == "{":
+            depth += 1
+        elif char == "}":
+            depth -= 1
+        elif char == ")" and depth <= 0:
+            return match.end()
+    return -1
+
+
+def parseFieldValue(text, pos):
+    # Offset after a value such as {a {b}} # "c" # macro starting at pos,
+    # -1 if a brace or quote is never closed
+    while True:
+        char = text[pos : pos + 1]
+        if char == "{":
+            pos = findClosingBrace(text, pos)
+        elif char == '"':
+            pos = findClosingQuote(text, pos)
+        else:
+            match = valuePiecePattern.match(text, pos)
+            if match is None:
+                return pos
+            pos = match.end()
+        if pos < 0:
+            return pos
+
+        afterPiece = whitespacePattern.match(text, pos).end()
+        if text[afterPiece : afterPiece + 1] != "#":
+            return pos
+        pos = whitespacePattern.match(text, afterPiece + 1).end()
+
+
+def parseBibEntries(
+    text,
+    firstLineNumber=0,
+    skipEntry=None,
+    lookupEntry=None,
+    start=0,
+    skippedSpans=None,
+):
+    # Tokenize the entries in text in one pass, tracking brace depth so
+    # values may span lines and contain '=', ',' or nested braces. Text
+    # outside of entries is a comment; @comment, @preamble and @string are
+    # skipped. Parsing starts at offset start (outside of entries), which is
+    # on line firstLineNumber. Entries for which skipEntry(type, id) is true
+    # are yielded without their fields or source, marked as skipped; they end
+    # where they would if parsed, so a broken one doesn't take the next
+    # entries along.
+    # Entries for which lookupEntry(source) returns a value are yielded
+    # without their fields too, with the value as entry.cached. The others
+    # are cacheable if their source is what lookupEntry was given, i.e. the
+    # braces are balanced. Given a skippedSpans list, the (start, end)
+    # offsets of each @comment, @preamble and @string are added to it, end -1
+    # if it isn't closed.
+    pos = start
+    lineNumber = firstLineNumber
+    linePos = start
+
+    while True:
+        pos = text.find("@", pos)
+        if pos < 0:
+            return
+
+        header = entryHeaderPattern.match(text, pos)
+        if header is None:
+            pos += 1
+            continue
+
+        entryType, opener, entryId, comma = header.groups()
+        closer = entryClosers[opener]
+        lineNumber += text.count("\n", linePos, pos)
+        linePos = pos
+
+        if entryType.lower() in skippedEntryTypes:
+            end = findEntryEnd(text, header.start(2), opener)
+            if skippedSpans is not None:
+                skippedSpans.append((pos, end))
+            pos = len(text) if end < 0 else end
+            continue
+
+        if skipEntry is not None and skipEntry(entryType, entryId):
+            entry = BibEntry(entryType, entryId, pos, len(text), lineNumber, lineNumber)
+            entry.skipped = True
+            body = simpleEntryBodyPatterns[opener].match(
+                text, header.end()
+            ) or nestedEntryBodyPatterns[opener].match(text, header.end())
+            if body is not None:
+                entry.end = body.end()
+            else:
+                parseBibFields(text, header.end(), closer, entry)
+                entry.fields = []
+            entry.endLine += text.count("\n", pos, max(pos, entry.end - 1))
+            yield entry
+            pos = entry.end
+            continue
+
+        if lookupEntry is not None:
+            end = findEntryEnd(text, header.start(2), opener)
+            cached = lookupEntry(text[pos:end]) if end >= 0 else None
+            if cached is not None:
+                entry = BibEntry(entryType, entryId, pos, end, lineNumber, lineNumber)
+                entry.endLine += text.count("\n", pos, end - 1)
+                entry.source = text[pos:end]
+                entry.cached = cached
+                yield entry
+                pos = end
+                continue
+
+        entry = BibEntry(entryType, entryId, pos, len(text), lineNumber, lineNumber)
+        fieldPos = header.end()
+        if not comma and text[fieldPos : fieldPos + 1] != closer:
+            entry.headerComma = False
+
+        body = simpleEntryBodyPatterns[opener].match(text, fieldPos)
+        if body is not None:
+            # the usual case, all fields in one go
+            entry.end = body.end()
+            fields = entry.fields = fieldsPattern.findall(text, fieldPos, entry.end)
+            # the last field may go without comma
+            if fields and not fields[-1][2]:
+                fields[-1] = fields[-1][:2] + (",",)
+        else:
+            parseBibFields(text, fieldPos, closer, entry)
+
+        entry.endLine = lineNumber + text.count("\n", pos, max(pos, entry.end - 1))
+        entry.source = text[pos : entry.end]
+        entry.cacheable = lookupEntry is not None and entry.end == end
+        yield entry
+        pos = entry.end
+
+
+def parseBibFields(text, fieldPos, closer, entry, fieldSpans=None):
+    # Field by field fallback for values with nested braces or '#', and for
+    # broken entries; sets the end of the entry. Given a fieldSpans list, the
+    # (name start, name end, value end) offsets of each field are added to it.
+    fields = entry.fields
+    lastFieldEnds = (closer, "", "@")
+    while True:
+        field = simpleFieldPattern.match(text, fieldPos)
+        if field is not None:
+            name, value, comma = field.groups()
+            fieldPos = field.end()
+            # the last field may go without comma
+            if not comma and text[fieldPos : fieldPos + 1] in lastFieldEnds:
+                comma = ","
+            fields.append((name, value, comma))
+            if fieldSpans is not None:
+                fieldSpans.append((field.start(1), field.end(1), field.end(2)))
+            continue
+
+        fieldPos = whitespacePattern.match(text, fieldPos).end()
+        char = text[fieldPos : fieldPos + 1]
+        if char == closer:
+            entry.end = fieldPos + 1
+            return
+        if char == ",":
+            fieldPos += 1
+            continue
+        if char == "" or char == "@":
+            # the next entry starts before this one was closed
+            entry.end = fieldPos
+            entry.terminated = False
+            return
+
+        fieldName = fieldNamePattern.match(text, fieldPos)
+        if fieldName is None:
+            # not a field, skip to the next comma or the closer
+            nextComma = text.find(",", fieldPos)
+            nextCloser = text.find(closer, fieldPos)
+            if nextCloser < 0:
+                nextCloser = len(text)
+                if nextComma < 0:
+                    fieldPos = nextCloser
+                    continue
+            fieldPos = nextCloser if nextComma < 0 else min(nextComma, nextCloser)
+            continue
+
+        valueStart = fieldName.end()
+        valueEnd = parseFieldValue(text, valueStart)
+        if valueEnd < 0:
+            fields.append((fieldName.group(1), text[valueStart:].strip(), ","))
+            if fieldSpans is not None:
+                fieldSpans.append((fieldName.start(1), fieldName.end(1), len(text)))
+            entry.end = len(text)
+            entry.terminated = False
+            return
+
+        fieldPos = whitespacePattern.match(text, valueEnd).end()
+        comma = text[fieldPos : fieldPos + 1]
+        if comma == ",":
+            fieldPos += 1
+        elif comma in lastFieldEnds:
+            comma = ","
+        else:
+            comma = ""
+        fields.append((fieldName.group(1), text[valueStart:valueEnd].strip(), comma))
+        if fieldSpans is not None:
+            fieldSpans.append((fieldName.start(1), fieldName.end(1), valueEnd))
+
+
+def unwrapFieldValue(value):
+    # {value} or "value" -> value
+    if len(value) > 1 and (
+        value[0] == "{" and value[-1] == "}" or value[0] == '"' and value[-1] == '"'
+    ):
+        value = value[1:-1]
+    return value.strip()
+
+
+### Results ###
+
+
+class CheckOptions(object):
+    # Settings for a check run, any attribute can be overridden by keyword
+    defaults = {
+        # biber treats keys differing only in case as clashes
+        "caseInsensitiveIds": False,
+        # reuse the problems of unchanged entries from this file, see EntryCache
+        "cacheFile": None,
+        "cacheSize": 200000,  # entries
+        # time the phases and checks into CheckResult.stats, see CheckStats
+        "collectStats": False,
+        # read bib files through mmap, see iterMappedBibBlocks
+        "mmapInput": True,
+        # rule ID's to check besides or instead of the default ones, and
+        # modules registering more rules, see fieldRule
+        "enabledRules": (),
+        "disabledRules": (),
+        "ruleModules": (),
+        # check only this fraction of the entries, the same ones every run,
+        # see isSampledId
+        "sampleRate": None,
+        # stop reading a bib file after the last of the cited entries
+        "stopAfterCited": False,
+        # {bib file: [(first line, last line)]} to check only the entries on
+        # these lines of each file, see changedLineRanges
+        "changedLines": None,
+    }
 
-entriesIds = []
-entriesProblemsHTML = []
+    def __init__(self, **kwargs):
+        for name, value in self.defaults.items():
+            setattr(self, name, value)
+        for name, value in kwargs.items():
+            if name not in self.defaults:
+                raise TypeError("Unknown check option '" + name + "'")
+            setattr(self, name, value)
+
+
+class EntryResult(object):
+    # A checked entry, as it appears in the report. lineNumber is where the
+    # entry ends, startLineNumber where it starts (both counted from 0).
+    # problems is a tuple of (rule ID, message) pairs. Results are kept for
+    # whole files, so they are slotted and share what they can: the type
+    # names, the empty problems and the missing field problems.
+    __slots__ = (
+        "bibFile",
+        "startLineNumber",
+        "id",
+        "type",
+        "articleId",
+        "title",
+        "author",
+        "lineNumber",
+        "problems",
+        "source",
+        "doi",
+    )
 
-entryArticleId = ""
-entryAuthor = ""
-entryFields = []
-entryHTML = ""
-entryId = ""
-entryProblems = []
-entryTitle = ""
-entryType = ""
+    def __init__(
+        self,
+        id,
+        type,
+        articleId,
+        title,
+        author,
+        lineNumber,
+        problems,
+        source,
+        bibFile=None,
+        startLineNumber=None,
+        doi="",
+    ):
+        self.bibFile = bibFile
+        self.startLineNumber = startLineNumber
+        self.id = id
+        self.type = type
+        self.articleId = articleId
+        self.title = title
+        self.author = author
+        self.lineNumber = lineNumber
+        self.problems = problems
+        self.source = source
+        self.doi = doi  # only read when duplicate-reference is checked
+
+
+class CheckResult(object):
+    # Everything found while checking a bib file, or several merged together
+    counterNames = (
+        "counterFlawedNames",
+        "counterMissingCommas",
+        "counterMissingFields",
+        "counterNonUniqueId",
+        "counterWrongFieldNames",
+        "counterWrongTypes",
+    )
 
-counterFlawedNames = 0
-counterMissingCommas = 0
-counterMissingFields = 0
-counterNonUniqueId = 0
-counterWrongFieldNames = 0
-counterWrongTypes = 0
+    def __init__(self, bibFile=None, auxFile=None):
+        self.bibFile = bibFile
+        self.auxFile = auxFile
+        self.entries = []
+        self.messages = []  # INFO/WARNING/ERROR lines for the console
+        self.failed = False  # the bib file could not be read
+        self.cacheHits = []  # digests of entries found in the cache
+        self.cacheUpdates = {}  # digest -> cached value of checked entries
+        self.stats = None  # CheckStats, if the options ask for them
+
+        for counterName in self.counterNames:
+            setattr(self, counterName, 0)
+
+    # tuple of all counters
+    getCounters = operator.attrgetter(*counterNames)
+
+    @property
+    def problemCount(self):
+        return sum(getattr(self, counterName) for counterName in self.counterNames)
+
+    def merge(self, other, keepEntries=True):
+        # Add the counters (and entries) of another result to this one
+        for counterName in self.counterNames:
+            setattr(
+                self, counterName, getattr(self, counterName) + getattr(other, counterName)
+            )
+        if keepEntries:
+            self.entries.extend(other.entries)
+        self.failed = self.failed or other.failed
+        self.cacheHits.extend(other.cacheHits)
+        self.cacheUpdates.update(other.cacheUpdates)
+        if other.stats is not None:
+            if self.stats is None:
+                self.stats = CheckStats()
+            self.stats.merge(other.stats)
+
+
+### Stats ###
+
+# CPU time of this process
+cpuTime = getattr(time, "process_time", None) or time.clock
+
+# cProfile.Profile enabled while CheckStats time reading, parsing or checking
+checkProfiler = None
+
+
+class CheckStats(object):
+    # Where the time of a run goes (--stats): wall and CPU seconds per phase,
+    # calls and seconds per check, and the problems found per rule ID.
+    # Phases nest, e.g. parse pulls lines from read, and each phase is only
+    # charged for its own time. Workers return theirs with their result.
+
+    def __init__(self):
+        self.phases = {}  # phase -> [wall seconds, cpu seconds]
+        self.checks = {}  # check -> [calls, wall seconds]
+        self.ruleHits = {}  # rule ID -> problems
+        self.counts = {}  # e.g. "entries", "lines" -> count
+        self.running = []  # [phase, wall start, cpu start], innermost last
+
+    def enter(self, phase):
+        wall, cpu = time.time(), cpuTime()
+        if self.running:
+            self.charge(wall, cpu)
+        elif checkProfiler is not None and phase != "report":
+            checkProfiler.enable()
+        self.running.append([phase, wall, cpu])
+
+    def leave(self):
+        wall, cpu = time.time(), cpuTime()
+        self.charge(wall, cpu)
+        self.running.pop()
+        if self.running:
+            self.running[-1][1:] = [wall, cpu]
+        elif checkProfiler is not None:
+            checkProfiler.disable()
+
+    def charge(self, wall, cpu):
+        # time since the innermost phase started or was resumed
+        running = self.running[-1]
+        times = self.phases.setdefault(running[0], [0.0, 0.0])
+        times[0] += wall - running[1]
+        times[1] += cpu - running[2]
+        running[1:] = [wall, cpu]
+
+    def timedIter(self, phase, iterable, countName, countItem=None):
+        # Yields from iterable, timing each step as phase
+        iterator = iter(iterable)
+        count = 0
+        try:
+            while True:
+                self.enter(phase)
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    self.leave()
+                count += countItem(item) if countItem else 1
+                yield item
+        finally:
+            self.counts[countName] = self.counts.get(countName, 0) + count
+
+    def addCheck(self, check, elapsed):
+        times = self.checks.get(check)
+        if times is None:
+            times = self.checks[check] = [0, 0.0]
+        times[0] += 1
+        times[1] += elapsed
+
+    def addProblems(self, problems):
+        ruleHits = self.ruleHits
+        for ruleId, message in problems:
+            ruleHits[ruleId] = ruleHits.get(ruleId, 0) + 1
+
+    def merge(self, other):
+        for mine, theirs in (
+            (self.phases, other.phases),
+            (self.checks, other.checks),
+        ):
+            for name, values in theirs.items():
+                mine[name] = [a + b for a, b in zip(mine.get(name, [0, 0]), values)]
+        for mine, theirs in (
+            (self.ruleHits, other.ruleHits),
+            (self.counts, other.counts),
+        ):
+            for name, value in theirs.items():
+                mine[name] = mine.get(name, 0) + value
+
+    def toDict(self, elapsed):
+        return {
+            "elapsedSeconds": elapsed,
+            "phases": dict(
+                (phase, {"wallSeconds": wall, "cpuSeconds": cpu})
+                for phase, (wall, cpu) in self.phases.items()
+            ),
+            "checks": dict(
+                (check, {"calls": calls, "wallSeconds": wall})
+                for check, (calls, wall) in self.checks.items()
+            ),
+            "ruleHits": self.ruleHits,
+            "counts": self.counts,
+            "perSecond": dict(
+                (name, count / elapsed if elapsed else None)
+                for name, count in self.counts.items()
+            ),
+            "peakMemoryMB": peakMemoryMB(),
+        }
 
-lastLine = 0
+    def summary(self, elapsed):
+        # Lines of the table printed by --stats
+        lines = ["{:<24} {:>10} {:>10}".format("phase", "wall s", "cpu s")]
+        for phase, (wall, cpu) in sorted(
+            self.phases.items(), key=lambda item: -item[1][0]
+        ):
+            lines.append("{:<24} {:>10.3f} {:>10.3f}".format(phase, wall, cpu))
+        lines.append("{:<24} {:>10.3f}".format("total", elapsed))
+        for name, count in sorted(self.counts.items()):
+            lines.append(
+                "{:<24} {:>10} {:>10.0f}/s".format(
+                    name, count, count / elapsed if elapsed else 0
+                )
+            )
+        peakMemory = peakMemoryMB()
+        if peakMemory is not None:
+            lines.append("{:<24} {:>10.0f}".format("peak memory MB", peakMemory))
+
+        lines.append("")
+        # wider, to fit the rule ID's
+        lines.append("{:<32} {:>10} {:>10}".format("check", "calls", "wall s"))
+        for check, (calls, wall) in sorted(
+            self.checks.items(), key=lambda item: -item[1][1]
+        ):
+            lines.append("{:<32} {:>10} {:>10.3f}".format(check, calls, wall))
+
+        if self.ruleHits:
+            lines.append("")
+            lines.append("{:<24} {:>10}".format("rule", "problems"))
+            for ruleId, hits in sorted(self.ruleHits.items()):
+                lines.append("{:<24} {:>10}".format(ruleId, hits))
+        return lines
+
+
+def peakMemoryMB():
+    # Peak RSS of this process and its finished workers, None if unknown
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024.0 * 1024.0 if sys.platform == "darwin" else 1024.0)
 
-### Global Abusing Handlers ###
 
+### Cache ###
 
-def handleNewEntryStarting(line):
-    global entryArticleId, entryAuthor, entryFields, entryHTML, entryId, entryProblems, entryTitle, entryType
-    global counterMissingCommas, counterNonUniqueId
+# bump when the cached values change shape
+entryCacheVersion = 4
 
-    entryFields = []
-    entryProblems = []
 
-    entryId = line.split("{")[1].rstrip(",\n")
+def defaultCacheFile():
+    cacheHome = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(cacheHome, "biblatex_check", "entries.cache")
+
+
+def ruleConfigHash(enabledRules=()):
+    # Cached problems are only valid for the rules that found them
+    config = hashlib.sha1()
+    config.update(
+        repr(
+            (
+                entryCacheVersion,
+                sorted(requiredEntryFields.items()),
+                sorted(fieldAliases.items()),
+                sorted(reportFieldNames),
+                sorted(enabledRules),
+            )
+        ).encode("utf8")
+    )
+    # and for the checks as they were written at the time
+    sourceFiles = [globals().get("__file__")]
+    for moduleName, module in sorted(loadedRuleModules.items()):
+        sourceFiles.append(getattr(module, "__file__", None))
+    for sourceFile in sourceFiles:
+        if sourceFile is None:
+            continue
+        if sourceFile.endswith((".pyc", ".pyo")):
+            sourceFile = sourceFile[:-1]
+        try:
+            fIn = open(sourceFile, "rb")
+            config.update(fIn.read())
+            fIn.close()
+        except IOError:
+            pass
+    return config.hexdigest()
+
+
+def entryDigest(source):
+    return hashlib.sha1(source.encode("utf8")).digest()
+
+
+class EntryCache(object):
+    # Problems found per entry, keyed by a digest of the entry's source, so
+    # unchanged entries aren't checked again. Only checks involving other
+    # entries (non-unique ID's) are run for them. Once there are more than
+    # maxEntries, the least recently used are evicted down to 7/8 of that, so
+    # a full cache isn't sorted again for every entry added.
+    # While checking the cache is only read, the results collect hits and new
+    # entries, which are added by update() and written by save(); those two
+    # take a lock, as --serve checks in threads. Each update() is a run of its
+    # own, so --watch and --serve evict what the last rounds didn't use.
+    # Without a cacheFile the cache is only kept in memory.
+
+    def __init__(
+        self, cacheFile, maxEntries=CheckOptions.defaults["cacheSize"], configHash=None
+    ):
+        self.cacheFile = cacheFile
+        self.maxEntries = maxEntries
+        self.configHash = configHash or ruleConfigHash()
+        self.entries = {}  # digest -> (last used run, value)
+        self.run = 0
+        self.changed = False
+        self.lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        # The cache is marshalled, which only holds data rather than running
+        # code when read the way pickle can: it may be shared, e.g. by CI runs
+        if self.cacheFile is None:
+            return
+        import marshal
+
+        try:
+            fIn = open(self.cacheFile, "rb")
+            try:
+                # much faster than marshal.load of the file
+                configHash, run, entries = marshal.loads(fIn.read())
+            finally:
+                fIn.close()
+        except (IOError, OSError, EOFError, ValueError, TypeError):
+            # missing, unreadable or not a cache, start afresh
+            return
+        if (
+            configHash == self.configHash
+            and isinstance(run, int)
+            and isinstance(entries, dict)
+        ):
+            self.entries = entries
+            self.run = run + 1
+
+    def get(self, digest):
+        cached = self.entries.get(digest)
+        return None if cached is None else cached[1]
+
+    def update(self, result):
+        with self.lock:
+            run = self.run
+            entries = self.entries
+            for digest in result.cacheHits:
+                cached = entries.get(digest)
+                if cached is not None:
+                    entries[digest] = (run, cached[1])
+            for digest, value in result.cacheUpdates.items():
+                entries[digest] = (run, value)
+            self.changed = self.changed or bool(result.cacheUpdates)
+            self.run = run + 1
+            self.evictLocked()
+        result.cacheHits = []
+        result.cacheUpdates = {}
+
+    def evictLocked(self):
+        if len(self.entries) <= self.maxEntries:
+            return
+        entries = self.entries
+        lastUsed = sorted(entries, key=lambda digest: entries[digest][0], reverse=True)
+        for digest in lastUsed[self.maxEntries - self.maxEntries // 8 :]:
+            del entries[digest]
+        self.changed = True
+
+    def save(self):
+        # Raises IOError/OSError if the cache file can't be written
+        with self.lock:
+            self.saveLocked()
+
+    def saveLocked(self):
+        if not self.changed:
+            return
+        import marshal
+        import tempfile
+
+        # a cache loaded with more entries, e.g. with a smaller --cache-size
+        self.evictLocked()
+        if self.cacheFile is None:
+            self.changed = False
+            return
+
+        cacheDir = os.path.dirname(os.path.abspath(self.cacheFile))
+        if not os.path.isdir(cacheDir):
+            os.makedirs(cacheDir)
+        # write a copy and move it in place, so readers never see half a cache
+        fd, tempName = tempfile.mkstemp(dir=cacheDir)
+        fOut = os.fdopen(fd, "wb")
+        try:
+            fOut.write(marshal.dumps((self.configHash, self.run, self.entries)))
+            fOut.close()
+            if os.name == "nt" and os.path.exists(self.cacheFile):
+                os.remove(self.cacheFile)
+            os.rename(tempName, self.cacheFile)
+        except Exception:
+            fOut.close()
+            os.remove(tempName)
+            raise
+        self.changed = False
+
+
+# caches opened in this process, shared with forked workers
+openedEntryCaches = {}
+
+
+def openEntryCache(options):
+    configHash = ruleConfigHash(enabledRuleIds(options))
+    cache = openedEntryCaches.get((options.cacheFile, configHash))
+    if cache is None:
+        cache = EntryCache(options.cacheFile, options.cacheSize, configHash)
+        openedEntryCaches[(options.cacheFile, configHash)] = cache
+    return cache
+
+
+### Rules ###
+
+
+class FieldRule(object):
+    # A check of the value of some fields, see fieldRule
+
+    __slots__ = (
+        "ruleId",
+        "fieldNames",
+        "entryTypes",
+        "check",
+        "counterName",
+        "enabled",
+        "module",
+    )
 
-    if line[-1] != ",":
-        entryProblems.append("missing comma at '@" + entryId + "' definition")
-        counterMissingCommas += 1
+    def __init__(
+        self, ruleId, fieldNames, entryTypes, check, counterName, enabled, module=None
+    ):
+        self.ruleId = ruleId
+        self.fieldNames = fieldNames
+        self.entryTypes = entryTypes  # None for every type
+        self.check = check
+        self.counterName = counterName
+        self.enabled = enabled  # unless enabled or disabled explicitly
+        # the rule module that registered it, only checked when the options
+        # load that module; None for the rules of this one
+        self.module = module
+
+
+# rule ID -> FieldRule, run in the order they were registered
+fieldRules = {}
+fieldRuleOrder = []
+# the rule module loadRuleModules is importing
+loadingRuleModule = None
+
+
+def fieldRule(
+    ruleId,
+    severity,
+    description,
+    fieldNames,
+    entryTypes=None,
+    counterName=None,
+    enabled=True,
+):
+    # Decorator registering check(fieldValue) as a rule run on the given
+    # (lower case) fields of entries of the given types, all if None. It is
+    # passed the value without the braces or quotes around it (see
+    # unwrapFieldValue) and returns a list of problem messages, empty if
+    # there are none. counterName is the
+    # CheckResult counter they count towards, e.g. "counterFlawedNames";
+    # without one they are reported but don't count towards the number of
+    # problems and exit code, like warnings. Rules registered with
+    # enabled=False only run when enabled explicitly (--enable-rule).
+    # Modules loaded with --rules-module register theirs the same way:
+    #
+    #   from biblatex_check import fieldRule
+    #
+    #   @fieldRule("doi-url", "warning", "DOI given as a URL", ["doi"])
+    #   def checkDoiUrl(fieldValue):
+    #       return ["doi given as a URL"] if "doi.org/" in fieldValue else []
+    def register(check):
+        if ruleId in problemRules and ruleId not in fieldRules:
+            raise ValueError("Rule '" + ruleId + "' is already defined")
+        if ruleId not in fieldRules:
+            fieldRuleOrder.append(ruleId)
+        problemRules[ruleId] = (severity, description)
+        fieldRules[ruleId] = FieldRule(
+            ruleId,
+            frozenset(fieldNames),
+            None if entryTypes is None else frozenset(entryTypes),
+            check,
+            counterName,
+            enabled,
+            loadingRuleModule,
+        )
+        return check
 
-    if entryId in entriesIds:
-        entryProblems.append("non-unique id: '" + entryId + "'")
-        counterNonUniqueId += 1
-    else:
-        entriesIds.append(entryId)
+    return register
 
-    entryType = line.split("{")[0].strip("@ ")
-    entryHTML = line + "<br />"
 
+###############################################################
+# Checks (please (de)activate/extend to your needs)
+###############################################################
 
-def handleEntryEnding(lineNumber, line):
-    global entryArticleId, entryAuthor, entryFields, entryHTML, entryId, entryProblems, entryTitle, entryType
-    global counterMissingFields, counterMissingCommas, removePunctuationMap
-    global entriesProblemsHTML
-    global lastLine
 
-    # Last line of entry is allowed to have missing comma
-    if lastLine == lineNumber - 1:
-        entryProblems = entryProblems[:-1]
-        counterMissingCommas -= 1
+@fieldRule(
+    "author-name",
+    "warning",
+    "Author with too few or too many name components",
+    ["author"],
+)
+def checkAuthorNames(fieldValue):
+    return checkNames(fieldValue, "author")
 
-    # Support for type aliases
-    entryFields = list(map(
-        lambda typeName: fieldAliases.get(typeName)
-        if typeName in fieldAliases
-        else typeName,
-        entryFields,
-    ))
 
-    entryHTML += line + "<br />"
+@fieldRule(
+    "editor-name",
+    "warning",
+    "Editor with too few or too many name components",
+    ["editor"],
+)
+def checkEditorNames(fieldValue):
+    return checkNames(fieldValue, "editor")
+
+
+def checkNames(fieldValue, fieldName):
+    problems = []
+    if "," not in fieldValue:
+        # names without commas are never missing a part
+        return problems
+    messages = nameProblemMessages[fieldName]
+    for name in splitNames(fieldValue):
+        if "," in name:
+            for problem in parseName(name).problems:
+                problems.append(messages[problem])
+    return problems
+
+
+# check if type 'proceedings' might be 'inproceedings'
+@fieldRule(
+    "proceedings-pages",
+    "error",
+    "Proceedings with page numbers",
+    ["pages"],
+    ["proceedings"],
+    "counterWrongTypes",
+)
+def checkProceedingsPages(fieldValue):
+    return ["wrong type: maybe should be 'inproceedings' because entry has page numbers"]
+
+
+# check if abbreviations are used in journal titles
+@fieldRule(
+    "abbreviated-journal",
+    "error",
+    "Abbreviated journal title",
+    ["journal", "journaltitle"],
+    ["article"],
+    "counterFlawedNames",
+)
+def checkAbbreviatedJournal(fieldValue):
+    if "." in fieldValue:
+        return ["flawed name: abbreviated journal title '" + fieldValue + "'"]
+    return []
+
+
+# check booktitle format; expected format "ICBAB '13: Proceeding of the 13th International Conference on Bla and Blubb"
+@fieldRule(
+    "booktitle-format",
+    "error",
+    "Inconsistent formatting of booktitle",
+    ["booktitle"],
+    ["inproceedings"],
+    "counterFlawedNames",
+    enabled=False,
+)
+def checkBooktitleFormat(fieldValue):
+    if (
+        ":" not in fieldValue
+        or ("Proceedings" not in fieldValue and "Companion" not in fieldValue)
+        or "." in fieldValue
+        or " '" not in fieldValue
+        or "workshop" in fieldValue
+        or "conference" in fieldValue
+        or "symposium" in fieldValue
+    ):
+        return ["flawed name: inconsistent formatting of booktitle '" + fieldValue + "'"]
+    return []
+
+
+# check if title is capitalized (heuristic)
+@fieldRule(
+    "title-capitalization",
+    "error",
+    "Title not capitalized",
+    ["title"],
+    counterName="counterFlawedNames",
+    enabled=False,
+)
+def checkTitleCapitalization(fieldValue):
+    title = fieldValue.replace("{", "").replace("}", "")
+    for word in title.split(" "):
+        word = word.strip(":")
+        if (
+            len(word) > 7
+            and word[0].islower()
+            and "-" not in word
+            and "_" not in word
+            and "[" not in word
+        ):
+            return ["flawed name: non-capitalized title '" + title + "'"]
+    return []
+
+
+# fields handleEntryField reads for the report, besides those of the rules
+reportFieldNames = frozenset(("author", "citeulike-article-id", "title"))
+
+
+def enabledRuleIds(options):
+    # The rule ID's checked with the given CheckOptions, raises ValueError
+    # for unknown ones and ImportError for rule modules that can't be loaded
+    loadRuleModules(options.ruleModules)
+    # the rules of modules loaded for other options don't count
+    knownRules = set(
+        ruleId
+        for ruleId in problemRules
+        if ruleId not in fieldRules
+        or fieldRules[ruleId].module is None
+        or fieldRules[ruleId].module in options.ruleModules
+    )
+    for ruleId in itertools.chain(options.enabledRules, options.disabledRules):
+        if ruleId not in knownRules:
+            raise ValueError("Unknown rule '" + ruleId + "'")
+    enabledRules = set(
+        ruleId
+        for ruleId in knownRules
+        if ruleId not in optionalRules
+        and (ruleId not in fieldRules or fieldRules[ruleId].enabled)
+    )
+    enabledRules.update(options.enabledRules)
+    enabledRules.difference_update(options.disabledRules)
+    return frozenset(enabledRules)
+
+
+def compileFieldRules(enabledRules):
+    # The enabled field rules as field name -> rules for the entry types
+    # without rules of their own, and entry type -> such a dict for the
+    # others, so each field only runs the rules that apply to it. The fields
+    # read for the report (and duplicate-reference) are in them too, maybe
+    # without rules.
+    readFieldNames = reportFieldNames
+    if "duplicate-reference" in enabledRules:
+        readFieldNames = readFieldNames | frozenset(("doi",))
+    defaultFieldRules = dict((fieldName, ()) for fieldName in readFieldNames)
+    typedFieldRules = {}
+    for ruleId in fieldRuleOrder:
+        if ruleId not in enabledRules:
+            continue
+        rule = fieldRules[ruleId]
+        if rule.entryTypes is None:
+            dispatches = [defaultFieldRules] + list(typedFieldRules.values())
+        else:
+            dispatches = []
+            for entryType in rule.entryTypes:
+                if entryType not in typedFieldRules:
+                    typedFieldRules[entryType] = dict(defaultFieldRules)
+                dispatches.append(typedFieldRules[entryType])
+        for entryFieldRules in dispatches:
+            for fieldName in rule.fieldNames:
+                entryFieldRules[fieldName] = entryFieldRules.get(fieldName, ()) + (rule,)
+    return defaultFieldRules, typedFieldRules
+
+
+# module name or .py path -> module, see loadRuleModules
+loadedRuleModules = {}
+
+
+def loadRuleModules(moduleNames):
+    # Import modules (by name, or the path of a .py file) that register rules
+    # with fieldRule; each is only loaded once, its rules remember it
+    global loadingRuleModule
+    for moduleName in moduleNames:
+        if moduleName in loadedRuleModules:
+            continue
+        # they import this module, which is __main__ when run as a script
+        sys.modules.setdefault("biblatex_check", sys.modules[__name__])
+        loadingRuleModule = moduleName
+        try:
+            if moduleName.endswith(".py"):
+                loadedRuleModules[moduleName] = loadModuleFile(moduleName)
+            else:
+                loadedRuleModules[moduleName] = __import__(moduleName, fromlist=["*"])
+        finally:
+            loadingRuleModule = None
+
+
+def loadModuleFile(path):
+    name = os.path.splitext(os.path.basename(path))[0]
+    if sys.version_info[0] > 2:
+        import importlib.util
+
+        spec = importlib.util.spec_from_file_location(name, path)
+        if spec is None:
+            raise ImportError("Can't load rules from '" + path + "'")
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+    import imp
 
-    if entryId in usedIds or not usedIds:
-        entryRequiredFields = requiredEntryFields.get(entryType.lower())
-        entryRequiredFields = resolveAliasedRequiredFields(
-            entryRequiredFields, requiredEntryFields
-        )
+    try:
+        return imp.load_source(name, path)
+    except IOError as e:
+        raise ImportError(str(e))
 
-        for requiredEntryField in entryRequiredFields:
-            # support for author/editor syntax
-            requiredEntryField = requiredEntryField.split("/")
 
-            # at least one the required fields is not found
-            if set(requiredEntryField).isdisjoint(entryFields):
-                entryProblems.append(
-                    "missing field '" + "/".join(requiredEntryField) + "'"
+def readRulesConfig(rulesFile):
+    # Rule settings, one per line: "<rule ID> on", "<rule ID> off" or
+    # "import <module or file.py>"; '#' starts a comment. Returns the lists
+    # of rules to enable, rules to disable and modules to load.
+    enabledRules, disabledRules, ruleModules = [], [], []
+    fIn = open(rulesFile, "r", encoding="utf8")
+    try:
+        for line in fIn:
+            parts = line.split("#")[0].split()
+            if not parts:
+                continue
+            if len(parts) == 2 and parts[0] == "import":
+                ruleModules.append(parts[1])
+            elif len(parts) == 2 and parts[1] in ("on", "off"):
+                (enabledRules if parts[1] == "on" else disabledRules).append(parts[0])
+            else:
+                raise ValueError(
+                    "Expected '<rule> on', '<rule> off' or 'import <module>' in line '"
+                    + line.strip()
+                    + "'"
                 )
-                counterMissingFields += 1
+    finally:
+        fIn.close()
+    return enabledRules, disabledRules, ruleModules
+
+
+### Checker ###
+
+
+class KeyIndex(object):
+    # Hashed index of reference ID's, remembering where each was first defined.
+    # An index can be built up front, e.g. for a chunk of a file: its
+    # pendingKeys are those whose first definition is still to be added.
+
+    def __init__(self, caseInsensitive=False, firstDefinitions=None, pendingKeys=None):
+        self.caseInsensitive = caseInsensitive
+        self.firstDefinitions = firstDefinitions or {}
+        self.pendingKeys = pendingKeys or set()
+
+    def __contains__(self, entryId):
+        return self.normalize(entryId) in self.firstDefinitions
+
+    def __len__(self):
+        return len(self.firstDefinitions)
+
+    def normalize(self, entryId):
+        return entryId.lower() if self.caseInsensitive else entryId
+
+    def add(self, entryId, lineNumber):
+        # Returns the (id, line number) of an earlier definition, if any
+        key = self.normalize(entryId)
+        firstDefinition = self.firstDefinitions.get(key)
+        if firstDefinition is None:
+            self.firstDefinitions[key] = (entryId, lineNumber)
+        elif key in self.pendingKeys:
+            # the index was built up front and this is the first definition
+            self.pendingKeys.discard(key)
+            return None
+        return firstDefinition
+
+    def addPending(self, entryId, lineNumber):
+        # add when building an index up front, the ID's first definition is
+        # then added (again) as the entries are checked
+        if self.add(entryId, lineNumber) is None:
+            self.pendingKeys.add(self.normalize(entryId))
+
+    def subset(self, entryIds, firstIds=()):
+        # Index of only the given ID's, e.g. those defined in one chunk, of
+        # which firstIds are first defined there
+        firstDefinitions = {}
+        for entryId in entryIds:
+            key = self.normalize(entryId)
+            firstDefinitions[key] = self.firstDefinitions[key]
+        pendingKeys = set(self.normalize(entryId) for entryId in firstIds)
+        return KeyIndex(self.caseInsensitive, firstDefinitions, pendingKeys)
+
+
+# LaTeX commands, e.g. \emph or the accent in {\"o}
+latexCommandPattern = re.compile(r"\\(?:[a-zA-Z]+|.)")
+# like removePunctuationMap, but punctuation separates words when titles are
+# compared, "state-of-the-art" is the same as "state of the art"
+titleWordPattern = re.compile(r"[^\W_]+", re.UNICODE)
+doiPrefixPattern = re.compile(
+    r"^(?:https?://(?:dx\.)?doi\.org/|doi:)\s*", re.IGNORECASE
+)
 
-    else:
-        entryProblems = []
 
-    if entryId in usedIds or (entryId and not usedIds):
-        entryProblemsHTML = generateEntryProblemsHTML(
-            entryHTML,
-            entryId,
-            entryType,
-            entryArticleId,
-            entryTitle,
-            entryProblems,
-            entryAuthor,
-            lineNumber,
+def normalizeTitle(title):
+    # The words of a title in lower case, without LaTeX commands, braces or
+    # punctuation
+    return titleWordPattern.findall(latexCommandPattern.sub("", title).lower())
+
+
+def normalizeDoi(doi):
+    return doiPrefixPattern.sub("", doi.strip()).lower()
+
+
+# Titles count as similar when their Jaccard index (words in common / words
+# in either) is at least similarTitleThreshold. Words are ordered by a hash,
+# and a title of n words has at least two of its first
+# n - ceil(n * threshold) + 2 words in that order in common with any similar
+# title's first words. Each title is indexed under the pairs of those words,
+# so it's only compared with the titles sharing such a pair.
+similarTitleThreshold = 0.8
+# shorter titles are too common to tell similar ones apart, they are only
+# duplicates when the same
+minTitleWords = 4
+# titles kept per pair of words; a pair shared by more titles is too common
+# to tell anything and is passed over, so each title is compared with few
+maxTitlesPerPair = 16
+# word -> its hash, bounded like fieldNameKeys
+wordHashes = {}
+maxWordHashes = 100000
+
+
+def hashWord(word):
+    # crc32, unsigned as on Python 3, so both versions index the same words
+    wordHash = wordHashes.get(word)
+    if wordHash is None:
+        wordHash = zlib.crc32(word.encode("utf8")) & 0xFFFFFFFF
+        if len(wordHashes) < maxWordHashes:
+            wordHashes[word] = wordHash
+    return wordHash
+
+
+class ReferenceIndex(object):
+    # Hashed index of the normalized DOI's and titles of a file's entries, to
+    # tell when an entry is probably the same reference as an earlier one
+    # under another ID. Similar titles are found through the first words of
+    # each title, see similarTitleThreshold, instead of comparing every pair.
+
+    def __init__(self):
+        self.dois = {}  # normalized DOI -> (id, line number)
+        self.titles = {}  # normalized title -> (id, line number)
+        # (id, line number, sorted word hashes) of the indexed titles
+        self.similarTitles = []
+        # hashes of two words -> index, or indexes, into similarTitles
+        self.pairTitles = {}
+
+    def add(self, entryId, lineNumber, title, doi=""):
+        # Returns (description, id, line number) of an earlier entry this
+        # one duplicates, if any
+        duplicate = None
+        doi = normalizeDoi(doi) if doi else ""
+        if doi:
+            first = self.dois.get(doi)
+            if first is None:
+                self.dois[doi] = (entryId, lineNumber)
+            elif first[0] != entryId:
+                duplicate = ("same doi as",) + first
+
+        words = normalizeTitle(title)
+        if not words:
+            return duplicate
+        normalizedTitle = " ".join(words)
+        first = self.titles.get(normalizedTitle)
+        if first is not None:
+            # the same title is already indexed for the similar ones
+            if duplicate is None and first[0] != entryId:
+                duplicate = ("same title as",) + first
+            return duplicate
+        self.titles[normalizedTitle] = (entryId, lineNumber)
+        # short titles are only compared whole, a word or two in common
+        # would make them similar
+        if len(words) < minTitleWords:
+            return duplicate
+
+        # hashes rather than words, and a single title per pair as a plain
+        # index, keep the garbage collector from scanning the index
+        wordHashes = sorted(set(map(hashWord, words)))
+        wordCount = len(wordHashes)
+        prefixLength = wordCount - int(math.ceil(wordCount * similarTitleThreshold))
+        prefixLength += 2
+        index = len(self.similarTitles)
+        self.similarTitles.append((entryId, lineNumber, tuple(wordHashes)))
+        pairTitles = self.pairTitles
+        compared = set()
+        for first, second in itertools.combinations(wordHashes[:prefixLength], 2):
+            pair = first << 32 | second
+            indexes = pairTitles.get(pair)
+            if indexes is None:
+                pairTitles[pair] = index
+                continue
+            if not isinstance(indexes, list):
+                indexes = pairTitles[pair] = [indexes]
+            elif len(indexes) >= maxTitlesPerPair:
+                continue
+            if duplicate is None:
+                duplicate = self.findSimilarTitle(
+                    entryId, wordHashes, indexes, compared
+                )
+            indexes.append(index)
+        return duplicate
+
+    def findSimilarTitle(self, entryId, wordHashes, indexes, compared):
+        wordCount = len(wordHashes)
+        wordHashes = frozenset(wordHashes)
+        for other in indexes:
+            if other in compared:
+                continue
+            compared.add(other)
+            otherId, otherLineNumber, otherWordHashes = self.similarTitles[other]
+            otherWordCount = len(otherWordHashes)
+            # the Jaccard index is at most the ratio of their lengths
+            if (
+                min(wordCount, otherWordCount)
+                < similarTitleThreshold * max(wordCount, otherWordCount)
+                or otherId == entryId
+            ):
+                continue
+            common = len(wordHashes.intersection(otherWordHashes))
+            if common >= similarTitleThreshold * (wordCount + otherWordCount - common):
+                return ("similar title to", otherId, otherLineNumber)
+        return None
+
+    def check(self, entry, result):
+        # Add the duplicate-reference problem to a checked entry, if any. The
+        # same ID defined twice is left to non-unique-id.
+        duplicate = self.add(entry.id, entry.lineNumber, entry.title, entry.doi)
+        if duplicate is None:
+            return
+        description, firstId, firstLineNumber = duplicate
+        problem = (
+            "duplicate-reference",
+            "duplicate reference: "
+            + description
+            + " '"
+            + firstId
+            + "' (line "
+            + str(firstLineNumber)
+            + ")",
+        )
+        entry.problems += (problem,)
+        if result.stats is not None:
+            result.stats.addProblems((problem,))
+
+
+# raw entry type -> (entry type, lower case type), both shared by all entries
+entryTypeNames = {}
+# raw field name -> lower case field name, shared by all entries; bounded in
+# case a broken file makes up many names
+fieldNameKeys = {}
+maxFieldNameKeys = 10000
+# required field -> its "missing field" problem, shared by all entries
+missingFieldProblems = {}
+
+
+def internEntryType(entryType):
+    typeNames = entryTypeNames.get(entryType)
+    if typeNames is None:
+        typeNames = (entryType, entryType.lower())
+        if len(entryTypeNames) < maxFieldNameKeys:
+            entryTypeNames[entryType] = typeNames
+    return typeNames
+
+
+class Checker(object):
+    # Checks bib files one after the other, keeping no state between runs.
+    # usedIds restricts the check to the given reference ID's (all if empty).
+
+    def __init__(self, usedIds=None, options=None, cache=None):
+        self.usedIds = set(usedIds or ())
+        self.options = options or CheckOptions()
+        self.sampleRate = self.options.sampleRate
+        self.enabledRules = enabledRuleIds(self.options)
+        self.defaultFieldRules, self.typedFieldRules = compileFieldRules(
+            self.enabledRules
         )
-        entriesProblemsHTML.append(entryProblemsHTML)
+        self.cache = cache
+        if cache is None and self.options.cacheFile:
+            self.cache = openEntryCache(self.options)
+        if self.options.collectStats:
+            self.instrument()
+
+    def instrument(self):
+        # Time the checks into result.stats. The methods are wrapped on this
+        # instance only, so checkers without stats pay nothing for them.
+        def timedPhase(phase, method):
+            def timed(*args):
+                stats = self.result.stats
+                stats.enter(phase)
+                try:
+                    return method(*args)
+                finally:
+                    stats.leave()
+
+            return timed
+
+        def timedCheck(check, method):
+            def timed(*args):
+                started = time.time()
+                try:
+                    return method(*args)
+                finally:
+                    self.result.stats.addCheck(
+                        check(*args) if callable(check) else check,
+                        time.time() - started,
+                    )
 
+            return timed
 
-def handleEntryLine(lineNumber, line):
-    global entryHTML, entryId
-    global usedIds
+        checkEntry = timedPhase("check", self.checkEntry)
 
-    if line != "":
-        entryHTML += line + "<br />"
+        def countingCheckEntry(bibEntry):
+            entry = checkEntry(bibEntry)
+            if entry is not None:
+                self.result.stats.addProblems(entry.problems)
+            return entry
 
-    if entryId in usedIds or not usedIds:
-        if "=" in line:
-            handleEntryField(lineNumber, line)
+        self.checkEntry = countingCheckEntry
 
+        checkSkippedEntry = self.checkSkippedEntry
 
-def handleEntryField(lineNumber, line):
-    global entryArticleId, entryAuthor, entryFields, entryHTML, entryId, entryProblems, entryTitle, entryType
-    global counterFlawedNames, counterWrongTypes, counterWrongFieldNames, counterMissingCommas
-    global lastLine
+        def countingCheckSkippedEntry(bibEntry):
+            counts = self.result.stats.counts
+            counts["skipped entries"] = counts.get("skipped entries", 0) + 1
+            counts["skipped chars"] = (
+                counts.get("skipped chars", 0) + bibEntry.end - bibEntry.start
+            )
+            return checkSkippedEntry(bibEntry)
+
+        self.checkSkippedEntry = countingCheckSkippedEntry
+        self.lookupCachedEntry = timedPhase("cache", self.lookupCachedEntry)
+        self.storeCachedEntry = timedPhase("cache", self.storeCachedEntry)
+        self.checkCachedEntry = timedCheck("cached entry", self.checkCachedEntry)
+        self.handleNewEntryStarting = timedCheck(
+            "entry header", self.handleNewEntryStarting
+        )
+        self.handleEntryEnding = timedCheck("required fields", self.handleEntryEnding)
+
+        # each field rule is timed on its own, through copies in this
+        # checker's dispatch dicts, the registered rules stay as they are
+        timedRules = {}
+
+        def timedRule(rule):
+            timed = timedRules.get(rule.ruleId)
+            if timed is None:
+                timed = timedRules[rule.ruleId] = FieldRule(
+                    rule.ruleId,
+                    rule.fieldNames,
+                    rule.entryTypes,
+                    timedCheck("rule '" + rule.ruleId + "'", rule.check),
+                    rule.counterName,
+                    rule.enabled,
+                    rule.module,
+                )
+            return timed
 
-    fieldName = line.split("=")[0].strip().lower()  # biblatex is not case sensitive
-    fieldValue = line.split("=")[1].strip(", \n").strip("{} \n")
+        def timedFieldRules(entryFieldRules):
+            return dict(
+                (fieldName, tuple(timedRule(rule) for rule in rules))
+                for fieldName, rules in entryFieldRules.items()
+            )
 
-    entryFields.append(fieldName)
+        self.defaultFieldRules = timedFieldRules(self.defaultFieldRules)
+        self.typedFieldRules = dict(
+            (entryType, timedFieldRules(entryFieldRules))
+            for entryType, entryFieldRules in self.typedFieldRules.items()
+        )
 
-    # Checks per field type
-    if fieldName == "author":
-        entryAuthor = "".join(filter(lambda x: not (x in '\\"{}'), fieldValue.split(" and ")[0]))
-        for author in fieldValue.split(" and "):
-            comp = author.split(",")
-            if len(comp) == 0:
-                entryProblems.append(
-                    "too little name components for an author in field 'author'"
+    def startStats(self, result):
+        # result.stats if the options ask for them, else None
+        if not self.options.collectStats:
+            return None
+        if result.stats is None:
+            result.stats = CheckStats()
+        return result.stats
+
+    def check(self, fIn, bibFile=None, auxFile=None):
+        result = CheckResult(bibFile, auxFile)
+        for entry in self.iterCheck(fIn, result):
+            result.entries.append(entry)
+        return result
+
+    def iterCheck(self, fIn, result, firstLineNumber=0, keyIndex=None):
+        # Yields every entry as soon as it is closed, counters go to result
+        blocks = readBibBlocks(fIn, self.options.mmapInput, firstLineNumber)
+        return self.iterCheckBlocks(blocks, result, keyIndex)
+
+    def iterCheckBlocks(self, blocks, result, keyIndex=None):
+        # Like iterCheck for (first line number, text) blocks. A part of a
+        # larger file is checked by passing a keyIndex holding the first
+        # definition of each of its ID's.
+        lookupEntry = self.lookupCachedEntry if self.cache is not None else None
+        # entries that aren't cited (or sampled) are cut at their header,
+        # without fields
+        skipEntry = None
+        if self.usedIds or self.sampleRate is not None:
+            skipEntry = self.isSkipped
+        stats = self.startStats(result)
+        if stats is not None:
+            blocks = stats.timedIter("read", blocks, "lines", countBlockLines)
+        if self.options.changedLines is not None:
+            bibEntries = iterChangedBibEntries(
+                blocks,
+                self.options.changedLines.get(result.bibFile, []),
+                skipEntry,
+                lookupEntry,
+                self.options.caseInsensitiveIds,
+            )
+        else:
+            bibEntries = (
+                bibEntry
+                for blockLineNumber, blockText in blocks
+                for bibEntry in parseBibEntries(
+                    blockText, blockLineNumber, skipEntry, lookupEntry
                 )
-            elif len(comp) > 2:
-                entryProblems.append(
-                    "too many name components for an author in field 'author'"
+            )
+        if stats is not None:
+            bibEntries = stats.timedIter("parse", bibEntries, "entries")
+        if self.options.stopAfterCited and self.usedIds and keyIndex is None:
+            bibEntries = self.untilAllCited(bibEntries, result)
+        return self.iterCheckEntries(bibEntries, result, keyIndex)
+
+    def untilAllCited(self, bibEntries, result):
+        # The entries up to the last cited one, the rest aren't read. A later
+        # duplicate of a cited ID goes unnoticed.
+        remainingIds = set(self.usedIds)
+        for bibEntry in bibEntries:
+            yield bibEntry
+            remainingIds.discard(bibEntry.id)
+            if not remainingIds:
+                result.messages.append(
+                    "INFO: Found every cited entry by line {}, not checking the"
+                    " rest".format(bibEntry.endLine + 1)
                 )
-            elif len(comp) == 2:
-                if comp[0].strip() == "":
-                    entryProblems.append(
-                        "last name of an author in field 'author' empty"
-                    )
-                if comp[1].strip() == "":
-                    entryProblems.append(
-                        "first name of an author in field 'author' empty"
+                return
+
+    def iterCheckEntries(self, bibEntries, result, keyIndex=None):
+        # Like iterCheckBlocks for parsed entries. Duplicate references are
+        # only looked for in whole files, the parts of a file checked with a
+        # keyIndex leave them to runParallelCheckJob.
+        self.result = result
+        self.startStats(result)
+        self.entriesIds = keyIndex or KeyIndex(self.options.caseInsensitiveIds)
+        self.resetEntry()
+        referenceIndex = None
+        if keyIndex is None and "duplicate-reference" in self.enabledRules:
+            referenceIndex = ReferenceIndex()
+
+        for bibEntry in bibEntries:
+            entry = self.checkEntry(bibEntry)
+            if entry is not None:
+                if referenceIndex is not None:
+                    referenceIndex.check(entry, result)
+                yield entry
+
+    def isSkipped(self, entryType, entryId):
+        if self.usedIds and entryId not in self.usedIds:
+            return True
+        return self.sampleRate is not None and not isSampledId(
+            entryId, self.sampleRate
+        )
+
+    def checkEntry(self, bibEntry):
+        if bibEntry.skipped:
+            return self.checkSkippedEntry(bibEntry)
+        if bibEntry.cached is not None:
+            return self.checkCachedEntry(bibEntry)
+
+        counters = None
+        if bibEntry.cacheable:
+            counters = CheckResult.getCounters(self.result)
+
+        if not self.handleNewEntryStarting(bibEntry):
+            return None
+
+        entryFields = self.entryFields
+        entryFieldRules = self.entryFieldRules
+        for fieldName, fieldValue, comma in bibEntry.fields:
+            # biblatex is not case sensitive
+            fieldKey = fieldNameKeys.get(fieldName)
+            if fieldKey is None:
+                fieldKey = fieldName.lower()
+                if len(fieldNameKeys) < maxFieldNameKeys:
+                    fieldNameKeys[fieldName] = fieldKey
+            fieldName = fieldKey
+            entryFields.append(fieldName)
+
+            rules = entryFieldRules.get(fieldName)
+            if rules is not None:
+                self.handleEntryField(fieldName, fieldValue, rules)
+
+            # check for commas between fields
+            if not comma and "missing-comma" in self.enabledRules:
+                self.entryProblems.append(
+                    (
+                        "missing-comma",
+                        "missing comma at end of line, at '"
+                        + fieldName
+                        + "' field definition.",
                     )
+                )
+                self.result.counterMissingCommas += 1
+
+        entry = self.handleEntryEnding(bibEntry)
+        if counters is not None:
+            self.storeCachedEntry(bibEntry, entry, counters)
+        return entry
+
+    def lookupCachedEntry(self, source):
+        digest = entryDigest(source)
+        cached = self.cache.get(digest)
+        if cached is not None:
+            self.result.cacheHits.append(digest)
+        return cached
+
+    def storeCachedEntry(self, bibEntry, entry, countersBefore):
+        # Cache what checkEntry found, apart from the non-unique ID problem
+        result = self.result
+        problems = entry.problems
+        counters = []
+        for name, before, after in zip(
+            CheckResult.counterNames, countersBefore, CheckResult.getCounters(result)
+        ):
+            count = after - before
+            if name == "counterNonUniqueId":
+                if count:
+                    problems = list(problems)
+                    del problems[self.entryHeaderProblemCount]
+            elif count:
+                counters.append((name, count))
+
+        result.cacheUpdates[entryDigest(bibEntry.source)] = (
+            entry.articleId,
+            entry.title,
+            entry.author,
+            tuple(problems),
+            self.entryHeaderProblemCount,
+            tuple(counters),
+            entry.doi,
+        )
+
+    def checkSkippedEntry(self, bibEntry):
+        # An entry that isn't cited, its ID still makes later ones non-unique.
+        # One redefining the ID of a changed entry is reported as non-unique.
+        firstDefinition = self.entriesIds.add(bibEntry.id, bibEntry.endLine)
+        if (
+            not bibEntry.duplicatesChanged
+            or firstDefinition is None
+            or "non-unique-id" not in self.enabledRules
+        ):
+            return None
+        self.result.counterNonUniqueId += 1
+        return EntryResult(
+            bibEntry.id,
+            internEntryType(bibEntry.type)[0],
+            "",
+            "",
+            "",
+            bibEntry.endLine,
+            (generateNonUniqueIdProblem(bibEntry.id, *firstDefinition),),
+            bibEntry.source,
+            self.result.bibFile,
+            bibEntry.startLine,
+        )
+
+    def checkCachedEntry(self, bibEntry):
+        # An unchanged entry, only the checks involving other entries are run
+        firstDefinition = self.entriesIds.add(bibEntry.id, bibEntry.endLine)
+        if (self.usedIds or self.sampleRate is not None) and self.isSkipped(
+            bibEntry.type, bibEntry.id
+        ):
+            return None
+        if "non-unique-id" not in self.enabledRules:
+            firstDefinition = None
+
+        result = self.result
+        (
+            articleId,
+            title,
+            author,
+            problems,
+            headerProblemCount,
+            counters,
+            doi,
+        ) = bibEntry.cached
+        for name, count in counters:
+            setattr(result, name, getattr(result, name) + count)
+
+        if firstDefinition is not None:
+            problems = (
+                problems[:headerProblemCount]
+                + (generateNonUniqueIdProblem(bibEntry.id, *firstDefinition),)
+                + problems[headerProblemCount:]
+            )
+            result.counterNonUniqueId += 1
+
+        return EntryResult(
+            bibEntry.id,
+            internEntryType(bibEntry.type)[0],
+            articleId,
+            title,
+            author,
+            bibEntry.endLine,
+            problems,
+            bibEntry.source,
+            result.bibFile,
+            bibEntry.startLine,
+            doi,
+        )
+
+    def resetEntry(self):
+        self.entryArticleId = ""
+        self.entryAuthor = ""
+        self.entryDoi = ""
+        self.entryFieldRules = self.defaultFieldRules  # see compileFieldRules
+        self.entryFields = []
+        self.entryId = ""
+        self.entryHeaderProblemCount = 0  # problems found in the '@type{id,' line
+        self.entryProblems = []
+        self.entryTitle = ""
+        self.entryType = ""
+        self.entryTypeName = ""
+
+    def handleNewEntryStarting(self, bibEntry):
+        # Returns whether the entry is to be checked
+        self.resetEntry()
+        self.entryType, self.entryTypeName = internEntryType(bibEntry.type)
+        self.entryFieldRules = self.typedFieldRules.get(
+            self.entryTypeName, self.defaultFieldRules
+        )
+        self.entryId = bibEntry.id
+
+        firstDefinition = self.entriesIds.add(self.entryId, bibEntry.endLine)
+
+        if (self.usedIds or self.sampleRate is not None) and self.isSkipped(
+            self.entryType, self.entryId
+        ):
+            return False
+
+        if not bibEntry.headerComma and "missing-comma" in self.enabledRules:
+            self.entryProblems.append(
+                ("missing-comma", "missing comma at '@" + self.entryId + "' definition")
+            )
+            self.result.counterMissingCommas += 1
+        self.entryHeaderProblemCount = len(self.entryProblems)
 
-    elif fieldName == "citeulike-article-id":
-        entryArticleId = fieldValue
+        if firstDefinition is not None and "non-unique-id" in self.enabledRules:
+            self.entryProblems.append(
+                generateNonUniqueIdProblem(self.entryId, *firstDefinition)
+            )
+            self.result.counterNonUniqueId += 1
+
+        return True
 
-    elif fieldName == "title":
-        entryTitle = re.sub(r"\}|\{", r"", fieldValue)
+    def handleEntryEnding(self, bibEntry):
+        enabledRules = self.enabledRules
+        if not bibEntry.terminated and "missing-closing-brace" in enabledRules:
+            self.entryProblems.append(
+                (
+                    "missing-closing-brace",
+                    "missing closing brace at end of '@" + self.entryId + "' definition",
+                )
+            )
 
-    ###############################################################
-    # Checks (please (de)activate/extend to your needs)
-    ###############################################################
+        entryRules = requiredFieldRules.get(self.entryTypeName)
+        if entryRules is None and "unknown-type" in enabledRules:
+            self.entryProblems.append(
+                (
+                    "unknown-type",
+                    "unknown entry type '" + self.entryType + "', checked as 'misc'",
+                )
+            )
+        if entryRules is None:
+            entryRules = unknownTypeRules
+        if "missing-field" not in enabledRules:
+            entryRules = ()
 
-    # check if type 'proceedings' might be 'inproceedings'
-    elif entryType == "proceedings" and fieldName == "pages":
-        entryProblems.append(
-            "wrong type: maybe should be 'inproceedings' because entry has page numbers"
+        entryFields = self.entryFields
+        for requiredEntryField, fieldNames in entryRules:
+            # at least one the required fields is not found
+            if fieldNames.isdisjoint(entryFields):
+                problem = missingFieldProblems.get(requiredEntryField)
+                if problem is None:
+                    problem = missingFieldProblems[requiredEntryField] = (
+                        "missing-field",
+                        "missing field '" + requiredEntryField + "'",
+                    )
+                self.entryProblems.append(problem)
+                self.result.counterMissingFields += 1
+
+        return EntryResult(
+            self.entryId,
+            self.entryType,
+            self.entryArticleId,
+            self.entryTitle,
+            self.entryAuthor,
+            bibEntry.endLine,
+            tuple(self.entryProblems),
+            bibEntry.source,
+            self.result.bibFile,
+            bibEntry.startLine,
+            self.entryDoi,
         )
-        counterWrongTypes += 1
 
-    # check if abbreviations are used in journal titles
-    elif entryType == "article" and fieldName in ("journal", "journaltitle"):
-        if "." in line:
-            entryProblems.append(
-                "flawed name: abbreviated journal title '" + fieldValue + "'"
+    def handleEntryField(self, fieldName, fieldValue, rules):
+        # Only called for the fields in entryFieldRules, with their rules
+        fieldValue = unwrapFieldValue(fieldValue)
+        if fieldName == "author":
+            firstAuthor = fieldValue.split(" and ", 1)[0]
+            if "{" in firstAuthor:
+                # maybe "{Barnes and Noble}"
+                firstAuthor = splitNames(fieldValue, 1)[0]
+            self.entryAuthor = (
+                firstAuthor.replace("\\", "")
+                .replace('"', "")
+                .replace("{", "")
+                .replace("}", "")
             )
-            counterFlawedNames += 1
 
-    # check booktitle format; expected format "ICBAB '13: Proceeding of the 13th International Conference on Bla and Blubb"
-    # if entryType == "inproceedings" and fieldName == "booktitle":
-    # if ":" not in line or ("Proceedings" not in line and "Companion" not in line) or "." in line or " '" not in line or "workshop" in line or "conference" in line or "symposium" in line:
-    # entryProblems.append("flawed name: inconsistent formatting of booktitle '"+fieldValue+"'")
-    # counterFlawedNames += 1
+        elif fieldName == "citeulike-article-id":
+            self.entryArticleId = fieldValue
+
+        elif fieldName == "title":
+            self.entryTitle = fieldValue.replace("{", "").replace("}", "")
+
+        elif fieldName == "doi":
+            self.entryDoi = fieldValue
+
+        for rule in rules:
+            messages = rule.check(fieldValue)
+            if messages:
+                for message in messages:
+                    self.entryProblems.append((rule.ruleId, message))
+                if rule.counterName is not None:
+                    setattr(
+                        self.result,
+                        rule.counterName,
+                        getattr(self.result, rule.counterName) + len(messages),
+                    )
 
-    # check if title is capitalized (heuristic)
-    # if fieldName == "title":
-    # for word in entryTitle.split(" "):
-    # word = word.strip(":")
-    # if len(word) > 7 and word[0].islower() and not  "-" in word and not "_"  in word and not "[" in word:
-    # entryProblems.append("flawed name: non-capitalized title '"+entryTitle+"'")
-    # counterFlawedNames += 1
-    # break
 
-    # check for commas at end of line
-    if line[-1] != ",":
-        entryProblems.append(
-            "missing comma at end of line, at '" + fieldName + "' field definition."
+def openBibForResult(bibFile, result):
+    result.messages.append("INFO: Reading references from '" + bibFile + "'")
+    try:
+        return open(bibFile, "r", encoding="utf8")
+    except IOError as e:
+        result.messages.append(
+            "ERROR: Input bib file '" + bibFile + "' doesn't exist or is not readable"
         )
-        counterMissingCommas += 1
-        lastLine = lineNumber
+        result.failed = True
 
 
-### Parse input file ###
+def loadAuxForResult(auxFile, result):
+    # Filter by reference ID's that are used
+    usedIds = set()
+    if auxFile:
+        result.messages.append(
+            "INFO: Filtering by references found in '" + auxFile + "'"
+        )
+        try:
+            usedIds = loadUsedIds(auxFile)
+        except IOError as e:
+            result.messages.append(
+                "WARNING: Aux file '" + auxFile + "' doesn't exist -> not restricting entries"
+            )
+    return usedIds
 
-for (bibLineNumber, bibLine) in enumerate(fIn):
-    bibLine = bibLine.strip("\n")
 
-    # Staring a new entry
-    if bibLine.startswith("@"):
-        handleNewEntryStarting(bibLine)
+def runCheckJob(job, onEntry=None):
+    # Check one (bib file, aux file) pair; runs in batch worker processes so
+    # everything it reports is returned in the result instead of printed.
+    # Given onEntry, each entry is passed to onEntry(result, entry) as soon
+    # as it is checked instead of being kept in result.entries.
+    bibFile, auxFile, options = job
+    result = CheckResult(bibFile, auxFile)
 
-    # Closing out the current entry
-    elif bibLine.startswith("}"):
-        handleEntryEnding(bibLineNumber, bibLine)
+    fIn = openBibForResult(bibFile, result)
+    if fIn is None:
+        return result
 
-    else:
-        handleEntryLine(bibLineNumber, bibLine)
+    usedIds = loadAuxForResult(auxFile, result)
 
-fIn.close()
+    checker = Checker(usedIds, options)
+    try:
+        if checker.usedIds:
+            checker.usedIds = addReferencedIdsFromFile(
+                checker.usedIds, fIn, checker.options.mmapInput
+            )
+        for entry in checker.iterCheck(fIn, result):
+            if onEntry is None:
+                result.entries.append(entry)
+            else:
+                onEntry(result, entry)
+    finally:
+        fIn.close()
+
+    return result
+
+
+def addReferencedIdsFromFile(usedIds, fIn, mmapInput=True):
+    # addReferencedIds over a bib file, which is read again from the start
+    # afterwards; streams that can't seek back are left alone
+    seekable = getattr(fIn, "seekable", None)
+    if seekable is not None and not seekable():
+        return usedIds
+    start = fIn.tell()
+    usedIds = addReferencedIds(usedIds, readBibBlocks(fIn, mmapInput))
+    fIn.seek(start)
+    return usedIds
+
+
+def countBlockLines(block):
+    return block[1].count("\n")
+
+
+def skipEveryEntry(entryType, entryId):
+    return True
+
+
+def isSampledId(entryId, sampleRate):
+    # Whether an entry is in the sample of sampleRate (0 to 1) of all
+    # entries. By a hash of its ID, so a run checks the same entries as the
+    # last one, and those of other files with the same ID's.
+    return (zlib.crc32(entryId.encode("utf8")) & 0xFFFFFFFF) < sampleRate * 2 ** 32
+
+
+def splitBibChunks(fIn, chunkCount, caseInsensitiveIds=False, mmapInput=False):
+    # Split a bib file at entry starts into about chunkCount lists of blocks.
+    # Returns [(blocks, ID's defined, ID's first defined)] and the KeyIndex
+    # of the whole file, so each chunk can tell its duplicates apart.
+    blocks = list(readBibBlocks(fIn, mmapInput))
+    keyIndex = KeyIndex(caseInsensitiveIds)
+    chunkSize = max(1, -(-len(blocks) // max(1, chunkCount)))
+
+    chunks = []
+    for start in range(0, len(blocks), chunkSize):
+        chunkBlocks = blocks[start : start + chunkSize]
+        chunkIds = []
+        firstIds = []
+        for blockLineNumber, blockText in chunkBlocks:
+            for bibEntry in parseBibEntries(blockText, blockLineNumber, skipEveryEntry):
+                if keyIndex.add(bibEntry.id, bibEntry.endLine) is None:
+                    firstIds.append(bibEntry.id)
+                chunkIds.append(bibEntry.id)
+        chunks.append((chunkBlocks, chunkIds, firstIds))
+
+    return chunks, keyIndex
+
+
+def runChunkJob(job):
+    # Check blocks from a larger bib file, see runParallelCheckJob
+    blocks, keyIndex, usedIds, bibFile, options = job
+    result = CheckResult(bibFile)
+    checker = Checker(usedIds, options)
+    for entry in checker.iterCheckBlocks(blocks, result, keyIndex):
+        result.entries.append(entry)
+    return result
+
+
+def runParallelCheckJob(job, workers, onEntry=None):
+    # Same as runCheckJob, but splits the bib file into chunks of entries
+    # checked by a pool of workers. Duplicate ID's need every chunk, so the
+    # split pass merges the ID's of all chunks into one index first and each
+    # worker is given the first definitions of its own ID's; the merged
+    # results are the same as checking the file in one go. Duplicate
+    # references are looked for here, in the entries of each chunk as it comes
+    # back. onEntry is called as each chunk comes back, as for runCheckJob.
+    bibFile, auxFile, options = job
+    result = CheckResult(bibFile, auxFile)
+
+    fIn = openBibForResult(bibFile, result)
+    if fIn is None:
+        return result
+
+    usedIds = loadAuxForResult(auxFile, result)
 
-problemCount = (
-    counterMissingFields
-    + counterFlawedNames
-    + counterWrongFieldNames
-    + counterWrongTypes
-    + counterNonUniqueId
-    + counterMissingCommas
-)
+    try:
+        # a few chunks per worker keeps them busy if entries differ in size
+        options = options or CheckOptions()
+        chunks, keyIndex = splitBibChunks(
+            fIn, workers * 4, options.caseInsensitiveIds, options.mmapInput
+        )
+    finally:
+        fIn.close()
 
-# Write out our HTML file
-if options.htmlOutput:
-    html = open(options.htmlOutput, "w", encoding="utf8")
-    html.write(
-        """<!doctype html>
-<html>
-<head>
-<meta http-equiv="Content-Type" content="text/html; charset=utf-8"/>
-<title>BibLatex Check</title>
-<style>
+    if usedIds:
+        usedIds = addReferencedIds(
+            usedIds, (block for chunk in chunks for block in chunk[0])
+        )
+    chunkJobs = [
+        (blocks, keyIndex.subset(chunkIds, firstIds), usedIds, bibFile, options)
+        for blocks, chunkIds, firstIds in chunks
+    ]
+
+    import multiprocessing
+
+    referenceIndex = None
+    if "duplicate-reference" in enabledRuleIds(options):
+        referenceIndex = ReferenceIndex()
+
+    pool = multiprocessing.Pool(workers)
+    try:
+        for chunkResult in pool.imap(runChunkJob, chunkJobs):
+            if referenceIndex is not None:
+                for entry in chunkResult.entries:
+                    referenceIndex.check(entry, chunkResult)
+            passEntries(chunkResult, onEntry, result)
+            result.merge(chunkResult)
+    finally:
+        pool.terminate()
+        pool.join()
+
+    return result
+
+
+def passEntries(result, onEntry, reportResult=None):
+    # Hand the entries a worker returned to onEntry, if given
+    if onEntry is not None:
+        for entry in result.entries:
+            onEntry(reportResult or result, entry)
+        result.entries = []
+
+
+def runCheckJobs(jobs, workers=1, onEntry=None):
+    # Results come back in the order of jobs, whichever worker finishes first.
+    # See runCheckJob for onEntry.
+    if workers > 1 and len(jobs) == 1:
+        yield runParallelCheckJob(jobs[0], workers, onEntry)
+        return
+
+    if workers <= 1:
+        for job in jobs:
+            yield runCheckJob(job, onEntry)
+        return
+
+    import multiprocessing
+
+    pool = multiprocessing.Pool(min(workers, len(jobs)))
+    try:
+        for result in pool.imap(runCheckJob, jobs):
+            passEntries(result, onEntry)
+            yield result
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def findBibFiles(paths):
+    # Expand directories (recursively) and glob patterns into sorted bib files
+    bibFiles = []
+    for path in paths:
+        if os.path.isdir(path):
+            found = []
+            for root, dirs, files in os.walk(path):
+                found.extend(
+                    os.path.join(root, name) for name in files if name.endswith(".bib")
+                )
+            bibFiles.extend(sorted(found))
+        elif glob.has_magic(path):
+            bibFiles.extend(sorted(glob.glob(path)))
+        else:
+            bibFiles.append(path)
+    return bibFiles
+
+
+def readManifest(manifestFile):
+    # One "input.bib [input.aux]" pair per line, '#' starts a comment
+    pairs = []
+    fIn = open(manifestFile, "r", encoding="utf8")
+    for line in fIn:
+        parts = line.split("#")[0].split()
+        if len(parts) == 1:
+            pairs.append((parts[0], None))
+        elif len(parts) == 2:
+            pairs.append((parts[0], parts[1]))
+        elif parts:
+            raise ValueError(
+                "Expected 'input.bib [input.aux]' in manifest line '" + line.strip() + "'"
+            )
+    fIn.close()
+    return pairs
+
+
+def checkBib(pathOrStream, aux=None, options=None):
+    # Check a bib file (path or open text stream), optionally restricted to
+    # the references cited in an aux file; returns a CheckResult
+    usedIds = loadUsedIds(aux) if aux else None
+    checker = Checker(usedIds, options)
+
+    if hasattr(pathOrStream, "read"):
+        fIn, bibFile = pathOrStream, getattr(pathOrStream, "name", None)
+    else:
+        fIn, bibFile = open(pathOrStream, "r", encoding="utf8"), pathOrStream
+    try:
+        if checker.usedIds:
+            checker.usedIds = addReferencedIdsFromFile(
+                checker.usedIds, fIn, checker.options.mmapInput
+            )
+        result = checker.check(fIn, bibFile, aux)
+    finally:
+        if fIn is not pathOrStream:
+            fIn.close()
+
+    if checker.cache is not None:
+        checker.cache.update(result)
+        checker.cache.save()
+    return result
+
+
+### Report ###
+
+
+class HTMLReport(object):
+    # Writes the HTML report while entries are still being checked. Their
+    # markup is spooled to a temporary file and only the sort key, offset and
+    # length of each entry are kept, so memory doesn't grow with the bib file.
+    # Given the reportedMarkup of an earlier report as markupCache, markup is
+    # kept in memory instead and reused for entries that are reported again.
+
+    def __init__(self, htmlOutput, showBibFile=False, markupCache=None):
+        self.htmlOutput = htmlOutput
+        self.showBibFile = showBibFile
+        self.markupCache = markupCache
+        self.entryIndex = []  # (sort key, offset, length) or (sort key, markup)
+        if markupCache is None:
+            import tempfile
+
+            self.spool = tempfile.TemporaryFile()
+            self.spoolOffset = 0
+        else:
+            self.spool = None
+            self.reportedMarkup = {}  # key -> (sort key, markup)
+
+    def addEntry(self, entry):
+        if self.markupCache is not None:
+            key = (
+                entry.source,
+                tuple(entry.problems),
+                entry.bibFile,
+                entry.lineNumber if self.showBibFile else None,
+            )
+            markup = self.markupCache.get(key)
+            if markup is None:
+                markup = self.generateMarkup(entry)
+            self.reportedMarkup[key] = markup
+            self.entryIndex.append(markup)
+            return
+
+        sortKey, entryHTML = self.generateMarkup(entry)
+        self.entryIndex.append((sortKey, self.spoolOffset, len(entryHTML)))
+        self.spool.write(entryHTML)
+        self.spoolOffset += len(entryHTML)
+
+    def generateMarkup(self, entry):
+        entryHTML = generateEntryProblemsHTML(entry, self.showBibFile).encode("utf8")
+        # entries are sorted by their opening tag, i.e. ID then severity
+        return entryHTML[: entryHTML.index(b">")], entryHTML
+
+    def readEntry(self, indexed):
+        if self.spool is None:
+            return indexed[1]
+        sortKey, offset, length = indexed
+        self.spool.seek(offset)
+        return self.spool.read(length)
+
+    def close(self, result, bibFiles=None, auxFiles=None):
+        # bibFiles/auxFiles list the inputs when result merges several files
+        html = open(self.htmlOutput, "w", encoding="utf8")
+        writeHTMLReportHead(html, result, len(self.entryIndex), bibFiles, auxFiles)
+
+        self.entryIndex.sort()
+        for sortKey, group in itertools.groupby(self.entryIndex, lambda i: i[0]):
+            group = [self.readEntry(indexed) for indexed in group]
+            # ties (e.g. duplicate ID's) are rare, these sort on their markup
+            group.sort()
+            html.write(b"".join(group).decode("utf8"))
+        if self.spool is not None:
+            self.spool.close()
+        self.entryIndex = []
+
+        html.write("</body></html>")
+        html.close()
+
+        return html.name
+
+
+def writeHTMLReport(result, htmlOutput, bibFiles=None, auxFiles=None):
+    # Report of a result holding its entries, see HTMLReport
+    report = HTMLReport(htmlOutput, bibFiles is not None)
+    for entry in result.entries:
+        report.addEntry(entry)
+    return report.close(result, bibFiles, auxFiles)
+
+
+htmlReportStyle = """<style>
 body {
     font-family: Calibri, Arial, Sans;
     padding: 10px;
@@ -660,7 +3101,9 @@ body {
     padding: 5px;
 }
 </style>
-<script src="http://ajax.googleapis.com/ajax/libs/jquery/1.5/jquery.min.js"></script>
+"""
+
+htmlReportScript = """<script src="http://ajax.googleapis.com/ajax/libs/jquery/1.5/jquery.min.js"></script>
 <script>
 
 function isInProblemMode() {
@@ -730,9 +3173,9 @@ $(document).ready(function(){
 });
 
 </script>
-</head>
-<body>
-<div id="title">
+"""
+
+htmlReportControls = """<div id="title">
 <h1><a href='http://github.com/pezmc/BibLatex-Check'>BibLaTeX Check</a></h1>
 <div id="control">
 <form id="search"><input placeholder="search entry ID ..."/></form>
@@ -754,36 +3197,2745 @@ $(document).ready(function(){
 <br style="clear: both; " />
 </div>
 </div>
+"""
+
+
+def writeHTMLReportHead(
+    html, result, entryCount, bibFiles=None, auxFiles=None, script=htmlReportScript
+):
+    html.write(
+        """<!doctype html>
+<html>
+<head>
+<meta http-equiv="Content-Type" content="text/html; charset=utf-8"/>
+<title>BibLatex Check</title>
 """
     )
+    html.write(htmlReportStyle)
+    html.write(script)
+    html.write("</head>\n<body>\n")
+    html.write(htmlReportControls)
     html.write("<div class='info'><h2>Info</h2><ul>")
-    html.write("<li>bib file: " + options.bibFile + "</li>")
-    html.write("<li>aux file: " + options.auxFile + "</li>")
-    html.write("<li># entries with errors: " + str(len(entriesProblemsHTML)) + "</li>")
-    html.write("<li># problems: " + str(problemCount) + "</li><ul>")
-    html.write("<li># missing fields: " + str(counterMissingFields) + "</li>")
-    html.write("<li># flawed names: " + str(counterFlawedNames) + "</li>")
-    html.write("<li># wrong types: " + str(counterWrongTypes) + "</li>")
-    html.write("<li># non-unique id: " + str(counterNonUniqueId) + "</li>")
-    html.write("<li># wrong field: " + str(counterWrongFieldNames) + "</li>")
-    html.write("<li># missing comma: " + str(counterMissingCommas) + "</li>")
+    if bibFiles is None:
+        html.write("<li>bib file: " + result.bibFile + "</li>")
+        html.write("<li>aux file: " + (result.auxFile or "-") + "</li>")
+    else:
+        html.write("<li># bib files: " + str(len(bibFiles)) + "</li>")
+        html.write(
+            "<li># aux files: " + str(len(set(filter(None, auxFiles)))) + "</li>"
+        )
+    html.write("<li># entries with errors: " + str(entryCount) + "</li>")
+    html.write("<li># problems: " + str(result.problemCount) + "</li><ul>")
+    html.write("<li># missing fields: " + str(result.counterMissingFields) + "</li>")
+    html.write("<li># flawed names: " + str(result.counterFlawedNames) + "</li>")
+    html.write("<li># wrong types: " + str(result.counterWrongTypes) + "</li>")
+    html.write("<li># non-unique id: " + str(result.counterNonUniqueId) + "</li>")
+    html.write("<li># wrong field: " + str(result.counterWrongFieldNames) + "</li>")
+    html.write("<li># missing comma: " + str(result.counterMissingCommas) + "</li>")
     html.write("</ul></ul></div>")
 
-    entriesProblemsHTML.sort()
-    for problem in entriesProblemsHTML:
-        html.write(problem)
-    html.write("</body></html>")
-    html.close()
 
-    if options.view:
-        import os
-        import pathlib
-        import webbrowser
+pagedReportScript = """<script>
+// The entries are in the _files directory next to the report, loaded as
+// scripts so the report also works from file:// URLs: entries.js calls
+// biblatexCheckReport with every entry's problems and the ID's to search,
+// sources-N.js calls biblatexCheckSources with the BibLaTeX source of some
+// of them, loaded when one of those is first shown. Only the current page
+// of entries is in the document.
+
+var report = null;
+var idStarts = null;
+var visible = [];
+var page = 0;
+var checked = {};
+var sources = {};
+var sourceRequests = {};
+
+function escapeHTML(text) {
+    return String(text).replace(/&/g, '&amp;').replace(/</g, '&lt;')
+        .replace(/>/g, '&gt;').replace(/"/g, '&quot;').replace(/'/g, '&#39;');
+}
+
+function isInProblemMode() {
+    return document.getElementById('mode_problems').checked;
+}
+
+function searchIds(query) {
+    // Indexes of the entries whose ID contains query, ignoring case. The
+    // ID's are one lower case string, a line each, so it's searched natively
+    // instead of entry by entry.
+    var ids = report.ids;
+    var found = [];
+    var position = ids.indexOf(query);
+    while (position >= 0) {
+        var low = 0, high = idStarts.length - 1;
+        while (low < high) {
+            var middle = (low + high + 1) >> 1;
+            if (idStarts[middle] <= position) {
+                low = middle;
+            } else {
+                high = middle - 1;
+            }
+        }
+        found.push(low);
+        if (low + 1 >= idStarts.length) {
+            break;
+        }
+        position = ids.indexOf(query, idStarts[low + 1]);
+    }
+    return found;
+}
+
+function update(keepPage) {
+    var query = document.querySelector('#search input').value.toLowerCase();
+    var indexes = null;
+    if (query !== '' && query.indexOf('\\n') < 0) {
+        indexes = searchIds(query);
+    }
+    var count = indexes === null ? report.entries.length : indexes.length;
+    var problemMode = isInProblemMode();
+    visible = [];
+    for (var i = 0; i < count; i++) {
+        var index = indexes === null ? i : indexes[i];
+        var entry = report.entries[index];
+        if (problemMode && (entry[6].length === 0 || checked[entry[0]])) {
+            continue;
+        }
+        visible.push(index);
+    }
+    if (!keepPage) {
+        page = 0;
+    }
+    page = Math.max(0, Math.min(page, Math.ceil(visible.length / report.pageSize) - 1));
+    render();
+}
+
+function generateEntryHTML(index) {
+    var entry = report.entries[index];
+    var id = entry[0], problems = entry[6];
+    var html = ["<div id='", escapeHTML(id), "' class='problem severe", problems.length,
+        checked[id] ? " problem_checked" : "", "' data-index='", index, "'>",
+        "<h2>", escapeHTML(id), " (", escapeHTML(entry[1]), ")</h2> ",
+        "<div class='links'>"];
+    var links = [];
+    if (report.citeulikeHref) {
+        links.push(" <a href='" + escapeHTML(report.citeulikeHref + entry[5]) +
+            "' target='_blank'>CiteULike</a>");
+    }
+    for (var i = 0; i < report.libraries.length; i++) {
+        links.push(" <a href='" + escapeHTML(report.libraries[i][1] + entry[4]) +
+            "' target='_blank'>" + escapeHTML(report.libraries[i][0]) + "</a>");
+    }
+    html.push(links.join(' | '), "</div>",
+        "<div class='reference'>", escapeHTML(entry[2]), " (", escapeHTML(entry[3]),
+        ")</div>");
+    if (entry[7] !== null) {
+        html.push("<div class='reference'>", escapeHTML(entry[7]), "</div>");
+    }
+    html.push("<ul>");
+    for (var i = 0; i < problems.length; i++) {
+        html.push("<li>", escapeHTML(problems[i]), "</li>");
+    }
+    html.push("</ul>",
+        "<form class='problem_control'><label>checked</label>",
+        "<input type='checkbox' class='checked'", checked[id] ? " checked" : "",
+        "/></form>",
+        "<div class='bibtex_toggle'>Current BibLaTex Entry</div>",
+        "<div class='bibtex'></div></div>");
+    return html.join('');
+}
+
+function render() {
+    var start = page * report.pageSize;
+    var end = Math.min(start + report.pageSize, visible.length);
+    var html = [];
+    for (var i = start; i < end; i++) {
+        html.push(generateEntryHTML(visible[i]));
+    }
+    var problems = document.getElementById('problems');
+    problems.style.counterReset = 'problem ' + start;
+    problems.innerHTML = html.join('');
+
+    var pages = Math.max(1, Math.ceil(visible.length / report.pageSize));
+    var pager = [];
+    if (page > 0) {
+        pager.push("<a href='#' data-page='" + (page - 1) + "'>&laquo; previous</a>");
+    }
+    pager.push(visible.length ? "entries " + (start + 1) + " to " + end + " of " +
+        visible.length + ", page " + (page + 1) + " of " + pages : "no entries");
+    if (page + 1 < pages) {
+        pager.push("<a href='#' data-page='" + (page + 1) + "'>next &raquo;</a>");
+    }
+    document.getElementById('pager').innerHTML = pager.join(' | ');
+}
+
+function biblatexCheckSources(file, fileSources) {
+    sources[file] = fileSources;
+    var callbacks = sourceRequests[file] || [];
+    delete sourceRequests[file];
+    for (var i = 0; i < callbacks.length; i++) {
+        callbacks[i]();
+    }
+}
+
+function withSource(index, callback) {
+    var file = Math.floor(index / report.sourcesPerFile);
+    if (sources[file]) {
+        callback(sources[file][index % report.sourcesPerFile]);
+        return;
+    }
+    var done = function () {
+        callback(sources[file][index % report.sourcesPerFile]);
+    };
+    if (sourceRequests[file]) {
+        sourceRequests[file].push(done);
+        return;
+    }
+    sourceRequests[file] = [done];
+    var script = document.createElement('script');
+    script.src = report.directory + '/sources-' + file + '.js';
+    document.body.appendChild(script);
+}
+
+function findProblem(element) {
+    while (element && !/(^| )problem( |$)/.test(element.className || '')) {
+        element = element.parentNode;
+    }
+    return element;
+}
+
+function biblatexCheckReport(data) {
+    report = data;
+    idStarts = [0];
+    var ids = report.ids;
+    var position = ids.indexOf('\\n');
+    while (position >= 0) {
+        idStarts.push(position + 1);
+        position = ids.indexOf('\\n', position + 1);
+    }
+    for (var i = 0; i < localStorage.length; i++) {
+        var key = localStorage.key(i);
+        if (localStorage.getItem(key) == 'true') {
+            checked[key] = true;
+        }
+    }
+
+    var problems = document.getElementById('problems');
+    problems.onclick = function (event) {
+        var target = event.target;
+        if (target.className != 'bibtex_toggle') {
+            return;
+        }
+        var bibtex = target.nextSibling;
+        if (bibtex.style.display == 'block') {
+            bibtex.style.display = 'none';
+            return;
+        }
+        withSource(+findProblem(target).getAttribute('data-index'), function (source) {
+            var lines = source.split('\\n'), html = [];
+            for (var i = 0; i < lines.length; i++) {
+                if (lines[i]) {
+                    html.push(escapeHTML(lines[i]) + '<br />');
+                }
+            }
+            bibtex.innerHTML = html.join('');
+            bibtex.style.display = 'block';
+        });
+    };
+    problems.onchange = function (event) {
+        var problem = findProblem(event.target);
+        var id = problem.getAttribute('id');
+        if (event.target.checked) {
+            checked[id] = true;
+        } else {
+            delete checked[id];
+        }
+        localStorage.setItem(id, event.target.checked);
+        if (event.target.checked && isInProblemMode()) {
+            update(true);
+        } else {
+            problem.className = problem.className.replace(' problem_checked', '') +
+                (event.target.checked ? ' problem_checked' : '');
+        }
+    };
+    problems.onmousedown = function (event) {
+        if (event.target.tagName != 'A') {
+            return;
+        }
+        var active = problems.getElementsByClassName('active');
+        for (var i = active.length - 1; i >= 0; i--) {
+            active[i].className = active[i].className.replace(' active', '');
+        }
+        findProblem(event.target).className += ' active';
+    };
+    document.getElementById('pager').onclick = function (event) {
+        var target = event.target.getAttribute('data-page');
+        if (target !== null) {
+            event.preventDefault();
+            page = +target;
+            render();
+            window.scrollTo(0, 0);
+        }
+    };
+    document.querySelector('#search input').oninput = function () {
+        update();
+    };
+    document.getElementById('search').onsubmit = function () {
+        return false;
+    };
+    document.getElementById('mode_problems').onchange = function () {
+        update();
+    };
+    document.getElementById('mode_all').onchange = function () {
+        update();
+    };
+    document.getElementById('uncheck_button').onclick = function () {
+        checked = {};
+        localStorage.clear();
+        update(true);
+    };
+    update();
+}
+</script>
+"""
+
+
+class PagedHTMLReport(HTMLReport):
+    # HTML report (--paged) for very many entries: the page holds no entries,
+    # it renders pageSize of them at a time from the problems written once to
+    # entries.js in the _files directory next to it. The sources of the
+    # entries are only loaded when shown, sourcesPerFile per file, and the
+    # search runs on a string of the ID's rather than on the page.
+    sourcesPerFile = 500
+
+    def __init__(self, htmlOutput, showBibFile=False, markupCache=None, pageSize=100):
+        HTMLReport.__init__(self, htmlOutput, showBibFile, markupCache)
+        self.pageSize = pageSize
+        self.directory = os.path.splitext(htmlOutput)[0] + "_files"
+
+    def generateMarkup(self, entry):
+        # The entry's JSON and its source's on the next line, sorted by ID
+        # and number of problems as HTMLReport sorts them
+        location = None
+        if self.showBibFile:
+            location = entry.bibFile + ":" + str(entry.lineNumber)
+        record = [
+            entry.id,
+            entry.type,
+            entry.title,
+            entry.author,
+            entry.title and entry.title.translate(removePunctuationMap),
+            entry.articleId,
+            [problem for ruleId, problem in entry.problems],
+            location,
+        ]
+        data = json.dumps(record) + "\n" + json.dumps(entry.source)
+        return (entry.id, str(len(entry.problems))), data.encode("utf8")
+
+    def close(self, result, bibFiles=None, auxFiles=None):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        for oldFile in glob.glob(os.path.join(self.directory, "sources-*.js")):
+            os.remove(oldFile)
+        directoryName = os.path.basename(self.directory)
+
+        entriesJS = open(
+            os.path.join(self.directory, "entries.js"), "w", encoding="utf8"
+        )
+        entriesJS.write(
+            "biblatexCheckReport({"
+            + '"pageSize": '
+            + json.dumps(self.pageSize)
+            + ', "sourcesPerFile": '
+            + json.dumps(self.sourcesPerFile)
+            + ', "directory": '
+            + json.dumps(directoryName)
+            + ', "libraries": '
+            + json.dumps(libraries)
+            + ', "citeulikeHref": '
+            + json.dumps(citeulikeHref if citeulikeUsername else None)
+            + ', "entries": [\n'
+        )
+        ids = []
+        fileSources = []
+
+        def writeSources():
+            # those of the last entries written
+            fileNumber = str((len(ids) - 1) // self.sourcesPerFile)
+            sourcesJS = open(
+                os.path.join(self.directory, "sources-" + fileNumber + ".js"),
+                "w",
+                encoding="utf8",
+            )
+            sourcesJS.write(
+                "biblatexCheckSources("
+                + fileNumber
+                + ", [\n"
+                + ",\n".join(fileSources)
+                + "]);\n"
+            )
+            sourcesJS.close()
+            del fileSources[:]
+
+        self.entryIndex.sort()
+        for sortKey, group in itertools.groupby(self.entryIndex, lambda i: i[0]):
+            group = [self.readEntry(indexed) for indexed in group]
+            group.sort()
+            for data in group:
+                record, source = data.decode("utf8").split("\n", 1)
+                entriesJS.write(record if not ids else ",\n" + record)
+                ids.append(sortKey[0].lower())
+                fileSources.append(source)
+                if len(fileSources) == self.sourcesPerFile:
+                    writeSources()
+        if fileSources:
+            writeSources()
+        if self.spool is not None:
+            self.spool.close()
+        entryCount = len(self.entryIndex)
+        self.entryIndex = []
+
+        entriesJS.write('], "ids": ' + json.dumps("\n".join(ids)) + "});\n")
+        entriesJS.close()
+
+        html = open(self.htmlOutput, "w", encoding="utf8")
+        writeHTMLReportHead(
+            html, result, entryCount, bibFiles, auxFiles, pagedReportScript
+        )
+        html.write(
+            "<div id='pager'></div>"
+            + "<div id='problems'></div>"
+            + "<script src="
+            + quoteattr(directoryName + "/entries.js")
+            + "></script>"
+        )
+        html.write("</body></html>")
+        html.close()
+
+        return html.name
+
+
+class StopChecking(Exception):
+    # Raised from an onEntry callback to stop checking, see --fail-after
+    pass
+
+
+class ConsoleReport(object):
+    # The PROBLEM: lines printed to stderr, written bufferSize characters at a
+    # time rather than line by line. Only the first maxProblems are printed,
+    # if given, and with summaryOnly none; close() then prints the number of
+    # problems of each rule instead.
+    bufferSize = 65536
+
+    def __init__(self, stream=None, maxProblems=None, summaryOnly=False):
+        self.stream = stream or sys.stderr
+        self.maxProblems = maxProblems
+        self.summaryOnly = summaryOnly
+        self.buffer = []
+        self.bufferLength = 0
+        self.printedCount = 0
+        self.ruleCounts = collections.Counter()
+
+    def addEntry(self, entry, bibFile):
+        problems = entry.problems
+        if not problems:
+            return
+        for ruleId, message in problems:
+            self.ruleCounts[ruleId] += 1
+        if self.summaryOnly:
+            return
+        if self.maxProblems is not None:
+            if self.printedCount >= self.maxProblems:
+                return
+            problems = problems[: self.maxProblems - self.printedCount]
+        self.printedCount += len(problems)
+
+        lines = generateEntryProblemsConsole(entry, bibFile, problems)
+        self.buffer.append(lines)
+        self.bufferLength += len(lines)
+        if self.bufferLength >= self.bufferSize:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.stream.write("".join(self.buffer))
+            self.buffer = []
+            self.bufferLength = 0
+        self.stream.flush()
+
+    def close(self):
+        problemCount = sum(self.ruleCounts.values())
+        if self.printedCount < problemCount:
+            if not self.summaryOnly:
+                self.buffer.append(
+                    "INFO: {} more problems not printed\n".format(
+                        problemCount - self.printedCount
+                    )
+                )
+            # the most frequent first
+            ruleCounts = sorted(
+                self.ruleCounts.items(), key=lambda item: (-item[1], item[0])
+            )
+            for ruleId, count in ruleCounts:
+                self.buffer.append(
+                    "SUMMARY: {:>8} {:<24} {}\n".format(
+                        count, ruleId, problemRules.get(ruleId, ("warning",))[0]
+                    )
+                )
+        self.flush()
+
+
+class ProblemReport(object):
+    # Base of the machine readable reports (--format). Each entry is written
+    # out as soon as it is checked, nothing is kept until close(). Output "-"
+    # writes to stdout.
+
+    def __init__(self, output):
+        self.output = output
+        if output == "-":
+            self.fOut = sys.stdout
+        else:
+            self.fOut = open(output, "w", encoding="utf8")
+        self.writeHead()
+
+    def writeHead(self):
+        pass
+
+    def addEntry(self, entry):
+        raise NotImplementedError
+
+    def writeTail(self, result):
+        pass
+
+    def close(self, result, bibFiles=None, auxFiles=None):
+        self.writeTail(result)
+        if self.fOut is sys.stdout:
+            self.fOut.flush()
+        else:
+            self.fOut.close()
+        return self.output
+
+
+def problemLocation(entry):
+    # bib file, first and last line of the entry, counted from 1
+    startLine = entry.startLineNumber
+    if startLine is None:
+        startLine = entry.lineNumber
+    return entry.bibFile or "-", startLine + 1, entry.lineNumber + 1
+
+
+class JSONLinesReport(ProblemReport):
+    # One JSON object per problem and line
+    def addEntry(self, entry):
+        if not entry.problems:
+            return
+
+        bibFile, startLine, endLine = problemLocation(entry)
+        self.fOut.write(
+            "".join(
+                json.dumps(
+                    {
+                        "file": bibFile,
+                        "line": startLine,
+                        "endLine": endLine,
+                        "id": entry.id,
+                        "type": entry.type,
+                        "rule": ruleId,
+                        "severity": problemRules[ruleId][0],
+                        "message": message,
+                    },
+                    sort_keys=True,
+                )
+                + "\n"
+                for ruleId, message in entry.problems
+            )
+        )
+
+
+class SARIFReport(ProblemReport):
+    # SARIF 2.1.0 log, as read by code scanning tools. The results are
+    # written first, the tool and its rules after them.
+    def writeHead(self):
+        self.fOut.write(
+            '{"$schema": "https://json.schemastore.org/sarif-2.1.0.json", '
+            '"version": "2.1.0", "runs": [{"results": ['
+        )
+        self.separator = "\n"
+
+    def addEntry(self, entry):
+        bibFile, startLine, endLine = problemLocation(entry)
+        for ruleId, message in entry.problems:
+            sarifResult = {
+                "ruleId": ruleId,
+                "level": problemRules[ruleId][0],
+                "message": {"text": message},
+                "locations": [
+                    {
+                        "physicalLocation": {
+                            "artifactLocation": {"uri": bibFile.replace(os.sep, "/")},
+                            "region": {"startLine": startLine, "endLine": endLine},
+                        }
+                    }
+                ],
+                "properties": {"entryId": entry.id, "entryType": entry.type},
+            }
+            self.fOut.write(self.separator + json.dumps(sarifResult, sort_keys=True))
+            self.separator = ",\n"
+
+    def writeTail(self, result):
+        driver = {
+            "name": "BibLatex-Check",
+            "version": __version__,
+            "informationUri": "https://github.com/Pezmc/BibLatex-Check",
+            "rules": [
+                {
+                    "id": ruleId,
+                    "shortDescription": {"text": description},
+                    "defaultConfiguration": {"level": severity},
+                }
+                for ruleId, (severity, description) in sorted(problemRules.items())
+            ],
+        }
+        self.fOut.write(
+            '\n], "tool": {"driver": ' + json.dumps(driver, sort_keys=True) + "}}]}\n"
+        )
+
+
+class JUnitReport(ProblemReport):
+    # JUnit XML, one test suite per bib file and one test case per entry.
+    # Entries with errors fail, warnings only go to the case's output. The
+    # suites are written as they go, so they don't carry test counts.
+    def writeHead(self):
+        self.fOut.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        self.fOut.write('<testsuites name="BibLatex-Check">\n')
+        self.bibFile = None
+
+    def addEntry(self, entry):
+        bibFile, startLine, endLine = problemLocation(entry)
+        if bibFile != self.bibFile:
+            if self.bibFile is not None:
+                self.fOut.write("</testsuite>\n")
+            self.fOut.write("<testsuite name=" + quoteattr(bibFile) + ">\n")
+            self.bibFile = bibFile
+
+        xml = [
+            "<testcase classname=",
+            quoteattr(bibFile),
+            " name=",
+            quoteattr(entry.id),
+            ">",
+        ]
+        errors = [
+            (ruleId, message)
+            for ruleId, message in entry.problems
+            if problemRules[ruleId][0] == "error"
+        ]
+        details = escape(
+            "".join(
+                "{}:{}: {}: {}\n".format(bibFile, startLine, ruleId, message)
+                for ruleId, message in entry.problems
+            )
+        )
+        if errors:
+            xml += [
+                "<failure message=",
+                quoteattr(errors[0][1]),
+                " type=",
+                quoteattr(errors[0][0]),
+                ">",
+                details,
+                "</failure>",
+            ]
+        elif details:
+            xml += ["<system-out>", details, "</system-out>"]
+        xml.append("</testcase>\n")
+        self.fOut.write("".join(xml))
+
+    def writeTail(self, result):
+        if self.bibFile is not None:
+            self.fOut.write("</testsuite>\n")
+        self.fOut.write("</testsuites>\n")
+
+
+# --format name -> report class
+reportFormats = {
+    "jsonl": JSONLinesReport,
+    "sarif": SARIFReport,
+    "junit": JUnitReport,
+}
+
+
+### Fix ###
+
+# BibTeX entry types -> the biblatex type and the type field telling what kind
+# of thesis or report it is, see the biblatex manual
+bibtexEntryTypes = {
+    "phdthesis": ("thesis", "phdthesis"),
+    "mastersthesis": ("thesis", "mathesis"),
+    "techreport": ("report", "techreport"),
+    "conference": ("inproceedings", None),
+    "electronic": ("online", None),
+    "www": ("online", None),
+}
+# what each kind of fix is called in the summary
+fixDescriptions = (
+    ("missing-comma", "missing commas"),
+    ("field-alias", "BibTeX field names"),
+    ("bibtex-type", "BibTeX entry types"),
+)
+fieldCommaPattern = re.compile(r"\s*,")
+fieldSeparatorPattern = re.compile(r"[ \t]*=[ \t]*")
+diffHunkPattern = re.compile(r"^@@ -(\d+)(,\d+)? \+(\d+)(,\d+)? @@")
+
+
+def matchCase(name, original):
+    # name written in upper case if original is
+    return name.upper() if original.isupper() else name
+
+
+def needsFixing(bibEntry):
+    # Whether fixBibEntry may change the entry, from what was parsed already
+    if not bibEntry.terminated:
+        return False
+    if not bibEntry.headerComma or bibEntry.type.lower() in bibtexEntryTypes:
+        return True
+    for fieldName, fieldValue, comma in bibEntry.fields:
+        if not comma or fieldName.lower() in fieldAliases:
+            return True
+    return False
+
+
+def fixBibEntry(source):
+    # The source of an entry with the fixes that can't change what it means:
+    # missing commas added, BibTeX field names and entry types renamed to
+    # biblatex's. Returns the fixed source and the kind of each fix made.
+    header = entryHeaderPattern.match(source)
+    if header is None:
+        return source, []
+    entryType, opener, entryId, comma = header.groups()
+    closer = entryClosers[opener]
+    entry = BibEntry(entryType, entryId, 0, len(source), 0, 0)
+    fieldSpans = []
+    parseBibFields(source, header.end(), closer, entry, fieldSpans)
+    if not entry.terminated or entry.end != len(source):
+        return source, []
+
+    # (start, end, replacement, kind of fix or "" if part of another)
+    edits = []
+    if not comma and source[header.end() : header.end() + 1] != closer:
+        edits.append((header.end(3), header.end(3), ",", "missing-comma"))
+
+    fieldNames = set(fieldName.lower() for fieldName, value, comma in entry.fields)
+    for (fieldName, value, comma), (nameStart, nameEnd, valueEnd) in zip(
+        entry.fields, fieldSpans
+    ):
+        alias = fieldAliases.get(fieldName.lower())
+        # renamed unless the entry has the biblatex field too
+        if alias is not None and alias not in fieldNames:
+            fieldNames.add(alias)
+            alias = matchCase(alias, fieldName)
+            edits.append((nameStart, nameEnd, alias, "field-alias"))
+        if not comma:
+            edits.append((valueEnd, valueEnd, ",", "missing-comma"))
+
+    biblatexType = bibtexEntryTypes.get(entryType.lower())
+    if biblatexType is not None and entry.fields and entry.fields[-1][2]:
+        biblatexType, typeField = biblatexType
+        edits.append(
+            (
+                header.start(1),
+                header.end(1),
+                matchCase(biblatexType, entryType),
+                "bibtex-type",
+            )
+        )
+        if typeField is not None and "type" not in fieldNames:
+            # a type field after the last one, laid out as that is
+            nameStart, nameEnd, valueEnd = fieldSpans[-1]
+            lineStart = source.rfind("\n", 0, nameStart) + 1
+            indent = source[lineStart:nameStart]
+            if indent.strip():
+                indent = " "
+            else:
+                indent = ("\r\n" if "\r\n" in source else "\n") + indent
+            separator = fieldSeparatorPattern.match(source, nameEnd)
+            separator = separator.group() if separator is not None else " = "
+            typeName = matchCase("type", entry.fields[-1][0])
+            typeField = typeName + separator + "{" + typeField + "}"
+            fieldComma = fieldCommaPattern.match(source, valueEnd)
+            if fieldComma is not None:
+                insertAt = fieldComma.end()
+                edits.append((insertAt, insertAt, indent + typeField + ",", ""))
+            else:
+                edits.append((valueEnd, valueEnd, "," + indent + typeField, ""))
+
+    if not edits:
+        return source, []
+    edits.sort(key=lambda edit: edit[0])
+    fixed = []
+    pos = 0
+    for start, end, replacement, kind in edits:
+        fixed += [source[pos:start], replacement]
+        pos = end
+    fixed.append(source[pos:])
+    return "".join(fixed), [kind for start, end, replacement, kind in edits if kind]
+
+
+def generateFixDiff(bibFile, before, after, lineNumber, lineShift):
+    # Unified diff hunks of a fixed part of bibFile starting at lineNumber
+    # (from 0), lineShift lines having been added before it
+    import difflib
+
+    diff = []
+    for line in difflib.unified_diff(
+        before.splitlines(True), after.splitlines(True), n=1
+    ):
+        if line.startswith("---") or line.startswith("+++"):
+            continue
+        hunk = diffHunkPattern.match(line)
+        if hunk is not None:
+            line = "@@ -{}{} +{}{} @@\n".format(
+                int(hunk.group(1)) + lineNumber,
+                hunk.group(2) or "",
+                int(hunk.group(3)) + lineNumber + lineShift,
+                hunk.group(4) or "",
+            )
+        elif not line.endswith("\n"):
+            line += "\n\\ No newline at end of file\n"
+        diff.append(line)
+    return "".join(diff)
+
+
+def fixBibFile(bibFile, dryRun=False, diffStream=None):
+    # Fix a bib file in one pass over its blocks, so it is never in memory as
+    # a whole. The fixed file is written next to it and renamed over it once
+    # complete, unless dryRun. Returns the kind of each fix made.
+    import tempfile
+
+    fIn = io.open(bibFile, "r", encoding="utf8", newline="")
+    fOut = None
+    if not dryRun:
+        directory = os.path.dirname(os.path.abspath(bibFile))
+        fd, fixedFile = tempfile.mkstemp(
+            prefix="." + os.path.basename(bibFile) + ".", suffix=".tmp", dir=directory
+        )
+        fOut = io.open(fd, "w", encoding="utf8", newline="")
+
+    fixes = []
+    lineShift = 0
+    if diffStream is not None:
+        diffStream.write("--- " + bibFile + "\n+++ " + bibFile + "\n")
+    try:
+        for blockLineNumber, blockText in iterBibBlocks(fIn):
+            pos = 0
+            for bibEntry in parseBibEntries(blockText, blockLineNumber):
+                if not needsFixing(bibEntry):
+                    continue
+                fixedSource, entryFixes = fixBibEntry(bibEntry.source)
+                if not entryFixes:
+                    continue
+                fixes += entryFixes
+                if diffStream is not None:
+                    # whole lines, with the text around the entry
+                    lineStart = blockText.rfind("\n", 0, bibEntry.start) + 1
+                    lineEnd = blockText.find("\n", bibEntry.end) + 1 or len(blockText)
+                    before = blockText[lineStart:lineEnd]
+                    after = (
+                        blockText[lineStart : bibEntry.start]
+                        + fixedSource
+                        + blockText[bibEntry.end : lineEnd]
+                    )
+                    diffStream.write(
+                        generateFixDiff(
+                            bibFile, before, after, bibEntry.startLine, lineShift
+                        )
+                    )
+                    lineShift += fixedSource.count("\n") - bibEntry.source.count("\n")
+                if fOut is not None:
+                    fOut.write(blockText[pos : bibEntry.start])
+                    fOut.write(fixedSource)
+                    pos = bibEntry.end
+            if fOut is not None:
+                fOut.write(blockText[pos:])
+    except BaseException:
+        if fOut is not None:
+            fOut.close()
+            os.remove(fixedFile)
+        raise
+    finally:
+        fIn.close()
+
+    if fOut is not None:
+        fOut.flush()
+        os.fsync(fOut.fileno())
+        fOut.close()
+        if fixes:
+            import shutil
+
+            shutil.copymode(bibFile, fixedFile)
+            # atomic, the file is either the old or the fixed one
+            getattr(os, "replace", os.rename)(fixedFile, bibFile)
+        else:
+            os.remove(fixedFile)
+    return fixes
+
+
+def fixBibFiles(bibFiles, dryRun, diffStream, printMessage):
+    # --fix and --fix-dry-run, returns the exit code
+    failed = False
+    for bibFile in bibFiles:
+        try:
+            fixes = fixBibFile(bibFile, dryRun, diffStream)
+        except (IOError, OSError) as e:
+            printMessage("ERROR: Bib file '" + bibFile + "' not fixed: " + str(e))
+            failed = True
+            continue
+        if not fixes:
+            printMessage("INFO: Nothing to fix in '" + bibFile + "'")
+        else:
+            printMessage(
+                "INFO: {} {} problems in '{}': {}".format(
+                    "Would fix" if dryRun else "Fixed",
+                    len(fixes),
+                    bibFile,
+                    describeFixes(fixes),
+                )
+            )
+    if diffStream is not None:
+        diffStream.flush()
+    return -1 if failed else 0
+
+
+def describeFixes(fixes):
+    # e.g. "3 missing commas, 1 BibTeX entry types"
+    counts = collections.Counter(fixes)
+    return ", ".join(
+        "{} {}".format(counts[kind], description)
+        for kind, description in fixDescriptions
+        if counts[kind]
+    )
+
+
+### Changes ###
+
+# the new file's first line and line count of a unified diff hunk
+changedHunkPattern = re.compile(r"@@ -\d+(?:,\d+)? \+(\d+)(?:,(\d+))? @@")
+
+
+def parseDiffLineRanges(lines):
+    # The lines a unified diff changes in each new file, as sorted
+    # [(first line, last line)] counted from 0 by the path after '+++ '.
+    # Removed lines count as changes of the lines around them.
+    changedLines = {}
+    lineRanges = None
+    previousLine = ""
+    for line in lines:
+        # an added line starting with '++ ' isn't a file header
+        isHeader = line.startswith("+++ ") and previousLine.startswith("--- ")
+        previousLine = line
+        if isHeader:
+            path = line[4:].rstrip("\r\n").split("\t")[0]
+            lineRanges = None
+            if path != "/dev/null":
+                lineRanges = changedLines.setdefault(path, [])
+            continue
+        hunk = changedHunkPattern.match(line)
+        if hunk is None or lineRanges is None:
+            continue
+        first = int(hunk.group(1))
+        count = 1 if hunk.group(2) is None else int(hunk.group(2))
+        if count:
+            lineRanges.append((first - 1, first + count - 2))
+        else:
+            # lines removed after line first
+            lineRanges.append((max(0, first - 1), first))
+    for path in changedLines:
+        changedLines[path] = mergeLineRanges(changedLines[path])
+    return changedLines
+
+
+def mergeLineRanges(lineRanges):
+    merged = []
+    for first, last in sorted(lineRanges):
+        if merged and first <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], last))
+        else:
+            merged.append((first, last))
+    return merged
+
+
+def overlapsLineRanges(lineRanges, first, last):
+    # Whether any of the sorted, merged lineRanges overlaps first to last
+    index = bisect.bisect_right(lineRanges, (last, sys.maxsize))
+    return index > 0 and lineRanges[index - 1][1] >= first
+
+
+def gitChangedLines(bibFile, revision):
+    # The lines of bibFile changed since a git revision, uncommitted changes
+    # included; None if git doesn't track the file, i.e. it's all new
+    directory, name = os.path.split(os.path.abspath(bibFile))
+    tracked = subprocess.check_output(
+        ["git", "ls-files", "--", name], cwd=directory
+    ).strip()
+    if not tracked:
+        return None
+    diff = subprocess.check_output(
+        ["git", "diff", "--no-color", "--no-ext-diff", "-U0", revision, "--", name],
+        cwd=directory,
+    )
+    changedLines = parseDiffLineRanges(diff.decode("utf8").splitlines())
+    return next(iter(changedLines.values()), [])
+
+
+def diffChangedLines(diffFile, bibFiles):
+    # {bib file: line ranges} of those bib files changed by a unified diff,
+    # matched by the end of their path ('b/refs.bib' is 'refs.bib' too)
+    fIn = sys.stdin if diffFile == "-" else open(diffFile, "r", encoding="utf8")
+    try:
+        diffLines = parseDiffLineRanges(fIn)
+    finally:
+        if fIn is not sys.stdin:
+            fIn.close()
+
+    changedLines = {}
+    for path, lineRanges in diffLines.items():
+        paths = ["/" + path.lstrip("/")]
+        if path[:2] in ("a/", "b/"):
+            paths.append("/" + path[2:])
+        for bibFile in bibFiles:
+            bibPath = os.path.abspath(bibFile).replace(os.sep, "/")
+            if any(bibPath.endswith(diffPath) for diffPath in paths):
+                changedLines.setdefault(bibFile, []).extend(lineRanges)
+    for bibFile in changedLines:
+        changedLines[bibFile] = mergeLineRanges(changedLines[bibFile])
+    return changedLines
+
+
+def changedLineRanges(bibFiles, revision=None, diffFile=None):
+    # {bib file: changed line ranges} of the bib files changed since a git
+    # revision, or by a unified diff; unchanged ones are left out and all of
+    # a new file is changed
+    if diffFile is not None:
+        return diffChangedLines(diffFile, bibFiles)
+    changedLines = {}
+    for bibFile in bibFiles:
+        lineRanges = gitChangedLines(bibFile, revision)
+        if lineRanges is None:
+            lineRanges = [(0, sys.maxsize)]
+        if lineRanges:
+            changedLines[bibFile] = lineRanges
+    return changedLines
+
+
+def iterChangedBibEntries(
+    blocks, lineRanges, skipEntry=None, lookupEntry=None, caseInsensitiveIds=False
+):
+    # parseBibEntries over (first line number, text) blocks, with the entries
+    # on none of the lineRanges skipped. Blocks without a changed line are
+    # only looked at for their ID's. The whole file is parsed first, so the
+    # skipped entries redefining the ID of an earlier changed entry can be
+    # marked duplicatesChanged; the checks report them as non-unique.
+    bibEntries = []
+    for blockLineNumber, blockText in blocks:
+        lastLine = blockLineNumber + blockText.count("\n")
+        if not overlapsLineRanges(lineRanges, blockLineNumber, lastLine):
+            bibEntries.extend(
+                parseBibEntries(blockText, blockLineNumber, skipEveryEntry)
+            )
+            continue
+        for bibEntry in parseBibEntries(
+            blockText, blockLineNumber, skipEntry, lookupEntry
+        ):
+            if not overlapsLineRanges(lineRanges, bibEntry.startLine, bibEntry.endLine):
+                bibEntry.skipped = True
+            bibEntries.append(bibEntry)
+
+    # whether the first definition of each ID is a changed entry
+    firstChanged = {}
+    keyIndex = KeyIndex(caseInsensitiveIds)
+    for bibEntry in bibEntries:
+        key = keyIndex.normalize(bibEntry.id)
+        changed = firstChanged.get(key)
+        if changed is None:
+            firstChanged[key] = not bibEntry.skipped
+        elif changed and bibEntry.skipped:
+            bibEntry.duplicatesChanged = True
+    return bibEntries
+
+
+### Watch ###
+
+
+def fileStamp(path):
+    # Changes whenever a file is written or replaced, None if it's missing
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime, stat.st_size, stat.st_ino
+
+
+def commonPrefixLength(a, b, chunkSize=65536):
+    length = min(len(a), len(b))
+    pos = 0
+    while pos < length and a[pos : pos + chunkSize] == b[pos : pos + chunkSize]:
+        pos += chunkSize
+    if pos >= length:
+        return length
+    # the first difference is within this chunk
+    low, high = pos, min(pos + chunkSize, length)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if a[pos:middle] == b[pos:middle]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def commonSuffixLength(a, b, limit, chunkSize=65536):
+    # Like commonPrefixLength from the end, at most limit characters
+    aEnd, bEnd = len(a), len(b)
+    length = 0
+    while length < limit:
+        size = min(chunkSize, limit - length)
+        if a[aEnd - length - size : aEnd - length] != b[bEnd - length - size : bEnd - length]:
+            break
+        length += size
+    else:
+        return limit
+    low, high = length, length + size
+    while low < high:
+        middle = (low + high + 1) // 2
+        if a[aEnd - middle : aEnd - length] == b[bEnd - middle : bEnd - length]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def isBlockSafe(text, bibEntries, skippedSpans):
+    # Whether the entries and skipped @comment's etc. parsed from text are
+    # closed and hold no line starting with '@', where iterBibBlocks could
+    # cut them. Then it makes no difference if the text is parsed in blocks.
+    for bibEntry in bibEntries:
+        if (
+            not bibEntry.terminated
+            or text.find("\n@", bibEntry.start, bibEntry.end) >= 0
+        ):
+            return False
+    for start, end in skippedSpans:
+        if end < 0 or text.find("\n@", start, end) >= 0:
+            return False
+    return True
+
+
+class WatchedBib(object):
+    # A bib file kept in memory while it is being edited. Only the text from
+    # the first changed entry to the first unchanged one after the change is
+    # parsed again; the other entries keep their results and are just
+    # shifted. Entries defining the same ID as a changed one are checked again
+    # for it, and every entry when checks involving other entries can't be
+    # narrowed down like that (cited entries, duplicate references, stats).
+
+    def __init__(self, bibFile, auxFile, options, cache):
+        self.bibFile = bibFile
+        self.auxFile = auxFile
+        self.options = options
+        self.cache = cache
+        self.checker = None
+        self.stamp = None
+        self.auxStamp = None
+        self.citedIds = None
+        self.text = None
+        self.bibEntries = []
+        self.closed = False  # see isBlockSafe
+        self.result = None
+        # the EntryResult of each of bibEntries, if only the changed ones
+        # (see checkChanges) are to be checked next time
+        self.entryResults = None
+        self.counters = None  # those of the last check
+        self.idCounts = {}  # normalized ID -> entries defining it
+        self.duplicateKeys = set()  # normalized ID's defined more than once
+
+    def changed(self):
+        return fileStamp(self.bibFile) != self.stamp or (
+            self.auxFile is not None and self.readAuxStamp() != self.auxStamp
+        )
+
+    def readAuxStamp(self):
+        return tuple(fileStamp(auxFile) for auxFile in splitAuxFiles(self.auxFile))
+
+    def check(self):
+        result = CheckResult(self.bibFile, self.auxFile)
+        self.stamp = fileStamp(self.bibFile)
+        fIn = openBibForResult(self.bibFile, result)
+        if fIn is None:
+            self.result = result
+            self.text = None
+            self.bibEntries = []
+            return result
+        try:
+            text = fIn.read()
+        finally:
+            fIn.close()
+        return self.checkText(text, result)
+
+    def checkText(self, text, result=None):
+        # Check the file's text as it is now, e.g. as an editor has it
+        if result is None:
+            result = CheckResult(self.bibFile, self.auxFile)
+        self.result = result
+        auxStamp = self.readAuxStamp() if self.auxFile is not None else None
+        if self.checker is None or auxStamp != self.auxStamp:
+            self.auxStamp = auxStamp
+            self.citedIds = loadAuxForResult(self.auxFile, result)
+            self.checker = Checker(self.citedIds, self.options, self.cache)
+            self.entryResults = None
+        if self.citedIds:
+            # an edit can change what the cited entries cross-reference
+            self.checker.usedIds = addReferencedIds(self.citedIds, [(0, text)])
+
+        change = None
+        if self.text is not None:
+            change = self.parseChanges(text)
+        self.text = text
+        if change is not None and self.entryResults is not None:
+            self.bibEntries = change[0]
+            self.checkChanges(change, result)
+            first, removedEntries, changedCount, lineShift = change[1:]
+            changedEntries = self.bibEntries[first : first + changedCount]
+        else:
+            bibEntries = change[0] if change is not None else self.parseAll(text)
+            self.bibEntries = changedEntries = bibEntries
+            result.entries = list(self.checker.iterCheckEntries(bibEntries, result))
+            self.cache.update(result)
+            self.keepEntryResults(result)
+
+        for bibEntry in changedEntries:
+            if bibEntry.cached is None and bibEntry.cacheable:
+                bibEntry.cached = self.cache.get(entryDigest(bibEntry.source))
+                if bibEntry.cached is not None:
+                    bibEntry.fields = []
+        return result
+
+    def lookupEntry(self, source):
+        digest = entryDigest(source)
+        cached = self.cache.get(digest)
+        if cached is not None:
+            self.result.cacheHits.append(digest)
+        return cached
+
+    def parseAll(self, text):
+        # In blocks as iterCheck does, which matters if an entry isn't closed
+        bibEntries = []
+        offset = 0
+        closed = True
+        for blockLineNumber, blockText in iterBibBlocks(io.StringIO(text)):
+            skippedSpans = []
+            blockEntries = list(
+                parseBibEntries(
+                    blockText,
+                    blockLineNumber,
+                    lookupEntry=self.lookupEntry,
+                    skippedSpans=skippedSpans,
+                )
+            )
+            closed = closed and isBlockSafe(blockText, blockEntries, skippedSpans)
+            for bibEntry in blockEntries:
+                bibEntry.start += offset
+                bibEntry.end += offset
+            bibEntries.extend(blockEntries)
+            offset += len(blockText)
+        self.closed = closed
+        return bibEntries
+
+    def parseChanges(self, text):
+        # The entries of text, from the entries of the text before. Parsing
+        # starts after the last entry before the change and goes on until it
+        # meets an entry after the change where it was, as an edit opening or
+        # closing an entry or a comment can take the next entries along, or
+        # let them out. None if the file can't be parsed piecewise, as an
+        # entry or comment isn't closed (see isBlockSafe).
+        old = self.text
+        if not self.closed:
+            return None
+
+        prefix = commonPrefixLength(old, text)
+        suffix = commonSuffixLength(old, text, min(len(old), len(text)) - prefix)
+        bibEntries = self.bibEntries
+        starts = [bibEntry.start for bibEntry in bibEntries]
+        ends = [bibEntry.end for bibEntry in bibEntries]
+
+        # entries before first are unchanged, those from last on are unless
+        # the changed ones take them along
+        first = bisect.bisect_right(ends, prefix)
+        last = bisect.bisect_left(starts, len(old) - suffix, first)
+        regionStart = ends[first - 1] if first else 0
+        shift = len(text) - len(old)
+
+        changedEntries = []
+        skippedSpans = []
+        following = len(bibEntries)  # the first entry kept after them
+        lineShift = 0
+        for bibEntry in parseBibEntries(
+            text,
+            bibEntries[first - 1].endLine if first else 0,
+            lookupEntry=self.lookupEntry,
+            start=regionStart,
+            skippedSpans=skippedSpans,
+        ):
+            # the text from an unchanged entry's start on is the same, so is
+            # what it parses to
+            oldStart = bibEntry.start - shift
+            index = bisect.bisect_left(starts, oldStart, last)
+            if index < len(starts) and starts[index] == oldStart:
+                following = index
+                lineShift = bibEntry.startLine - bibEntries[index].startLine
+                break
+            changedEntries.append(bibEntry)
+        if not isBlockSafe(text, changedEntries, skippedSpans):
+            return None
+
+        for bibEntry in bibEntries[following:]:
+            bibEntry.start += shift
+            bibEntry.end += shift
+            bibEntry.startLine += lineShift
+            bibEntry.endLine += lineShift
+
+        return (
+            bibEntries[:first] + changedEntries + bibEntries[following:],
+            first,
+            bibEntries[first:following],
+            len(changedEntries),
+            lineShift,
+        )
+
+    def entryKey(self, entryId):
+        return entryId.lower() if self.options.caseInsensitiveIds else entryId
+
+    def keepEntryResults(self, result):
+        # Keep what checkChanges needs, if it can check the next change
+        self.entryResults = None
+        checker = self.checker
+        if (
+            checker.usedIds
+            or "duplicate-reference" in checker.enabledRules
+            or checker.options.collectStats
+            or len(result.entries) != len(self.bibEntries)
+        ):
+            return
+        self.entryResults = list(result.entries)
+        self.counters = CheckResult.getCounters(result)
+        idCounts = self.idCounts = {}
+        for bibEntry in self.bibEntries:
+            key = self.entryKey(bibEntry.id)
+            idCounts[key] = idCounts.get(key, 0) + 1
+        self.duplicateKeys = set(key for key, count in idCounts.items() if count > 1)
+
+    def countIds(self, bibEntries, increment, affectedKeys):
+        idCounts = self.idCounts
+        for bibEntry in bibEntries:
+            key = self.entryKey(bibEntry.id)
+            count = idCounts.get(key, 0) + increment
+            idCounts[key] = count
+            if count > 1:
+                self.duplicateKeys.add(key)
+            else:
+                self.duplicateKeys.discard(key)
+            affectedKeys.add(key)
+
+    def checkChanges(self, change, result):
+        # Check the changed entries and those defining the same ID's as the
+        # changed or removed ones, the others keep their results. The counters
+        # are those of the last check, less what the entries checked again
+        # counted then, plus what they count now.
+        bibEntries, first, removedEntries, changedCount, lineShift = change
+        lastResults = self.entryResults
+        entryResults = (
+            lastResults[:first]
+            + [None] * changedCount
+            + lastResults[first + len(removedEntries) :]
+        )
+        if lineShift:
+            for entryResult in entryResults[first + changedCount :]:
+                entryResult.startLineNumber += lineShift
+                entryResult.lineNumber += lineShift
+
+        affectedKeys = set()
+        self.countIds(removedEntries, -1, affectedKeys)
+        self.countIds(bibEntries[first : first + changedCount], 1, affectedKeys)
+        if lineShift and self.duplicateKeys:
+            # non-unique-id problems name the line of the first definition,
+            # which moved if it's after the change
+            movedKeys = set(self.duplicateKeys)
+            for bibEntry in bibEntries[:first]:
+                movedKeys.discard(self.entryKey(bibEntry.id))
+            affectedKeys.update(movedKeys)
+        if self.options.caseInsensitiveIds:
+            checked = [
+                index
+                for index, bibEntry in enumerate(bibEntries)
+                if bibEntry.id.lower() in affectedKeys
+            ]
+        else:
+            checked = [
+                index
+                for index, bibEntry in enumerate(bibEntries)
+                if bibEntry.id in affectedKeys
+            ]
+
+        for name, count in zip(CheckResult.counterNames, self.counters):
+            setattr(result, name, count)
+        uncountedResults = lastResults[first : first + len(removedEntries)]
+        uncountedResults += [entryResults[index] for index in checked]
+        for entryResult in uncountedResults:
+            if entryResult is not None:
+                for ruleId, message in entryResult.problems:
+                    name = problemCounterName(ruleId)
+                    if name is not None:
+                        setattr(result, name, getattr(result, name) - 1)
+
+        # the first definitions of the ID's checked, for the non-unique ones
+        keyIndex = KeyIndex(self.options.caseInsensitiveIds)
+        for index in checked:
+            keyIndex.addPending(bibEntries[index].id, bibEntries[index].endLine)
+        checkedResult = CheckResult(self.bibFile, self.auxFile)
+        checkedEntries = self.checker.iterCheckEntries(
+            [bibEntries[index] for index in checked], checkedResult, keyIndex
+        )
+        for index, entryResult in zip(checked, checkedEntries):
+            entryResults[index] = entryResult
+
+        result.merge(checkedResult, keepEntries=False)
+        result.entries = list(entryResults)
+        self.entryResults = entryResults
+        self.counters = CheckResult.getCounters(result)
+        self.cache.update(result)
+
+
+def watchBibFiles(
+    pairs,
+    checkOptions,
+    htmlOutput=None,
+    console=True,
+    view=False,
+    pageSize=None,
+    maxProblems=None,
+    summaryOnly=False,
+):
+    # Check the bib files whenever one of them (or its aux file) changes,
+    # until interrupted. Changes are polled for every tenth of a second.
+    # Given a pageSize, the HTML report is a PagedHTMLReport; maxProblems and
+    # summaryOnly are those of ConsoleReport.
+    import gc
+
+    if checkOptions.cacheFile:
+        cache = openEntryCache(checkOptions)
+    else:
+        cache = EntryCache(None, checkOptions.cacheSize)
+    watched = [
+        WatchedBib(bibFile, auxFile, checkOptions, cache) for bibFile, auxFile in pairs
+    ]
+    markupCache = {}
+    total = CheckResult()
+    frozen = False
+
+    try:
+        while True:
+            changed = [watchedBib for watchedBib in watched if watchedBib.changed()]
+            if not changed:
+                time.sleep(0.1)
+                continue
+
+            started = time.time()
+            for watchedBib in changed:
+                watchedBib.check()
+
+            total = CheckResult()
+            report = None
+            if htmlOutput and pageSize:
+                report = PagedHTMLReport(
+                    htmlOutput, len(watched) > 1, markupCache, pageSize
+                )
+            elif htmlOutput:
+                report = HTMLReport(htmlOutput, len(watched) > 1, markupCache)
+            consoleReport = None
+            if console:
+                consoleReport = ConsoleReport(
+                    maxProblems=maxProblems, summaryOnly=summaryOnly
+                )
+            for watchedBib in watched:
+                result = watchedBib.result
+                if watchedBib in changed:
+                    if consoleReport is not None:
+                        consoleReport.flush()
+                    for message in result.messages:
+                        print(message)
+                if consoleReport is not None:
+                    for entry in result.entries:
+                        consoleReport.addEntry(entry, result.bibFile)
+                if report is not None:
+                    for entry in result.entries:
+                        report.addEntry(entry)
+                total.merge(result, keepEntries=False)
+            if consoleReport is not None:
+                consoleReport.close()
+
+            if report is not None:
+                if len(watched) == 1:
+                    total.bibFile, total.auxFile = pairs[0]
+                    report.close(total)
+                else:
+                    report.close(
+                        total,
+                        [bibFile for bibFile, auxFile in pairs],
+                        [auxFile for bibFile, auxFile in pairs],
+                    )
+                markupCache = report.reportedMarkup
+                if view:
+                    import pathlib
+                    import webbrowser
+
+                    webbrowser.open(pathlib.Path(os.path.abspath(htmlOutput)).as_uri())
+                    view = False
+
+            print(
+                "INFO: Found {} problems in {:.0f} ms, watching for changes".format(
+                    total.problemCount, (time.time() - started) * 1000
+                )
+            )
+            sys.stdout.flush()
+
+            # what the first check loaded is kept for the whole session, it
+            # needn't be scanned for cycles. Only frozen once, or the garbage
+            # of later rounds would never be collected.
+            if not frozen and hasattr(gc, "freeze"):
+                gc.collect()
+                gc.freeze()
+                frozen = True
+    except KeyboardInterrupt:
+        pass
+
+    try:
+        cache.save()
+    except (IOError, OSError) as e:
+        print("WARNING: Cache '" + cache.cacheFile + "' not written: " + str(e))
+
+    if total.problemCount > 0 or total.failed:
+        return -1
+    return 0
+
+
+### Server ###
+
+# severity -> DiagnosticSeverity of the language server protocol
+diagnosticSeverities = {"error": 1, "warning": 2}
+
+
+def uriToPath(uri):
+    # file:///home/x/refs.bib -> /home/x/refs.bib, other URI's are kept
+    if not uri.startswith("file://"):
+        return uri
+    from urllib.parse import unquote, urlparse
+
+    return unquote(urlparse(uri).path)
+
+
+class LineIndex(object):
+    # Offsets of the starts of every step-th line or so of a text, so an
+    # editor's (line, character) positions are found without counting the
+    # lines before them. Edits shift the lines after them.
+    step = 64
+
+    def __init__(self, text):
+        self.lines = [0]
+        self.offsets = [0]
+        self.offset(text, text.count("\n"), 0)
+
+    def offset(self, text, line, character):
+        # The offset of a position; characters are UTF-16 code units, as
+        # editors count them
+        index = bisect.bisect_right(self.lines, line) - 1
+        lineNumber, offset = self.lines[index], self.offsets[index]
+        while lineNumber < line:
+            lineEnd = text.find("\n", offset)
+            if lineEnd < 0:
+                return len(text)
+            offset = lineEnd + 1
+            lineNumber += 1
+            if lineNumber - self.lines[index] >= self.step:
+                index += 1
+                self.lines.insert(index, lineNumber)
+                self.offsets.insert(index, offset)
+
+        lineEnd = text.find("\n", offset)
+        if lineEnd < 0:
+            lineEnd = len(text)
+        prefix = text[offset : min(lineEnd, offset + character)]
+        if len(prefix) < character or prefix and max(prefix) > u"\uffff":
+            # UTF-16 counts characters beyond U+FFFF twice
+            prefix = (
+                text[offset:lineEnd]
+                .encode("utf-16-le")[: 2 * character]
+                .decode("utf-16-le", "ignore")
+            )
+        return offset + len(prefix)
+
+    def replace(self, text, start, end, newText):
+        # Before text[start:end] is replaced by newText. Lines starting
+        # within the replaced text are dropped, those after it are shifted.
+        first = bisect.bisect_right(self.offsets, start)
+        last = bisect.bisect_right(self.offsets, end, first)
+        lineShift = newText.count("\n") - text.count("\n", start, end)
+        shift = len(newText) - (end - start)
+        self.lines[first:] = [line + lineShift for line in self.lines[last:]]
+        self.offsets[first:] = [offset + shift for offset in self.offsets[last:]]
+
+
+class BibDocument(object):
+    # A bib file open in an editor, with the text the editor has. Edits are
+    # applied to it in memory and only the entries they touch are parsed and
+    # checked again, see WatchedBib.
+
+    def __init__(self, uri, text, version, options, cache):
+        self.uri = uri
+        self.version = version
+        self.text = text
+        self.lineIndex = LineIndex(text)
+        self.watched = WatchedBib(uriToPath(uri), None, options, cache)
+        self.changed = True
+        self.checking = False  # in one of the server's threads
+        # (id, problems) -> their diagnostics as JSON, as last published
+        self.diagnosticMarkup = {}
+
+    def applyChange(self, change):
+        # A TextDocumentContentChangeEvent, the new text of a range or of all
+        if "range" not in change:
+            self.text = change["text"]
+            self.lineIndex = LineIndex(self.text)
+        else:
+            start = self.positionOffset(change["range"]["start"])
+            end = max(start, self.positionOffset(change["range"]["end"]))
+            self.lineIndex.replace(self.text, start, end, change["text"])
+            self.text = self.text[:start] + change["text"] + self.text[end:]
+        self.changed = True
+
+    def positionOffset(self, position):
+        return self.lineIndex.offset(
+            self.text, position["line"], position["character"]
+        )
+
+    def check(self, text):
+        # Run in one of the server's threads, one check at a time
+        return self.watched.checkText(text)
+
+    def generateDiagnostics(self, result, version):
+        # publishDiagnostics notification with the problems of every entry, at
+        # their first line, for the given version of the text. Entries with
+        # the same problems as in the last one reuse their JSON, wherever they
+        # moved to.
+        diagnosticMarkup = {}
+        lastMarkup = self.diagnosticMarkup
+        diagnostics = []
+        for entry in result.entries:
+            if not entry.problems:
+                continue
+            key = (entry.id, entry.problems)
+            markup = lastMarkup.get(key)
+            if markup is None:
+                markup = generateEntryDiagnostics(entry)
+            diagnosticMarkup[key] = markup
+            diagnosticRange = diagnosticRangeMarkup % (
+                entry.startLineNumber,
+                entry.startLineNumber + 1,
+            )
+            for problemMarkup in markup:
+                diagnostics.append(diagnosticRange + problemMarkup)
+        self.diagnosticMarkup = diagnosticMarkup
+        return (
+            '{"jsonrpc": "2.0", "method": "textDocument/publishDiagnostics", '
+            + '"params": {"uri": '
+            + json.dumps(self.uri)
+            + ', "version": '
+            + json.dumps(version)
+            + ', "diagnostics": ['
+            + ", ".join(diagnostics)
+            + "]}}"
+        )
+
+
+diagnosticRangeMarkup = (
+    '{"range": {"start": {"line": %d, "character": 0}, '
+    + '"end": {"line": %d, "character": 0}}, '
+)
+
+
+def generateEntryDiagnostics(entry):
+    # The diagnostic of each problem as JSON, without the opening brace and
+    # its range, which depends on where the entry is
+    return [
+        json.dumps(
+            {
+                "severity": diagnosticSeverities.get(problemRules[ruleId][0], 2),
+                "code": ruleId,
+                "source": "biblatex_check",
+                "message": entry.id + " - " + message,
+            },
+            sort_keys=True,
+        )[1:]
+        for ruleId, message in entry.problems
+    ]
+
+
+class CheckProtocol(object):
+    # One client of serveChecks, as an asyncio protocol: JSON-RPC messages
+    # with Content-Length headers, as in the language server protocol. The
+    # client opens bib files with textDocument/didOpen and sends its edits
+    # with textDocument/didChange, the problems come back as
+    # textDocument/publishDiagnostics. All messages that arrived together are
+    # handled before the documents they changed are checked, once each. The
+    # checks run in the loop's threads, so the other clients are served
+    # meanwhile.
+
+    def __init__(self, server, writeMessage=None):
+        self.server = server
+        self.writeMessage = writeMessage
+        self.transport = None
+        self.buffer = b""
+        self.documents = {}  # uri -> BibDocument
+        self.methods = {
+            "initialize": self.initialize,
+            "shutdown": self.shutdown,
+            "exit": self.exit,
+            "textDocument/didOpen": self.didOpen,
+            "textDocument/didChange": self.didChange,
+            "textDocument/didClose": self.didClose,
+        }
+
+    def connection_made(self, transport):
+        self.transport = transport
+        if self.writeMessage is None:
+            self.writeMessage = transport.write
+
+    def data_received(self, data):
+        self.buffer += data
+        while True:
+            headerEnd = self.buffer.find(b"\r\n\r\n")
+            if headerEnd < 0:
+                break
+            length = None
+            for header in self.buffer[:headerEnd].split(b"\r\n"):
+                name, _, value = header.partition(b":")
+                if name.strip().lower() == b"content-length":
+                    try:
+                        length = int(value)
+                    except ValueError:
+                        length = -1
+            if length is not None and length < 0:
+                # the messages after it can't be told apart, drop the client
+                self.server.log("WARNING: Bad Content-Length, closing the connection")
+                self.buffer = b""
+                self.transport.close()
+                return
+            bodyStart = headerEnd + 4
+            if length is None:
+                # not a message, skip the headers
+                self.buffer = self.buffer[bodyStart:]
+                continue
+            if len(self.buffer) < bodyStart + length:
+                break
+            body = self.buffer[bodyStart : bodyStart + length]
+            self.buffer = self.buffer[bodyStart + length :]
+            self.handleMessage(body)
+        self.checkDocuments()
+
+    def checkDocuments(self):
+        # Check the documents changed since they were last checked. A document
+        # being checked is checked again once done, if it was edited meanwhile.
+        for document in list(self.documents.values()):
+            if document.changed and not document.checking:
+                self.startCheck(document)
+
+    def startCheck(self, document):
+        document.changed = False
+        document.checking = True
+        version = document.version
+        started = time.time()
+
+        def checked(future):
+            document.checking = False
+            if self.documents.get(document.uri) is not document:
+                # closed meanwhile
+                return
+            result = future.result()
+            self.send(document.generateDiagnostics(result, version))
+            self.server.log(
+                "INFO: Found {} problems in '{}' in {:.0f} ms".format(
+                    result.problemCount,
+                    document.uri,
+                    (time.time() - started) * 1000,
+                )
+            )
+            self.checkDocuments()
+
+        future = self.server.loop.run_in_executor(None, document.check, document.text)
+        future.add_done_callback(checked)
+
+    def eof_received(self):
+        return False
+
+    def connection_lost(self, exc):
+        self.documents = {}
+        self.server.clientClosed(self)
+
+    def send(self, body):
+        body = body.encode("utf8")
+        self.writeMessage(
+            b"Content-Length: " + str(len(body)).encode("ascii") + b"\r\n\r\n" + body
+        )
+
+    def respond(self, messageId, result=None, error=None):
+        message = {"jsonrpc": "2.0", "id": messageId}
+        if error is not None:
+            message["error"] = error
+        else:
+            message["result"] = result
+        self.send(json.dumps(message))
+
+    def handleMessage(self, body):
+        try:
+            message = json.loads(body.decode("utf8"))
+            method = message["method"]
+        except (ValueError, KeyError, TypeError):
+            self.respond(None, error={"code": -32700, "message": "Parse error"})
+            return
+        params = message.get("params") or {}
+        handler = self.methods.get(method)
+        if handler is None:
+            if "id" in message:
+                self.respond(
+                    message["id"],
+                    error={"code": -32601, "message": "Unknown method " + method},
+                )
+            return
+        try:
+            result = handler(params)
+        except (KeyError, TypeError, ValueError) as e:
+            if "id" in message:
+                self.respond(
+                    message["id"], error={"code": -32602, "message": str(e)}
+                )
+            else:
+                self.server.log("WARNING: " + method + " not handled: " + str(e))
+            return
+        if "id" in message:
+            self.respond(message["id"], result)
+
+    def initialize(self, params):
+        return {
+            "capabilities": {
+                # open and close notifications, incremental changes
+                "textDocumentSync": {"openClose": True, "change": 2}
+            },
+            "serverInfo": {"name": "biblatex_check"},
+        }
+
+    def shutdown(self, params):
+        return None
+
+    def exit(self, params):
+        if self.transport is not None:
+            self.transport.close()
+
+    def didOpen(self, params):
+        textDocument = params["textDocument"]
+        self.documents[textDocument["uri"]] = BibDocument(
+            textDocument["uri"],
+            textDocument["text"],
+            textDocument.get("version"),
+            self.server.options,
+            self.server.cache,
+        )
+
+    def didChange(self, params):
+        document = self.documents[params["textDocument"]["uri"]]
+        document.version = params["textDocument"].get("version")
+        for change in params["contentChanges"]:
+            document.applyChange(change)
+
+    def didClose(self, params):
+        uri = params["textDocument"]["uri"]
+        if self.documents.pop(uri, None) is not None:
+            self.send(
+                json.dumps(
+                    {
+                        "jsonrpc": "2.0",
+                        "method": "textDocument/publishDiagnostics",
+                        "params": {"uri": uri, "diagnostics": []},
+                    }
+                )
+            )
+
+
+class CheckServer(object):
+    # Serves CheckProtocol clients from one process, sharing the options and
+    # the cache of entry problems; see serveChecks
+
+    def __init__(self, options, loop, stopWhenClosed=False):
+        self.options = options
+        self.loop = loop
+        self.stopWhenClosed = stopWhenClosed
+        self.stopped = False
+        if options.cacheFile:
+            self.cache = openEntryCache(options)
+        else:
+            self.cache = EntryCache(None, options.cacheSize)
+        self.clients = set()
+
+    def protocol(self, writeMessage=None):
+        client = CheckProtocol(self, writeMessage)
+        self.clients.add(client)
+        return client
+
+    def clientClosed(self, client):
+        self.clients.discard(client)
+        if self.stopWhenClosed:
+            # maybe before the loop is run for good, see serveChecks
+            self.stopped = True
+            self.loop.stop()
+
+    def log(self, message):
+        # stdout may be the protocol's, messages go to stderr
+        sys.stderr.write(message + "\n")
+        sys.stderr.flush()
+
+
+def serveChecks(checkOptions, socketPath=None):
+    # Check the bib files an editor sends over stdin/stdout, or over a Unix
+    # socket any number of editors connect to, until stopped (Ctrl-C) or the
+    # stdio client exits. Python 3 only, for asyncio.
+    try:
+        import asyncio
+    except ImportError:
+        sys.stderr.write("ERROR: Serving checks needs Python 3\n")
+        return -1
+
+    import stat
+
+    # only a socket left by an earlier server is replaced
+    if socketPath is not None and os.path.exists(socketPath):
+        if not stat.S_ISSOCK(os.stat(socketPath).st_mode):
+            sys.stderr.write(
+                "ERROR: '" + socketPath + "' exists and is not a socket\n"
+            )
+            return -1
+        os.remove(socketPath)
+
+    loop = asyncio.new_event_loop()
+    server = CheckServer(checkOptions, loop, stopWhenClosed=socketPath is None)
+    if socketPath is None:
+        stdout = sys.stdout.buffer
+
+        def writeMessage(data):
+            stdout.write(data)
+            stdout.flush()
+
+        loop.run_until_complete(
+            loop.connect_read_pipe(lambda: server.protocol(writeMessage), sys.stdin)
+        )
+        server.log("INFO: Serving checks on stdin/stdout")
+    else:
+        listener = loop.run_until_complete(
+            loop.create_unix_server(server.protocol, socketPath)
+        )
+        server.log("INFO: Serving checks on '" + socketPath + "'")
+
+    try:
+        # stop as on Ctrl-C, removing the socket and saving the cache
+        import signal
+
+        loop.add_signal_handler(signal.SIGTERM, loop.stop)
+    except (NotImplementedError, AttributeError):
+        pass
+    try:
+        if not server.stopped:
+            loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if socketPath is not None:
+            listener.close()
+            if os.path.exists(socketPath) and stat.S_ISSOCK(
+                os.stat(socketPath).st_mode
+            ):
+                os.remove(socketPath)
+        loop.close()
+
+    try:
+        server.cache.save()
+    except (IOError, OSError) as e:
+        server.log(
+            "WARNING: Cache '" + server.cache.cacheFile + "' not written: " + str(e)
+        )
+    return 0
+
+
+### Command line ###
+
+
+def writeStats(options, stats, elapsed, profiler, printMessage):
+    # --stats, --stats-file and --profile output at the end of a run
+    if options.stats:
+        printMessage("INFO: Stats, the phases of workers are added up")
+        for line in stats.summary(elapsed):
+            printMessage(("  " + line).rstrip())
+    if options.statsFile:
+        fOut = open(options.statsFile, "w", encoding="utf8")
+        fOut.write(json.dumps(stats.toDict(elapsed), indent=2, sort_keys=True) + "\n")
+        fOut.close()
+        printMessage("INFO: Stats written to '" + options.statsFile + "'")
+    if profiler is not None:
+        profiler.dump_stats(options.profileFile)
+        printMessage(
+            "INFO: Profile written to '"
+            + options.profileFile
+            + "', see python -m pstats "
+            + options.profileFile
+        )
+
+
+def main(argv=None):
+    usage = (
+        sys.argv[0]
+        + " [-b|--bib=<input.bib>] [-a|--aux=<input.aux>] [-o|--output=<output.html>] [-v|--view] [-h|--help]"
+        + " [--paged] [--page-size=<N>]"
+        + " [-N|--no-console] [--max-problems=<N>] [--summary] [-q|--quiet]"
+        + " [--fail-fast|--fail-after=<N>] [--sample=<rate>] [--stop-after-cited]"
+        + " [--changed-since=<rev>|--changed-diff=<file.diff>]"
+        + " [-j|--jobs=<N>] [-m|--manifest=<manifest.txt>] [--cache=<file>|--no-cache] [-w|--watch]"
+        + " [--serve|--serve-socket=<path>] [--fix|--fix-dry-run] [--fix-diff]"
+        + " [--format=<jsonl|sarif|junit>] [--stats] [--profile=<file.prof>]"
+        + " [--enable-rule=<rule>] [--disable-rule=<rule>] [--rules-module=<module>]"
+        + " [--rules-config=<rules.txt>] [--list-rules]"
+        + " [<file.bib|directory|glob> ...]"
+    )
+
+    parser = OptionParser(usage)
+
+    parser.add_option(
+        "-b",
+        "--bib",
+        dest="bibFile",
+        help="Bib File",
+        metavar="input.bib",
+    )
+
+    parser.add_option(
+        "-a",
+        "--aux",
+        dest="auxFile",
+        help="Aux File(s) or biber .bcf files, separated by ','",
+        metavar="input.aux",
+        default="references.aux",
+    )
+
+    parser.add_option(
+        "-o", "--output", dest="htmlOutput", help="HTML Output File", metavar="output.html"
+    )
+
+    parser.add_option(
+        "-v", "--view", dest="view", action="store_true", help="Open in Browser"
+    )
+
+    parser.add_option(
+        "--paged",
+        dest="paged",
+        action="store_true",
+        help="Write an HTML report showing a page of entries at a time, for very many",
+    )
+
+    parser.add_option(
+        "--page-size",
+        dest="pageSize",
+        type="int",
+        default=100,
+        help="Entries per page of the --paged report (100 by default)",
+        metavar="N",
+    )
+
+    parser.add_option(
+        "-N",
+        "--no-console",
+        dest="no_console",
+        action="store_true",
+        help="Do not print problems to console",
+    )
+
+    parser.add_option(
+        "--max-problems",
+        dest="maxProblems",
+        type="int",
+        help="Print only the first N problems to console, then a summary per rule",
+        metavar="N",
+    )
+
+    parser.add_option(
+        "--summary",
+        dest="summaryOnly",
+        action="store_true",
+        help="Print the number of problems per rule to console instead of each problem",
+    )
+
+    parser.add_option(
+        "-q",
+        "--quiet",
+        dest="quiet",
+        action="store_true",
+        help="Print nothing, stop at the first problem; only the exit code tells",
+    )
+
+    parser.add_option(
+        "--fail-fast",
+        dest="failAfter",
+        action="store_const",
+        const=1,
+        help="Stop checking at the first problem",
+    )
+
+    parser.add_option(
+        "--fail-after",
+        dest="failAfter",
+        type="int",
+        help="Stop checking after N problems",
+        metavar="N",
+    )
+
+    parser.add_option(
+        "--sample",
+        dest="sampleRate",
+        type="float",
+        help="Check only this fraction (0 to 1) of the entries, the same ones each run",
+        metavar="RATE",
+    )
+
+    parser.add_option(
+        "--stop-after-cited",
+        dest="stopAfterCited",
+        action="store_true",
+        default=False,
+        help="Stop reading a bib file once every entry cited in the aux file is found",
+    )
+
+    parser.add_option(
+        "--changed-since",
+        dest="changedSince",
+        help="Check only the entries changed since this git revision",
+        metavar="REV",
+    )
+
+    parser.add_option(
+        "--changed-diff",
+        dest="changedDiff",
+        help="Check only the entries changed by this unified diff, '-' reads stdin",
+        metavar="file.diff",
+    )
+
+    parser.add_option(
+        "-I",
+        "--case-insensitive-ids",
+        dest="caseInsensitiveIds",
+        action="store_true",
+        default=False,
+        help="Treat reference ID's differing only in case as duplicates, like biber",
+    )
+
+    parser.add_option(
+        "-m",
+        "--manifest",
+        dest="manifest",
+        help="File listing 'input.bib [input.aux]' pairs to check, one per line",
+        metavar="manifest.txt",
+    )
+
+    parser.add_option(
+        "-j",
+        "--jobs",
+        dest="jobs",
+        type="int",
+        default=1,
+        help="Number of worker processes, 0 for one per CPU. A single bib file is split into chunks of entries",
+        metavar="N",
+    )
+
+    parser.add_option(
+        "--cache",
+        dest="cacheFile",
+        help="Reuse the problems of unchanged entries from this file (default: "
+        + defaultCacheFile()
+        + ")",
+        metavar="file",
+        default=defaultCacheFile(),
+    )
+
+    parser.add_option(
+        "--no-cache",
+        dest="cacheFile",
+        action="store_const",
+        const=None,
+        help="Check every entry again, without reading or writing the cache",
+    )
+
+    parser.add_option(
+        "--cache-size",
+        dest="cacheSize",
+        type="int",
+        default=CheckOptions.defaults["cacheSize"],
+        help="Number of entries kept in the cache, the least recently used are dropped",
+        metavar="N",
+    )
+
+    parser.add_option(
+        "-w",
+        "--watch",
+        dest="watch",
+        action="store_true",
+        help="Check again whenever a bib file changes, until interrupted with Ctrl-C",
+    )
+
+    parser.add_option(
+        "--fix",
+        dest="fix",
+        action="store_true",
+        help="Fix missing commas, BibTeX field names and entry types in the bib files",
+    )
+
+    parser.add_option(
+        "--fix-dry-run",
+        dest="fixDryRun",
+        action="store_true",
+        help="Count what --fix would fix, without changing the bib files",
+    )
+
+    parser.add_option(
+        "--fix-diff",
+        dest="fixDiff",
+        action="store_true",
+        help="Print what --fix (or --fix-dry-run) changes as a unified diff",
+    )
+
+    parser.add_option(
+        "--serve",
+        dest="serve",
+        action="store_true",
+        help="Check the bib files an editor sends over stdin/stdout (language server protocol)",
+    )
+
+    parser.add_option(
+        "--serve-socket",
+        dest="serveSocket",
+        help="Like --serve, for any number of editors connecting to this Unix socket",
+        metavar="path",
+    )
+
+    parser.add_option(
+        "--format",
+        dest="format",
+        type="choice",
+        choices=sorted(reportFormats),
+        help="Also write the problems as " + "/".join(sorted(reportFormats)),
+        metavar="FORMAT",
+    )
+
+    parser.add_option(
+        "--format-output",
+        dest="formatOutput",
+        default="-",
+        help="File for the --format report (default: stdout)",
+        metavar="file",
+    )
+
+    parser.add_option(
+        "--no-mmap",
+        dest="mmapInput",
+        action="store_false",
+        default=True,
+        help="Read bib files line by line instead of memory mapping them",
+    )
+
+    parser.add_option(
+        "--stats",
+        dest="stats",
+        action="store_true",
+        help="Print where the time went: per phase, check and rule",
+    )
+
+    parser.add_option(
+        "--stats-file",
+        dest="statsFile",
+        help="Write the --stats figures to a JSON file",
+        metavar="stats.json",
+    )
+
+    parser.add_option(
+        "--profile",
+        dest="profileFile",
+        help="Write a cProfile dump of reading, parsing and checking (see pstats)",
+        metavar="file.prof",
+    )
+
+    parser.add_option(
+        "--enable-rule",
+        dest="enabledRules",
+        action="append",
+        default=[],
+        help="Also check this rule (e.g. title-capitalization), may be repeated or comma separated",
+        metavar="rule",
+    )
+
+    parser.add_option(
+        "--disable-rule",
+        dest="disabledRules",
+        action="append",
+        default=[],
+        help="Don't check this rule, may be repeated or comma separated",
+        metavar="rule",
+    )
+
+    parser.add_option(
+        "--rules-module",
+        dest="ruleModules",
+        action="append",
+        default=[],
+        help="Load more rules from a Python module or .py file, may be repeated",
+        metavar="module",
+    )
+
+    parser.add_option(
+        "--rules-config",
+        dest="rulesConfig",
+        help="File of '<rule> on', '<rule> off' and 'import <module>' lines",
+        metavar="rules.txt",
+    )
+
+    parser.add_option(
+        "--list-rules",
+        dest="listRules",
+        action="store_true",
+        help="List the rules and whether they are checked, then exit",
+    )
+
+    (options, args) = parser.parse_args(argv)
+
+    ### Handle Args ###
+
+    global checkProfiler
+    started = time.time()
+    collectStats = bool(options.stats or options.statsFile or options.profileFile)
+
+    # with the --format report (or the --serve protocol, or the --fix-diff
+    # diff) on stdout, everything else goes to stderr
+    messageStream = sys.stdout
+    if options.format and options.formatOutput == "-":
+        messageStream = sys.stderr
+    if options.serve or options.fixDiff:
+        messageStream = sys.stderr
+
+    def printMessage(message):
+        # only errors get through --quiet
+        if options.quiet and not message.startswith("ERROR:"):
+            return
+        messageStream.write(message + "\n")
+
+    # the rules config first, so the command line can override it
+    enabledRules, disabledRules, ruleModules = [], [], []
+    if options.rulesConfig:
+        try:
+            enabledRules, disabledRules, ruleModules = readRulesConfig(
+                options.rulesConfig
+            )
+        except (IOError, ValueError) as e:
+            printMessage(
+                "ERROR: Rules config '"
+                + options.rulesConfig
+                + "' is not readable: "
+                + str(e)
+            )
+            return -1
+    for ruleIds, extraRuleIds, otherRuleIds in (
+        (enabledRules, options.enabledRules, disabledRules),
+        (disabledRules, options.disabledRules, enabledRules),
+    ):
+        for ruleId in ",".join(extraRuleIds).split(","):
+            if ruleId:
+                ruleIds.append(ruleId)
+                if ruleId in otherRuleIds:
+                    otherRuleIds.remove(ruleId)
+    ruleModules.extend(options.ruleModules)
+
+    checkOptions = CheckOptions(
+        caseInsensitiveIds=options.caseInsensitiveIds,
+        cacheFile=options.cacheFile,
+        cacheSize=options.cacheSize,
+        collectStats=collectStats,
+        mmapInput=options.mmapInput,
+        enabledRules=tuple(enabledRules),
+        disabledRules=tuple(disabledRules),
+        ruleModules=tuple(ruleModules),
+        sampleRate=options.sampleRate,
+        stopAfterCited=options.stopAfterCited,
+    )
+    try:
+        checkedRules = enabledRuleIds(checkOptions)
+    except (ImportError, ValueError) as e:
+        printMessage("ERROR: Rules not loaded: " + str(e))
+        return -1
+
+    if options.listRules:
+        for ruleId, (severity, description) in sorted(problemRules.items()):
+            print(
+                "{:<24} {:<8} {:<4} {}".format(
+                    ruleId,
+                    severity,
+                    "on" if ruleId in checkedRules else "off",
+                    description,
+                )
+            )
+        return 0
+
+    if options.serve or options.serveSocket:
+        if options.watch or options.format or collectStats:
+            printMessage(
+                "ERROR: --watch, --format, --stats and --profile can't be combined"
+                " with --serve"
+            )
+            return -1
+        return serveChecks(checkOptions, options.serveSocket)
+
+    # Bib files given as -b, directories/globs and manifest entries
+    pairs = []
+    if options.bibFile:
+        pairs.append((options.bibFile, options.auxFile))
+    for arg in args:
+        bibFiles = findBibFiles([arg])
+        if not bibFiles:
+            printMessage("ERROR: No bib files found in '" + arg + "'")
+            return -1
+        pairs.extend((bibFile, options.auxFile) for bibFile in bibFiles)
+    if options.manifest:
+        try:
+            pairs.extend(readManifest(options.manifest))
+        except (IOError, ValueError) as e:
+            printMessage(
+                "ERROR: Manifest '"
+                + options.manifest
+                + "' is not readable: "
+                + str(e)
+            )
+            return -1
+    if not pairs:
+        if options.bibFile or args or options.manifest:
+            printMessage("ERROR: No bib files to check")
+            return -1
+        pairs.append(("input.bib", options.auxFile))
+
+    if options.fix or options.fixDryRun:
+        return fixBibFiles(
+            [bibFile for bibFile, auxFile in pairs],
+            options.fixDryRun,
+            sys.stdout if options.fixDiff else None,
+            printMessage,
+        )
+
+    if options.changedSince or options.changedDiff:
+        if options.watch:
+            printMessage(
+                "ERROR: --changed-since and --changed-diff can't be combined with --watch"
+            )
+            return -1
+        try:
+            checkOptions.changedLines = changedLineRanges(
+                [bibFile for bibFile, auxFile in pairs],
+                options.changedSince,
+                options.changedDiff,
+            )
+        except (IOError, OSError, subprocess.CalledProcessError) as e:
+            printMessage("ERROR: Changed lines not found: " + str(e))
+            return -1
+        changedPairs = [
+            (bibFile, auxFile)
+            for bibFile, auxFile in pairs
+            if bibFile in checkOptions.changedLines
+        ]
+        printMessage(
+            "INFO: Checking the changed entries of {} of {} bib file(s)".format(
+                len(changedPairs), len(pairs)
+            )
+        )
+        if not changedPairs:
+            return 0
+        pairs = changedPairs
+
+    jobs = [(bibFile, auxFile, checkOptions) for bibFile, auxFile in pairs]
+
+    workers = options.jobs
+    if workers <= 0:
+        import multiprocessing
+
+        workers = multiprocessing.cpu_count()
+
+    if len(jobs) > 1:
+        printMessage(
+            "INFO: Checking {} bib files with {} worker(s)".format(
+                len(jobs), min(workers, len(jobs))
+            )
+        )
+    elif workers > 1:
+        printMessage("INFO: Checking entries with {} workers".format(workers))
+
+    if options.profileFile and workers > 1:
+        printMessage("INFO: Profiling checks in this process only, without workers")
+        workers = 1
+
+    # the exit code is known once failAfter problems are found
+    failAfter = options.failAfter
+    if options.quiet and failAfter is None:
+        failAfter = 1
+    if failAfter is not None:
+        if options.htmlOutput or options.format or options.watch or collectStats:
+            printMessage(
+                "ERROR: -o, --format, --watch, --stats and --profile can't be"
+                " combined with --quiet, --fail-fast or --fail-after"
+            )
+            return -1
+        if failAfter < 1:
+            printMessage("ERROR: --fail-after has to be at least 1")
+            return -1
+        printMessage("INFO: Will stop after {} problem(s)".format(failAfter))
+
+    if options.sampleRate is not None:
+        if not 0 < options.sampleRate <= 1:
+            printMessage("ERROR: --sample has to be more than 0 and at most 1")
+            return -1
+        printMessage(
+            "INFO: Will check a sample of {:.1%} of the entries".format(
+                options.sampleRate
+            )
+        )
+
+    if options.stopAfterCited:
+        if options.watch:
+            printMessage("ERROR: --stop-after-cited can't be combined with --watch")
+            return -1
+        if workers > 1 and len(jobs) == 1:
+            # the split into chunks reads the whole file
+            printMessage("INFO: Checking entries in this process, without workers")
+            workers = 1
+
+    if checkOptions.changedLines is not None and workers > 1 and len(jobs) == 1:
+        # iterChangedBibEntries needs every entry of the file in one process
+        printMessage("INFO: Checking entries in this process, without workers")
+        workers = 1
+
+    if options.no_console:
+        printMessage("INFO: Will suppress problems on console")
+    elif options.summaryOnly:
+        printMessage("INFO: Will print the number of problems per rule")
+    elif options.maxProblems is not None:
+        if options.maxProblems < 0:
+            printMessage("ERROR: --max-problems can't be negative")
+            return -1
+        printMessage(
+            "INFO: Will print the first {} problems".format(options.maxProblems)
+        )
+
+    cache = None
+    if checkOptions.cacheFile:
+        printMessage(
+            "INFO: Will reuse unchanged entries from '" + checkOptions.cacheFile + "'"
+        )
+        cache = openEntryCache(checkOptions)
+
+    if options.htmlOutput:
+        printMessage(
+            "INFO: Will output HTML to '"
+            + options.htmlOutput
+            + "'"
+            + (" and auto open in the default web browser" if options.view else "")
+        )
+        if options.paged:
+            if options.pageSize < 1:
+                printMessage("ERROR: --page-size has to be at least 1")
+                return -1
+            printMessage(
+                "INFO: Will show {} entries per page, from '{}'".format(
+                    options.pageSize,
+                    os.path.splitext(options.htmlOutput)[0] + "_files",
+                )
+            )
+
+    if options.format:
+        printMessage(
+            "INFO: Will write a "
+            + options.format
+            + " report to "
+            + (
+                "stdout"
+                if options.formatOutput == "-"
+                else "'" + options.formatOutput + "'"
+            )
+        )
+
+    if options.watch:
+        if options.format or collectStats:
+            printMessage(
+                "ERROR: --format, --stats and --profile can't be combined with --watch"
+            )
+            return -1
+        # serially, each change only needs the changed entries checked
+        return watchBibFiles(
+            pairs,
+            checkOptions,
+            options.htmlOutput,
+            not options.no_console,
+            options.view,
+            options.pageSize if options.paged else None,
+            options.maxProblems,
+            options.summaryOnly,
+        )
+
+    ### Parse input files ###
+
+    # Entries are reported as they are checked rather than kept until the end
+    report = None
+    if options.htmlOutput and options.paged:
+        report = PagedHTMLReport(
+            options.htmlOutput, len(jobs) > 1, pageSize=options.pageSize
+        )
+    elif options.htmlOutput:
+        report = HTMLReport(options.htmlOutput, len(jobs) > 1)
+    formatReport = None
+    if options.format:
+        formatReport = reportFormats[options.format](options.formatOutput)
+    consoleReport = None
+    if not options.no_console and not options.quiet:
+        consoleReport = ConsoleReport(
+            maxProblems=options.maxProblems, summaryOnly=options.summaryOnly
+        )
+
+    # the checks time themselves into their results, reporting is timed here
+    mainStats = CheckStats() if collectStats else None
+    if options.profileFile:
+        import cProfile
+
+        checkProfiler = cProfile.Profile()
+
+    def printMessages(result):
+        if result.messages and consoleReport is not None:
+            # keep them in order with the problems before them
+            consoleReport.flush()
+        for message in result.messages:
+            printMessage(message)
+        del result.messages[:]
+
+    countedProblems = [0]
+
+    def reportEntry(result, entry):
+        if mainStats is not None:
+            mainStats.enter("report")
+        printMessages(result)
+        if consoleReport is not None:
+            consoleReport.addEntry(entry, result.bibFile)
+        if report is not None:
+            report.addEntry(entry)
+        if formatReport is not None:
+            formatReport.addEntry(entry)
+        if mainStats is not None:
+            mainStats.leave()
+        if failAfter is not None:
+            for ruleId, message in entry.problems:
+                if problemCounterName(ruleId) is not None:
+                    countedProblems[0] += 1
+            if countedProblems[0] >= failAfter:
+                raise StopChecking()
+
+    total = CheckResult()
+    try:
+        for result in runCheckJobs(jobs, workers, reportEntry):
+            printMessages(result)
+            if failAfter is not None and result.failed:
+                raise StopChecking()
+            if cache is not None:
+                cache.update(result)
+            total.merge(result)
+    except StopChecking:
+        if consoleReport is not None:
+            consoleReport.close()
+        if countedProblems[0]:
+            printMessage(
+                "WARNING: Stopped checking at {} problems.".format(countedProblems[0])
+            )
+        return -1
+    if consoleReport is not None:
+        consoleReport.close()
+
+    profiler, checkProfiler = checkProfiler, None
+
+    if cache is not None:
+        if mainStats is not None:
+            mainStats.enter("cache")
+        try:
+            cache.save()
+        except (IOError, OSError) as e:
+            printMessage(
+                "WARNING: Cache '" + cache.cacheFile + "' not written: " + str(e)
+            )
+        if mainStats is not None:
+            mainStats.leave()
+
+    if len(jobs) == 1:
+        total.bibFile, total.auxFile = pairs[0]
+
+    if mainStats is not None:
+        mainStats.enter("report")
+    if formatReport is not None:
+        formatReport.close(total)
+
+    # Write out our HTML file
+    if report is not None:
+        if len(jobs) == 1:
+            htmlName = report.close(total)
+        else:
+            htmlName = report.close(
+                total,
+                [bibFile for bibFile, auxFile in pairs],
+                [auxFile for bibFile, auxFile in pairs],
+            )
+    if mainStats is not None:
+        mainStats.leave()
+        stats = total.stats or CheckStats()
+        stats.merge(mainStats)
+        writeStats(options, stats, time.time() - started, profiler, printMessage)
+
+    if report is not None:
+
+        if options.view:
+            import pathlib
+            import webbrowser
+
+            webbrowser.open(pathlib.Path(os.path.abspath(htmlName)).as_uri())
+
+        printMessage("SUCCESS: Report {} has been generated".format(options.htmlOutput))
+
+    if total.problemCount > 0:
+        printMessage("WARNING: Found {} problems.".format(total.problemCount))
+        return -1
+
+    if total.failed:
+        return -1
 
-        webbrowser.open(pathlib.Path(os.path.abspath(html.name)).as_uri())
+    return 0
 
-    print("SUCCESS: Report {} has been generated".format(options.htmlOutput))
 
-if problemCount > 0:
-    print("WARNING: Found {} problems.".format(problemCount))
-    sys.exit(-1)
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,40 @@
+import os
+import sys
+import unittest
+
+testsDir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(testsDir))
+
+import biblatex_check  # noqa: E402
+
+
+class EntryCacheTest(unittest.TestCase):
+    # The cache of --watch and --serve is only saved at exit, it must keep to
+    # its size while they run
+
+    def update(self, cache, hits=(), updates=()):
+        result = biblatex_check.CheckResult()
+        result.cacheHits = list(hits)
+        result.cacheUpdates = dict((digest, digest) for digest in updates)
+        cache.update(result)
+
+    def testEvictsWhileRunning(self):
+        cache = biblatex_check.EntryCache(None, 16)
+        self.update(cache, updates=range(16))
+        self.assertEqual(len(cache.entries), 16)
+        # the entries used again in a later round outlive those that weren't
+        self.update(cache, hits=range(8))
+        self.update(cache, updates=[16])
+        self.assertEqual(len(cache.entries), 14)
+        for digest in range(8):
+            self.assertEqual(cache.get(digest), digest)
+        self.assertEqual(cache.get(16), 16)
+        self.assertEqual(sum(cache.get(digest) is not None for digest in range(16)), 13)
+        for index in range(100):
+            self.update(cache, updates=[17 + index])
+            self.assertTrue(len(cache.entries) <= 16)
+        self.assertEqual(cache.get(116), 116)
+
+
+if __name__ == "__main__":
+    unittest.main()
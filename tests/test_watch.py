@@ -0,0 +1,71 @@
+import io
+import os
+import sys
+import unittest
+
+testsDir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(testsDir))
+
+import biblatex_check  # noqa: E402
+
+
+def summarize(result):
+    return (
+        [
+            (entry.id, entry.startLineNumber, entry.lineNumber, entry.problems)
+            for entry in result.entries
+        ],
+        biblatex_check.CheckResult.getCounters(result),
+    )
+
+
+class WatchedBibTest(unittest.TestCase):
+    # Edits checked again piecewise by WatchedBib (--watch, --serve) must
+    # give what checking the edited file afresh does
+
+    def setUp(self):
+        fIn = io.open(os.path.join(testsDir, "input.bib"), encoding="utf8")
+        try:
+            self.text = fIn.read()
+        finally:
+            fIn.close()
+        self.options = biblatex_check.CheckOptions()
+        self.watched = biblatex_check.WatchedBib(
+            "input.bib", None, self.options, biblatex_check.EntryCache(None)
+        )
+        self.watched.checkText(self.text)
+
+    def edit(self, old, new, after=None):
+        # Replaces the first old (after the first after) and checks again
+        start = self.text.index(after) if after is not None else 0
+        pos = self.text.index(old, start)
+        self.text = self.text[:pos] + new + self.text[pos + len(old) :]
+        result = self.watched.checkText(self.text)
+        fresh = biblatex_check.Checker(None, self.options).check(
+            io.StringIO(self.text), "input.bib"
+        )
+        self.assertEqual(summarize(result), summarize(fresh))
+
+    def testEdits(self):
+        # a comment merged into an entry's header line
+        self.edit("missing\n@book{lamport1986latex", "missing @book{lamport1986latex")
+        # an entry no longer closed, and closed again
+        self.edit("1986}\n}", "1986}\n")
+        self.edit("1986}\n", "1986}\n}")
+        # a comment left open takes the next entries along, and a stray brace
+        # before it moves where the file is cut in blocks
+        self.edit("% no errors", "% no @comment{errors")
+        self.edit("firstname')\n@report", "firstname')}\n@report")
+        self.edit("Algebraic", "Al(gebraic")
+        self.edit("firstname')}", "firstname')")
+        self.edit("@comment{errors", "errors")
+        # an entry opened by a parenthesis, and one added in between
+        self.edit("% year/date missing", "@misc(p,\n  title={T}\n)\n")
+        self.edit("\n\n", "\n@misc{new,\n  title={T},\n  year={1}\n}\n\n", "Elephants")
+        # a duplicate ID taken away and back
+        self.edit("@misc{doe2020twice,", "@misc{doe2020once,")
+        self.edit("@misc{doe2020once,", "@misc{doe2020twice,")
+
+
+if __name__ == "__main__":
+    unittest.main()